@@ -15,13 +15,28 @@
 # You should have received a copy of the GNU General Public License
 # along with pymindaffectBCI.  If not, see <http://www.gnu.org/licenses/>
 
-from mindaffectBCI.decoder.offline.read_mindaffectBCI import read_mindaffectBCI_message
-from mindaffectBCI.utopiaclient import DataPacket
-from time import sleep
+from mindaffectBCI.decoder.offline.read_mindaffectBCI import iter_mindaffectBCI_message_chunks
+from mindaffectBCI.utopiaclient import DataPacket, DataHeader
+from collections import deque
+from time import sleep, perf_counter
+import threading
+import queue
 
 class FileProxyHub:
     ''' Proxy UtopiaClient which gets messages from a saved log file '''
-    def __init__(self, filename:str=None, speedup:float=None, use_server_ts:bool=True):
+    def __init__(self, filename:str=None, speedup:float=None, use_server_ts:bool=True, fast:bool=False,
+                 readahead:int=16, chunksize:int=1<<20, report_interval_s:float=10):
+        """Proxy UtopiaClient which gets messages from a saved log file
+
+        Args:
+            filename (str, optional): the save file to replay, text or binary log format. Defaults to None, i.e. the most recent log file.
+            speedup (float, optional): real-time replay speed-up factor, None means don't throttle. Defaults to None.
+            use_server_ts (bool, optional): re-write the message time-stamps to the server time-stamps. Defaults to True.
+            fast (bool, optional): as-fast-as-possible replay, where the clock is driven by the message time-stamps, with no sleeping and skipping over any gaps in the log. Defaults to False.
+            readahead (int, optional): max number of message blocks to pre-read in the background reader thread. Defaults to 16.
+            chunksize (int, optional): size of the blocks the log file is read in. Defaults to 1M.
+            report_interval_s (float, optional): interval in wall-clock seconds between replay throughput reports in fast mode. Defaults to 10.
+        """
         self.filename = filename
         import glob
         import os
@@ -34,17 +49,56 @@ class FileProxyHub:
             self.filename = max(files, key=os.path.getctime)
         print("Loading : {}\n".format(self.filename))
         self.speedup = speedup
+        self.fast = fast
         self.isConnected = True
+        self.eof = False # True when all the messages have been replayed
+        self._readdone = False
         self.lasttimestamp = None
         self.use_server_ts = use_server_ts
-        self.file = open(self.filename,'r')
-    
+        self.report_interval_s = report_interval_s
+        self.pending = deque()
+        self.nmsgs, self.nsamp = 0, 0
+        self.wall_t0, self.data_t0, self.last_report = None, None, None
+        # start the background reader, with bounded queue to limit the memory use
+        self.queue = queue.Queue(maxsize=readahead)
+        self.reader = threading.Thread(target=self._read_messages, args=(chunksize,), daemon=True)
+        self.reader.start()
+
+    def _read_messages(self, chunksize:int):
+        """background reader thread, which parses the log in blocks and puts them into the read-ahead queue"""
+        from mindaffectBCI.decoder.offline.mindaffectBCI_binlog import is_binary_log, BinaryLogReader
+        try:
+            if is_binary_log(self.filename):
+                blocks = BinaryLogReader(self.filename).iter_messages(packet_batch=False)
+            else:
+                blocks = iter_mindaffectBCI_message_chunks(self.filename, chunksize=chunksize)
+            for msgs in blocks:
+                # re-write timestamp to server time stamp
+                if self.use_server_ts:
+                    for m in msgs:
+                        m.timestamp = m.sts
+                self.queue.put(msgs)
+        finally:
+            self.queue.put(None) # mark the end of file
+
+    def _peek(self):
+        """get the next message without removing it, None at end of file"""
+        while not self.pending:
+            if self._readdone:
+                return None
+            msgs = self.queue.get()
+            if msgs is None:
+                self._readdone = True
+            else:
+                self.pending.extend(msgs)
+        return self.pending[0]
+
     def getTimeStamp(self):
-        """[summary]
+        """get the current time, i.e. the time-stamp of the replay cursor
 
         Returns:
-            [type]: [description]
-        """        
+            int: the current time-stamp
+        """
         return self.lasttimestamp
     
     def autoconnect(self, *args,**kwargs):
@@ -60,40 +114,81 @@ class FileProxyHub:
         """        
         pass
 
+    def sleep(self, timeout_ms:float):
+        """sleep on the replay clock, i.e. do nothing in fast mode, or sleep the speed-up scaled time
+
+        Args:
+            timeout_ms (float): the time to sleep
+        """
+        if self.fast:
+            return
+        sleep(timeout_ms/1000./self.speedup if self.speedup else timeout_ms/1000.)
+
     def getNewMessages(self, timeout_ms):
-        """[summary]
+        """get the messages in the next timeout_ms of the log, and advance the replay clock
 
         Args:
-            timeout_ms ([type]): [description]
+            timeout_ms (float): the time window to get messages for
 
         Returns:
-            [type]: [description]
-        """        
+            list-of-messages: the new messages
+        """
+        if self.wall_t0 is None:
+            self.wall_t0 = perf_counter()
+            self.last_report = self.wall_t0
+        # initialize the time-stamp tracking
+        if self.lasttimestamp is None or self.lasttimestamp==0:
+            m = self._peek()
+            # N.B. the header time-stamp isn't server time, so start from the first non-header message,
+            # and always pass the header through immediately
+            m = next((m for m in self.pending if not isinstance(m, DataHeader)), m)
+            self.lasttimestamp = m.timestamp if m is not None else 0
+            self.data_t0 = self.lasttimestamp
+        end_ts = self.lasttimestamp + timeout_ms
         msgs = []
-        for line in self.file:
-            msg = read_mindaffectBCI_message(line)
-            if msg is None:
-                continue
-            # re-write timestamp to server time stamp
-            if self.use_server_ts:
-                msg.timestamp = msg.sts
-            # initialize the time-stamp tracking
-            if self.lasttimestamp is None or self.lasttimestamp==0: 
-                self.lasttimestamp = msg.timestamp
-            # add to outgoing message queue
-            msgs.append(msg)
-            # check if should stop
-            if self.lasttimestamp is not None and self.lasttimestamp+timeout_ms < msg.sts:
+        while True:
+            m = self._peek()
+            if m is None or (m.timestamp > end_ts and not isinstance(m, DataHeader)):
                 break
-        else:
+            msgs.append(self.pending.popleft())
+            if isinstance(m, DataPacket):
+                self.nsamp = self.nsamp + len(m.samples)
+        self.nmsgs = self.nmsgs + len(msgs)
+
+        if m is None:
             # mark as disconneted at EOF
             self.isConnected = False
-        if self.speedup :
+            self.eof = True
+            self.report()
+        if self.fast:
+            # skip over any gap to the next message
+            if not msgs and m is not None:
+                end_ts = max(end_ts, m.timestamp)
+            if self.report_interval_s and perf_counter() > self.last_report + self.report_interval_s:
+                self.report()
+        elif self.speedup:
             sleep(timeout_ms/1000./self.speedup)
         # update the time-stamp cursor
-        self.lasttimestamp = self.lasttimestamp + timeout_ms
+        self.lasttimestamp = end_ts
         return msgs
 
+    def replay_stats(self):
+        """get the replay throughput statistics
+
+        Returns:
+            dict: with the number of messages and samples replayed, the wall-clock and data time in seconds, and the speed-up w.r.t. real-time
+        """
+        wall_s = perf_counter() - self.wall_t0 if self.wall_t0 is not None else 0
+        data_s = (self.lasttimestamp - self.data_t0)/1000. if self.data_t0 is not None else 0
+        return dict(msgs=self.nmsgs, samples=self.nsamp, wall_s=wall_s, data_s=data_s,
+                    speedup=data_s/wall_s if wall_s > 0 else 0, msgs_per_s=self.nmsgs/wall_s if wall_s > 0 else 0)
+
+    def report(self):
+        """print the replay throughput statistics"""
+        self.last_report = perf_counter()
+        st = self.replay_stats()
+        print("\nReplay: {msgs} msgs, {samples} samples, {data_s:.1f}s data in {wall_s:.1f}s = {speedup:.1f}x real-time ({msgs_per_s:.0f} msgs/s)".format(**st), flush=True)
+
 def testcase(filename, fs=200, fs_out=200, stopband=((45,65),(0,3),(25,-1)), order=4):
     """[summary]
 
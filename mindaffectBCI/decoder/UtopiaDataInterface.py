@@ -18,10 +18,11 @@
 
 from mindaffectBCI.utopiaclient import UtopiaClient, Subscribe, StimulusEvent, NewTarget, Selection, DataPacket, UtopiaMessage, SignalQuality
 from collections import deque
-from mindaffectBCI.decoder.utils import RingBuffer, extract_ringbuffer_segment
+from mindaffectBCI.decoder.utils import RingBuffer, extract_ringbuffer_segment, extract_ringbuffer_segment_ts
 from mindaffectBCI.decoder.lower_bound_tracker import lower_bound_tracker
 from mindaffectBCI.decoder.linear_trend_tracker import linear_trend_tracker
 from time import sleep
+import threading
 import numpy as np
 
 class UtopiaDataInterface:
@@ -43,7 +44,7 @@ class UtopiaDataInterface:
     def __init__(self, datawindow_ms=60000, msgwindow_ms=60000,
                  data_preprocessor=None, stimulus_preprocessor=None, send_signalquality=True, 
                  timeout_ms=100, mintime_ms=50, fs=None, U=None, sample2timestamp='lower_bound_tracker',
-                 clientid=None):
+                 clientid=None, threaded:bool=False):
         # rate control
         self.timeout_ms = timeout_ms
         self.mintime_ms = mintime_ms # minimum time to spend in update => max processing rate
@@ -89,6 +90,16 @@ class UtopiaDataInterface:
         self.raw_power = None
         self.preproc_power = None
 
+        # background ingestion thread, which is then the only writer to the ring-buffers
+        self.threaded = threaded
+        self.ingest_thread = None
+        self.ingest_msgs = deque() # new messages from the ingestion thread, not yet returned by update
+        self.ingest_stop = threading.Event()
+        self.ingest_new = threading.Event() # set when there is new data/messages
+        self.ingest_ready = threading.Event() # set when the ring-buffers are initialized
+        self.read_nsamp, self.read_nstimulus = 0, 0 # ring-buffer counts at the last update
+        self.send_lock = threading.Lock()
+
     def connect(self, host=None, port=-1, queryifhostnotfound=True):
         """[make a connection to the utopia host]
 
@@ -120,6 +131,30 @@ class UtopiaDataInterface:
 
         return self.U.isConnected if self.U is not None else False
 
+    def isEOF(self):
+        """test if the data source has finished, e.g. at the end of a replayed save file
+
+        Returns:
+            bool: True if the data source will not produce any more messages
+        """
+        eof = getattr(self.U, 'eof', False)
+        if eof and self.ingest_thread is not None: # not EOF until all ingested messages and data are returned
+            eof = not self.ingest_thread.is_alive() and len(self.ingest_msgs) == 0 and \
+                (self.data_ringbuffer is None or self.read_nsamp == self.data_ringbuffer.state_[1]) and \
+                (self.stimulus_ringbuffer is None or self.read_nstimulus == self.stimulus_ringbuffer.state_[1])
+        return eof
+
+    def sleep(self, timeout_ms:float):
+        """sleep for timeout_ms, on the data source clock if it has one, e.g. for fast save file replay
+
+        Args:
+            timeout_ms (float): the time to sleep
+        """
+        if hasattr(self.U, 'sleep'):
+            self.U.sleep(timeout_ms)
+        else:
+            sleep(timeout_ms/1000.0)
+
     def getTimeStamp(self):
         """[summary]
 
@@ -136,7 +171,9 @@ class UtopiaDataInterface:
             msg (UtopiaMessage): [description]
         """        
 
-        self.U.sendMessage(msg)
+        # N.B. lock as may be sent from both the ingestion thread and the main thread
+        with self.send_lock:
+            self.U.sendMessage(msg)
 
     def getNewMessages(self, timeout_ms=0):
         """[get new messages from the UtopiaHub]
@@ -195,10 +232,10 @@ class UtopiaDataInterface:
         # on the data state after pre-processing
         tmpdatabuf = [self.processDataPacket(m) for m in databuf]
         # strip empty packets
-        tmpdatabuf = [d for d in tmpdatabuf if d.shape[0]>0]
+        tmpdatabuf = [(d,d_ts) for d,d_ts in tmpdatabuf if d.shape[0]>0]
         # estimate the sample rate of the pre-processed data
-        pp_nsamp = [m.shape[0] for m in tmpdatabuf]
-        pp_ts = [ m[-1,-1] for m in tmpdatabuf]
+        pp_nsamp = [d.shape[0] for d,_ in tmpdatabuf]
+        pp_ts = [ d_ts[-1] for _,d_ts in tmpdatabuf]
         slopes = self.local_slope(pp_nsamp, pp_ts)
         self.fs = np.median( slopes ) * 1000.0# fs = nSamp/time
         print('Estimated pre-processed sample rate={}'.format(self.fs))
@@ -206,9 +243,9 @@ class UtopiaDataInterface:
         # create the ring buffer, big enough to store the pre-processed data
         if self.data_ringbuffer:
             print("Warning: re-init data ring buffer")
-        # TODO []: why does the datatype of the ring buffer matter so much? Is it because of uss?
-        #  Answer[]: it's the time-stamps, float32 rounds time-stamps to 24bits
-        self.data_ringbuffer = RingBuffer(maxsize=self.fs*self.datawindow_ms/1000, shape=tmpdatabuf[0].shape[1:], dtype=np.float32)
+        # N.B. time-stamps are stored separately as float32 rounds time-stamps to 24bits
+        self.data_ringbuffer = RingBuffer(maxsize=self.fs*self.datawindow_ms/1000, shape=tmpdatabuf[0][0].shape[1:], dtype=np.float32,
+                                          ts_dtype=np.float64)
 
         # insert the warmup data into the ring buffer
         self.data_timestamp=None # reset last seen data
@@ -222,8 +259,8 @@ class UtopiaDataInterface:
                                                             sample2timestamp=self.sample2timestamp)
         for m in databuf:
             # apply the pre-processing again (this time with fs estimated)
-            d = self.processDataPacket(m)
-            self.data_ringbuffer.extend(d)
+            d, d_ts = self.processDataPacket(m)
+            self.data_ringbuffer.extend(d, d_ts)
             nsamp = nsamp + d.shape[0]
 
         return (nsamp, nmsg)
@@ -243,10 +280,37 @@ class UtopiaDataInterface:
         local_slope = [ (snsamp[i+step] - snsamp[i]) / (data_ts[i+step]-data_ts[i]) for i in range(0,len(snsamp)-step,step//2) ]
         return local_slope
 
-    def initStimulusRingBuffer(self):
-        '''initialize the data ring buffer, by getting some seed messages and datapackets to get the data sizes etc.'''
-        # TODO []: more efficient memory use, with different dtype for 'real' data and the time-stamps?
-        self.stimulus_ringbuffer = RingBuffer(maxsize=self.fs*self.datawindow_ms/1000, shape=(257,), dtype=np.float32)
+    def initStimulusRingBuffer(self, dtype=np.uint8, shape=(256,)):
+        '''initialize the stimulus ring buffer, for stimulus states of the given dtype and shape
+
+        Args:
+            dtype (np.dtype, optional): the type of the (pre-processed) stimulus state. Defaults to np.uint8.
+            shape (tuple, optional): the shape of the (pre-processed) stimulus state. Defaults to (256,).
+        '''
+        # N.B. without a stimulus_preprocessor the state is a byte per objID, with time-stamps stored separately
+        self.stimulus_ringbuffer = RingBuffer(maxsize=self.fs*self.datawindow_ms/1000, shape=tuple(shape), dtype=dtype,
+                                              ts_dtype=np.float64)
+
+    def appendStimulus(self, d:np.ndarray, d_ts:float):
+        '''add a (pre-processed) stimulus state to the stimulus ring buffer, matching the buffer to the type of the state
+
+        Args:
+            d (np.ndarray): the stimulus state, as returned by `processStimulusEvent`
+            d_ts (float): the time-stamp of this stimulus state
+
+        Raises:
+            ValueError: if the type or shape of the state changes after the first stimulus
+        '''
+        d = np.asarray(d)
+        rb = self.stimulus_ringbuffer
+        if d.dtype != rb.buffer.dtype or d.shape != rb.elementshape:
+            if rb.n > 0:
+                raise ValueError("Stimulus state {}{} doesn't match the stimulus ring buffer {}{}".format(
+                    d.dtype, d.shape, rb.buffer.dtype, rb.elementshape))
+            # first stimulus, so use the stimulus_preprocessor output type, e.g. float, rather than truncating
+            self.initStimulusRingBuffer(d.dtype, d.shape)
+            rb = self.stimulus_ringbuffer
+        rb.append(d, d_ts)
 
     def preprocess_message(self, m:UtopiaMessage):
         """[apply pre-processing to topia message before any more work]
@@ -258,10 +322,7 @@ class UtopiaDataInterface:
             [type]: [description]
         """        
         
-        #  WARNING BODGE: fit time-stamp in 24bits for float32 ring buffer
-        #  Note: this leads to wrap-arroung in (1<<24)/1000/3600 = 4.6 hours
-        #        but that shouldn't matter.....
-        m.timestamp = m.timestamp % (1<<24)
+        # N.B. time-stamps are stored as float64 in the ring-buffers, so no need to wrap them.
         return m
     
     def processDataPacket(self, m: DataPacket):
@@ -271,12 +332,14 @@ class UtopiaDataInterface:
             m (DataPacket): [description]
 
         Returns:
-            [type]: [description]
+            d (np.ndarray): (t,d) the pre-processed data
+            d_ts (np.ndarray): (t,) the time-stamp for each sample of d
         """        
         
         #print("DP: {}".format(m))
         # extract the raw data
-        d = np.array(m.samples, dtype=np.float32) # process as singles
+        # N.B. no copy if the packet was decoded as a float32 array
+        d = np.asarray(m.samples, dtype=np.float32) # process as singles
         # apply the pre-processor, if one was given
 
         if self.data_preprocessor:
@@ -298,11 +361,29 @@ class UtopiaDataInterface:
             if self.data_timestamp is not None and m.timestamp < self.data_timestamp:
                 print("Warning: Time-stamp wrap-around detected!!")
 
-            d = self.add_sample_timestamps(d,m.timestamp,self.fs)
+            d_ts = self.sample_timestamps(d,m.timestamp)
+        else:
+            d_ts = np.zeros((0,),dtype=np.float64)
 
         # update the last time-stamp tracking
         self.data_timestamp= m.timestamp
-        return d
+        return d, d_ts
+
+    def sample_timestamps(self,d:np.ndarray,timestamp:float):
+        """compute the per-sample timestamp information for the data matrix
+
+        Args:
+            d (np.ndarray): (t,d) the data matrix to compute time stamps for
+            timestamp (float): the timestamp of the last sample of d
+
+        Returns:
+            np.ndarray: (t,) time-stamp for each sample of d
+        """
+        if self.sample2timestamp is not None and not isinstance(self.sample2timestamp,str):
+            sample_ts = self.sample2timestamp.transform(timestamp, len(d))
+        else: # all the same ts
+            sample_ts = np.ones((len(d),),dtype=int)*timestamp
+        return sample_ts
 
     def add_sample_timestamps(self,d:np.ndarray,timestamp:float,fs:float):
         """add per-sample timestamp information to the data matrix
@@ -315,10 +396,7 @@ class UtopiaDataInterface:
         Returns:
             np.ndarray: (t,d+1) data matrix with attached time-stamp channel
         """
-        if self.sample2timestamp is not None and not isinstance(self.sample2timestamp,str):
-            sample_ts = self.sample2timestamp.transform(timestamp, len(d))
-        else: # all the same ts
-            sample_ts = np.ones((len(d),),dtype=int)*timestamp
+        sample_ts = self.sample_timestamps(d,timestamp)
         # combine data with timestamps, ensuring type is preserved
         d = np.append(np.array(d), sample_ts[:, np.newaxis], -1).astype(d.dtype)
         return d
@@ -356,26 +434,26 @@ class UtopiaDataInterface:
             m (StimulusEvent): [description]
 
         Returns:
-            [type]: [description]
+            d (np.ndarray): (256,) the stimulus state for each objID
+            ts (float): the time-stamp of this stimulus state
         """        
         
-        # get the vector to hold the stimulus info
-        d = np.zeros((257,),dtype=np.float32)
-
-        if self.stimulus_ringbuffer is not None and self.stimulus_timestamp is not None:
-            # hold value of used objIDs from previous time stamp
-            d[:] = self.stimulus_ringbuffer[-1,:]
+        if self.stimulus_ringbuffer is not None and self.stimulus_timestamp is not None and self.stimulus_ringbuffer.n > 0:
+            # hold value of used objIDs from previous time stamp, in the ring buffer type
+            d = np.array(self.stimulus_ringbuffer[-1,:])
+        else:
+            # get the vector to hold the stimulus info
+            d = np.zeros((256,),dtype=np.uint8)
 
         # insert the  updated state
         d[m.objIDs] = m.objState
-        d[-1] = m.timestamp
         # apply the pre-processor, if one was given
         if self.stimulus_preprocessor:
             d = self.stimulus_preprocessor.transform(d)
 
         # update the last time-stamp tracking
         self.stimulus_timestamp= m.timestamp
-        return d
+        return d, m.timestamp
 
     def update_and_send_ElectrodeQualities(self, d_raw: np.ndarray, d_preproc: np.ndarray, ts: int):
         """[compute running estimate of electrode qality and stream it]
@@ -418,7 +496,7 @@ class UtopiaDataInterface:
                 # plot the sample time-stamp jitter...
                 import matplotlib.pyplot as plt
                 plt.figure(10)
-                ts = self.data_ringbuffer[:,-1]
+                ts = self.data_ringbuffer.unwrap_ts()
                 idx = np.flatnonzero(ts)
                 if len(idx)>0:
                     ts = ts[idx[0]:]
@@ -462,16 +540,18 @@ class UtopiaDataInterface:
              list of the *new* utopia messages from the server
           nsamp: int
              number of new data samples in this call
-             Note: use data_ringbuffer[-nsamp:,...] to get the new data
+             Note: use data_ringbuffer[-nsamp:,...] to get the new data, and data_ringbuffer.unwrap_ts()[-nsamp:] for their time-stamps
           nstimulus : int
              number of new stimulus events in this call
-             Note: use stimulus_ringbuffer[-nstimulus:,...] to get the new data
+             Note: use stimulus_ringbuffer[-nstimulus:,...] to get the new data, and stimulus_ringbuffer.unwrap_ts()[-nstimulus:] for their time-stamps
         '''
         if timeout_ms is None:
             timeout_ms = self.timeout_ms
         if mintime_ms is None:
             mintime_ms = self.mintime_ms
-        if not self.isConnected():
+        if self.threaded:
+            return self.update_threaded(timeout_ms)
+        if not self.isConnected() and not self.isEOF():
             self.connect()
         if not self.isConnected():
             return [],0,0
@@ -493,13 +573,41 @@ class UtopiaDataInterface:
         # record the list of new messages from this call
         newmsgs = self.newmsgs # start with any left-overs from old calls 
         self.newmsgs=[] # clear the  left-over messages stack
-        
+
+        msgs, nsamp2, nstimulus = self.ingest(timeout_ms, mintime_ms, t0)
+        newmsgs.extend(msgs)
+        return (newmsgs, nsamp+nsamp2, nstimulus)
+
+    def ingest(self, timeout_ms, mintime_ms, t0=None):
+        '''get and process messages from the data source for timeout_ms, adding them to the ring-buffers
+
+        Args
+         timeout_ms : int
+             time to spend getting messages
+         mintime_ms : int
+             min time to accumulate messages before processing
+         t0 : int
+             start time of the update, defaults to now.
+        Returns
+          newmsgs : [newMsgs :UtopiaMessage]
+             list of the new non-data utopia messages
+          nsamp: int
+             number of new data samples
+          nstimulus : int
+             number of new stimulus events
+        '''
+        if t0 is None:
+            t0 = self.getTimeStamp()
+        newmsgs = []
+        nsamp = 0
+        nstimulus = 0
+        nmsg = 0
         ttg = timeout_ms - (self.getTimeStamp() - t0) # time-to-go in the update loop
         while ttg > 0:
 
             # rate limit
             if ttg >= mintime_ms:
-                sleep(mintime_ms/1000.0)
+                self.sleep(mintime_ms)
                 ttg = timeout_ms - (self.getTimeStamp() - t0) # udate time-to-go
                 
             # get the new messages
@@ -514,23 +622,23 @@ class UtopiaDataInterface:
                 print("{:c}".format(m.msgID), end='', flush=True)
                 
                 if m.msgID == DataPacket.msgID: # data-packets are special
-                    d = self.processDataPacket(m) # (samp x ...)
-                    self.data_ringbuffer.extend(d)
+                    d, d_ts = self.processDataPacket(m) # (samp x ...)
+                    self.data_ringbuffer.extend(d, d_ts)
                     nsamp = nsamp + d.shape[0]
                     
                 elif m.msgID == StimulusEvent.msgID: # as are stmiuluse events
-                    d = self.processStimulusEvent(m) # (nY x ...)
-                    self.stimulus_ringbuffer.append(d)
+                    d, d_ts = self.processStimulusEvent(m) # (nY x ...)
+                    self.appendStimulus(d, d_ts)
                     nstimulus = nstimulus + 1
                     
                 else:
                     # NewTarget/Selection are also special in that they clear stimulus state...
                     if m.msgID == NewTarget.msgID or m.msgID == Selection.msgID :
                         # Make a dummy stim-event to reset all objIDs to off
-                        d = self.processStimulusEvent(StimulusEvent(m.timestamp,
+                        d, d_ts = self.processStimulusEvent(StimulusEvent(m.timestamp,
                                                                     np.arange(255,dtype=np.int32),
                                                                     np.zeros(255,dtype=np.int8)))
-                        self.stimulus_ringbuffer.append(d)
+                        self.appendStimulus(d, d_ts)
                         self.stimulus_timestamp= m.timestamp
                     
                     if len(self.msg_ringbuffer)>0 and m.timestamp > self.msg_ringbuffer[0].timestamp + self.msgwindow_ms: # slide msg buffer
@@ -551,6 +659,84 @@ class UtopiaDataInterface:
         # return new messages, and count new samples/stimulus 
         return (newmsgs, nsamp, nstimulus)
 
+    def start_ingestion(self):
+        '''start the background ingestion thread, which gets and processes the messages into the ring-buffers'''
+        if self.ingest_thread is not None and self.ingest_thread.is_alive():
+            return
+        self.ingest_stop.clear()
+        self.ingest_thread = threading.Thread(target=self.ingest_loop, daemon=True, name='UtopiaDataInterface.ingest')
+        self.ingest_thread.start()
+
+    def stop_ingestion(self, timeout_ms=None):
+        '''stop the background ingestion thread'''
+        self.ingest_stop.set()
+        if self.ingest_thread is not None:
+            self.ingest_thread.join(None if timeout_ms is None else timeout_ms/1000.0)
+
+    def ingest_loop(self):
+        '''main loop for the ingestion thread.
+
+        N.B. this thread is the single writer for the ring-buffers, and the main thread only
+        reads them via lock-free snapshots, so data is captured even when the main thread is busy.
+        '''
+        while not self.ingest_stop.is_set():
+            if not self.isConnected():
+                if getattr(self.U, 'eof', False):
+                    break
+                self.connect()
+                if not self.isConnected():
+                    sleep(self.timeout_ms/1000.0)
+                    continue
+            if self.data_ringbuffer is None:
+                self.initDataRingBuffer()
+                self.initStimulusRingBuffer()
+                self.last_log_ts = self.getTimeStamp()
+                self.ingest_ready.set()
+            newmsgs, nsamp, nstimulus = self.ingest(self.timeout_ms, self.mintime_ms)
+            self.ingest_msgs.extend(newmsgs)
+            if newmsgs or nsamp > 0 or nstimulus > 0:
+                self.ingest_new.set()
+        self.ingest_new.set() # wake any waiting reader
+
+    def update_threaded(self, timeout_ms=None):
+        '''update from the ingestion thread, by waiting for new data and collecting the new messages
+
+        Args:
+            timeout_ms (int, optional): max time to block waiting for new data. Defaults to None.
+
+        Returns:
+            newmsgs, nsamp, nstimulus : as for update, but nstimulus also counts the stimulus state resets from NewTarget/Selection messages
+        '''
+        if timeout_ms is None:
+            timeout_ms = self.timeout_ms
+        if self.ingest_thread is None:
+            self.start_ingestion()
+        self.ingest_new.wait(timeout_ms/1000.0)
+        self.ingest_new.clear()
+
+        newmsgs = self.newmsgs # start with any left-overs from old calls 
+        self.newmsgs = []
+        if not self.ingest_ready.is_set():
+            return (newmsgs, 0, 0)
+        while self.ingest_msgs:
+            newmsgs.append(self.ingest_msgs.popleft())
+        # count the new samples/stimuli from the published ring-buffer state
+        nsamp = self.data_ringbuffer.state_[1]
+        nstimulus = self.stimulus_ringbuffer.state_[1]
+        nsamp, self.read_nsamp = nsamp - self.read_nsamp, nsamp
+        nstimulus, self.read_nstimulus = nstimulus - self.read_nstimulus, nstimulus
+        return (newmsgs, nsamp, nstimulus)
+
+    def read_ringbuffer(self, rb, fn):
+        '''apply the read function fn to the ring buffer rb, via a consistent snapshot if it is written by the ingestion thread'''
+        if not self.threaded or rb is None:
+            return fn(rb)
+        while True:
+            snap = rb.snapshot()
+            res = fn(snap)
+            if rb.snapshot_valid(snap):
+                return res
+
 
 
     def push_back_newmsgs(self,oldmsgs):
@@ -566,29 +752,59 @@ class UtopiaDataInterface:
 
 
 
-    def extract_data_segment(self, bgn_ts, end_ts=None):
+    def extract_data_segment(self, bgn_ts, end_ts=None, copy:bool=True):
         """extract a segment of data based on a start and end time-stamp
 
         Args:
             bgn_ts (float): segment start time-stamp
             end_ts (float, optional): segment end time-stamp. Defaults to None.
+            copy (bool, optional): if False return a view which is only valid until the next update. Defaults to True.
+
+        Returns:
+            (np.ndarray): (t,d+1) the data between these time-stamps with time-stamps in the last channel, or None if timestamps invalid
+        """        
+        return self.read_ringbuffer(self.data_ringbuffer, lambda rb: extract_ringbuffer_segment(rb,bgn_ts,end_ts,copy=copy or self.threaded))
+
+    def extract_data_segment_ts(self, bgn_ts, end_ts=None, copy:bool=True):
+        """extract a segment of data, and it's time-stamps, based on a start and end time-stamp
+
+        Args:
+            bgn_ts (float): segment start time-stamp
+            end_ts (float, optional): segment end time-stamp. Defaults to None.
+            copy (bool, optional): if False return views which are only valid until the next update. Defaults to True.
 
         Returns:
-            (np.ndarray): the data between these time-stamps, or None if timestamps invalid
+            X (np.ndarray): (t,d) the float32 data between these time-stamps
+            X_ts (np.ndarray): (t,) the time-stamp for each sample in X
         """        
-        return extract_ringbuffer_segment(self.data_ringbuffer,bgn_ts,end_ts)
+        return self.read_ringbuffer(self.data_ringbuffer, lambda rb: extract_ringbuffer_segment_ts(rb,bgn_ts,end_ts,copy=copy or self.threaded))
     
-    def extract_stimulus_segment(self, bgn_ts, end_ts=None):
+    def extract_stimulus_segment(self, bgn_ts, end_ts=None, copy:bool=True):
         """extract a segment of the stimulus stream based on a start and end time-stamp
 
         Args:
             bgn_ts (float): segment start time-stamp
             end_ts (float, optional): segment end time-stamp. Defaults to None.
+            copy (bool, optional): if False return a view which is only valid until the next update. Defaults to True.
 
         Returns:
-            (np.ndarray): the stimulus events between these time-stamps, or None if timestamps invalid
+            (np.ndarray): (t,257) the stimulus events between these time-stamps with time-stamps in the last channel, or None if timestamps invalid
         """        
-        return extract_ringbuffer_segment(self.stimulus_ringbuffer,bgn_ts,end_ts)
+        return self.read_ringbuffer(self.stimulus_ringbuffer, lambda rb: extract_ringbuffer_segment(rb,bgn_ts,end_ts,copy=copy or self.threaded))
+
+    def extract_stimulus_segment_ts(self, bgn_ts, end_ts=None, copy:bool=True):
+        """extract a segment of the stimulus stream, and it's time-stamps, based on a start and end time-stamp
+
+        Args:
+            bgn_ts (float): segment start time-stamp
+            end_ts (float, optional): segment end time-stamp. Defaults to None.
+            copy (bool, optional): if False return views which are only valid until the next update. Defaults to True.
+
+        Returns:
+            Y (np.ndarray): (t,256) the stimulus state between these time-stamps, uint8 unless changed by the stimulus_preprocessor
+            Y_ts (np.ndarray): (t,) the time-stamp for each stimulus event in Y
+        """        
+        return self.read_ringbuffer(self.stimulus_ringbuffer, lambda rb: extract_ringbuffer_segment_ts(rb,bgn_ts,end_ts,copy=copy or self.threaded))
     
     def extract_msgs_segment(self, bgn_ts, end_ts=None):
         """[extract the messages between start/end time stamps]
@@ -602,7 +818,8 @@ class UtopiaDataInterface:
         """        
         
         msgs = [] # store the trial stimEvents
-        for m in reversed(self.msg_ringbuffer):
+        # N.B. iterate over a copy, as may be updated by the ingestion thread
+        for m in reversed(list(self.msg_ringbuffer)):
             if m.timestamp <= bgn_ts:
                 # stop as soon as earlier than bgn_ts
                 break
@@ -659,13 +876,134 @@ except:
 #--------------------------------------------------------------------------
 #--------------------------------------------------------------------------
 from mindaffectBCI.decoder.utils import sosfilt, butter_sosfilt, sosfilt_zi_warmup
+class polyphase_resampler:
+    """Incremental streaming polyphase FIR resampler by the rational factor up/down
+
+    Only the retained output samples are computed, using the polyphase components of a Kaiser windowed-sinc
+    anti-aliasing filter (as for scipy.signal.resample_poly), with the input history carried over between calls.
+    The per-sample info, e.g. time-stamps, is interpolated at the filter center, i.e. compensating for the
+    (linear-phase) group delay, so the output samples are aligned with their time-stamps.  N.B. outputs
+    centered before the first input sample are dropped.
+    """
+    def __init__(self, up:int, down:int, halflen:int=10, beta:float=5.0):
+        """Incremental streaming polyphase FIR resampler by the rational factor up/down
+
+        Args:
+            up (int): up-sampling factor
+            down (int): down-sampling factor
+            halflen (int, optional): half length of the anti-aliasing filter in output samples. Defaults to 10.
+            beta (float, optional): Kaiser window shape parameter. Defaults to 5.0.
+        """
+        self.up, self.down = int(up), int(down)
+        # anti-aliasing filter, at the up-sampled rate with cut-off at the lower nyquist
+        max_rate = max(self.up, self.down)
+        L = 2*halflen*max_rate + 1
+        n = np.arange(L) - (L-1)/2
+        self.delay = (L-1)//2 # group delay in up-sampled samples
+        h = np.sinc(n/max_rate) * np.kaiser(L, beta)
+        h = h * (self.up / np.sum(h)) # unit pass-band gain after up-sampling
+        # polyphase components, H[phase,j] = h[phase + j*up]
+        self.ntaps = -(-L // self.up)
+        h = np.concatenate((h, np.zeros(self.ntaps*self.up - L)))
+        self.H = h.reshape((self.ntaps, self.up)).T # (up,ntaps)
+        self.X_ = None
+
+    def reset(self):
+        """reset the filter state"""
+        self.X_ = None
+
+    def transform(self, X, Y=None):
+        """resample the next block of samples
+
+        Args:
+            X (np.ndarray): (nsamp,d) the next block of data
+            Y (np.ndarray, optional): (nsamp,e) additional per-sample info, e.g. time-stamps, to linearly interpolate to the output samples. Defaults to None.
+
+        Returns:
+            X (np.ndarray): (nout,d) the resampled data
+            Y (np.ndarray): (nout,e) the resampled Y, if given
+        """
+        if self.X_ is None:
+            # warm start the filter history with the first sample, N.B. +2 for the partial output sample
+            self.nhist = self.ntaps + 2
+            self.X_ = np.repeat(X[:1, ...], self.nhist, axis=0)
+            self.Y_ = np.repeat(Y[:1, ...], self.nhist, axis=0) if Y is not None else None
+            self.nin = 0 # number of input samples seen
+            self.nout = -(-self.delay // self.down) # number of output samples produced, N.B. start at the first centered after the first input
+        start = self.nin - self.nhist # input index of the first history sample
+        Xc = np.concatenate((self.X_, X), axis=0)
+        Yc = np.concatenate((self.Y_, Y), axis=0) if Y is not None else None
+        self.nin = self.nin + X.shape[0]
+
+        # outputs whose input position, m*down/up, we have the samples up to
+        mend = ((self.nin-1)*self.up) // self.down + 1
+        m = np.arange(self.nout, mend)
+        p = m * self.down
+        n0 = p // self.up - start # last input sample used, relative to Xc
+        phase = p % self.up
+        # apply the phase's filter components to the window of inputs before each output
+        # N.B. outputs with the same phase are every up'th, with inputs every down'th, so
+        #  can use a strided view of the input windows rather than copying them out
+        # N.B. channel major so the windows are contiguous for the dot-products
+        XcT = np.ascontiguousarray(Xc.reshape((Xc.shape[0], -1)).T) # (d,nsamp)
+        Xwin = np.lib.stride_tricks.sliding_window_view(XcT, self.ntaps, axis=-1) # (d,nwin,ntaps)
+        H = self.H[:, ::-1].astype(X.dtype) if np.issubdtype(X.dtype, np.floating) else self.H[:, ::-1]
+        Xout = np.zeros((XcT.shape[0], len(m)), dtype=np.result_type(X.dtype, H.dtype)) # (d,nout)
+        for k in range(min(self.up, len(m))):
+            win0 = n0[k] - (self.ntaps-1) # first window for this phase
+            Xout[:, k::self.up] = Xwin[:, win0::self.down, :][:, :len(m[k::self.up]), :] @ H[phase[k], :]
+        Xout = Xout.T.reshape((len(m),)+X.shape[1:]).astype(X.dtype)
+        if Yc is not None:
+            # interpolate at the filter center, i.e. group delay before the output position
+            q = p - self.delay
+            nc = q // self.up - start
+            w = ((q % self.up) / self.up).reshape((-1,) + (1,)*(Yc.ndim-1))
+            n1 = np.minimum(nc + 1, Yc.shape[0]-1)
+            Yout = (Yc[nc, ...] * (1-w) + Yc[n1, ...] * w).astype(Yc.dtype)
+        self.nout = max(self.nout, mend)
+
+        # carry over the history
+        self.X_ = Xc[-self.nhist:, ...]
+        if Yc is not None:
+            self.Y_ = Yc[-self.nhist:, ...]
+        return Xout if Y is None else (Xout, Yout)
+
+    @staticmethod
+    def testcase(up=2, down=5, nsamp=1000, step=7):
+        ''' test the polyphase resampler is the same for single and incremental calling '''
+        X = np.cumsum(np.random.randn(nsamp, 3), axis=0)
+        xs = np.arange(nsamp, dtype=np.float64)[:, np.newaxis]
+        m0, xs0 = polyphase_resampler(up, down).transform(X, xs)
+        rs = polyphase_resampler(up, down)
+        m1, xs1 = zip(*[rs.transform(X[i:i+step, :], xs[i:i+step, :]) for i in range(0, nsamp, step)])
+        m1, xs1 = np.concatenate(m1, 0), np.concatenate(xs1, 0)
+        print("{}->{} samples, diff: {} ts-diff: {}".format(nsamp, m0.shape[0], np.max(np.abs(m0-m1)), np.max(np.abs(xs0-xs1))))
+
+    @staticmethod
+    def test_delay(fs=2000, fs_out=100, nsamp=4000, impulse_ts=1000, step=33):
+        ''' test the output time-stamps are aligned with the data, i.e. an impulse's peak keeps it's time-stamp '''
+        from fractions import Fraction
+        rate = Fraction(fs_out/fs).limit_denominator(100)
+        ts = np.arange(nsamp)*1000/fs
+        X = np.zeros((nsamp, 1))
+        X[np.searchsorted(ts, impulse_ts), 0] = 1
+        rs = polyphase_resampler(rate.numerator, rate.denominator)
+        Xout, tsout = zip(*[rs.transform(X[i:i+step, :], ts[i:i+step, np.newaxis]) for i in range(0, nsamp, step)])
+        Xout, tsout = np.concatenate(Xout, 0), np.concatenate(tsout, 0)
+        peak_ts = tsout[np.argmax(Xout[:, 0]), 0]
+        print("{}->{}hz impulse at {}ms, peak at {}ms".format(fs, fs_out, impulse_ts, peak_ts))
+        assert abs(peak_ts - impulse_ts) <= 500/fs_out, "resampled data not aligned with time-stamps"
+        assert np.all(np.diff(tsout[:, 0]) > 0) and tsout[0, 0] >= ts[0]
+
 class butterfilt_and_downsample(TransformerMixin):
     """Incremental streaming transformer to provide filtering and downsampling data transformations
 
     Args:
         TransformerMixin ([type]): sklearn compatible transformer
+        decimator (str, optional): how to downsample, one-of: None - filter at the input rate then select (or linearly interpolate) output samples, 'polyphase' - anti-alias and resample with a polyphase FIR filter first, then filter at the output rate. Defaults to None.
     """    
-    def __init__(self, stopband=((0,5),(5,-1)), order:int=6, fs:float =250, fs_out:float =60, ftype='butter'):
+    def __init__(self, stopband=((0,5),(5,-1)), order:int=6, fs:float =250, fs_out:float =60, ftype='butter', decimator:str=None):
+        self.decimator = decimator
         self.stopband = stopband
         self.fs = fs
         self.fs_out = fs_out if fs_out is not None and fs_out < fs else fs
@@ -690,7 +1028,20 @@ class butterfilt_and_downsample(TransformerMixin):
         if fs is not None: # parameter overrides stored fs
             self.fs = fs
 
+        # rate the spectral filter runs at, the output rate if resample first
+        filter_fs = self.fs
+        self.resampler_ = None
+        if self.decimator == 'polyphase' and self.fs_out is not None and self.fs_out < self.fs:
+            from fractions import Fraction
+            rate = Fraction(self.fs_out/self.fs).limit_denominator(100)
+            self.resampler_ = polyphase_resampler(rate.numerator, rate.denominator)
+            filter_fs = self.fs * rate.numerator / rate.denominator
+        elif self.decimator is not None and not self.decimator == 'polyphase':
+            raise ValueError("Unknown decimator type {}".format(self.decimator))
+
         # preprocess -> spectral filter
+        # N.B. coefficients from file are for the input rate, so always filter before resampling
+        self.prefilter_ = self.resampler_ is None or isinstance(self.stopband, str)
         if isinstance(self.stopband, str):
             import pickle
             import os
@@ -709,13 +1060,18 @@ class butterfilt_and_downsample(TransformerMixin):
 
         else:
             # estimate them from the given information
-            X, self.sos_, self.zi_ = butter_sosfilt(X, self.stopband, self.fs, order=self.order, axis=self.axis, zi=zi, ftype=self.ftype)
+            X, self.sos_, self.zi_ = butter_sosfilt(X, self.stopband, filter_fs, order=self.order, axis=self.axis, zi=zi, ftype=self.ftype)
             
         # preprocess -> downsample
         self.nsamp = 0
-        self.resamprate_ = int(round(self.fs*2.0/self.fs_out))/2.0 if self.fs_out is not None else 1
-        self.out_fs_  = self.fs/self.resamprate_
-        print("resample: {}->{}hz rsrate={}".format(self.fs, self.out_fs_, self.resamprate_))
+        if self.resampler_ is not None:
+            self.resamprate_ = self.fs / filter_fs
+            self.out_fs_ = filter_fs
+            print("resample: {}->{}hz polyphase {}/{}".format(self.fs, self.out_fs_, self.resampler_.up, self.resampler_.down))
+        else:
+            self.resamprate_ = int(round(self.fs*2.0/self.fs_out))/2.0 if self.fs_out is not None else 1
+            self.out_fs_  = self.fs/self.resamprate_
+            print("resample: {}->{}hz rsrate={}".format(self.fs, self.out_fs_, self.resamprate_))
 
         return self
 
@@ -733,6 +1089,19 @@ class butterfilt_and_downsample(TransformerMixin):
         if not hasattr(self,'sos_'):
             self.fit(X[0:1,:])
 
+        if self.resampler_ is not None:
+            # polyphase resample, then filter at the output rate
+            if self.sos_ is not None and self.prefilter_:
+                X, self.zi_ = sosfilt(self.sos_, X, axis=self.axis, zi=self.zi_)
+            self.nsamp = self.nsamp + X.shape[self.axis]
+            if Y is None:
+                X = self.resampler_.transform(X)
+            else:
+                X, Y = self.resampler_.transform(X, Y)
+            if self.sos_ is not None and not self.prefilter_ and X.shape[self.axis] > 0:
+                X, self.zi_ = sosfilt(self.sos_, X, axis=self.axis, zi=self.zi_)
+            return X if Y is None else (X, Y)
+
         if self.sos_ is not None:
             X, self.zi_ = sosfilt(self.sos_, X, axis=self.axis, zi=self.zi_)
 
@@ -1283,6 +1652,33 @@ class channel_power_standardizer(TransformerMixin):
         plt.show()
 
 
+def testStimulusDtype():
+    '''check the stimulus ring buffer keeps the type of the stimulus_preprocessor output'''
+    class scale_stimulus:
+        def transform(self, d):
+            return d.astype(np.float32) * .5
+    ui = UtopiaDataInterface(stimulus_preprocessor=scale_stimulus())
+    ui.fs = 100
+    ui.initStimulusRingBuffer()
+    for ts, state in enumerate((1, 3, 0)):
+        d, d_ts = ui.processStimulusEvent(StimulusEvent(ts, np.array([1, 2]), np.array([state, state])))
+        ui.appendStimulus(d, d_ts)
+    Y, Y_ts = ui.extract_stimulus_segment_ts(-1)
+    print("stimulus={} {}".format(Y.dtype, Y[:, 1]))
+    assert Y.dtype == np.float32 and np.array_equal(Y[:, 1], [.5, 1.5, 0])
+    try: # changed type after the first stimulus
+        ui.appendStimulus(np.zeros((256,), dtype=np.uint8), 3)
+        assert False, "type change not detected"
+    except ValueError:
+        pass
+    # without pre-processor, a byte per objID
+    ui = UtopiaDataInterface()
+    ui.fs = 100
+    ui.initStimulusRingBuffer()
+    ui.appendStimulus(*ui.processStimulusEvent(StimulusEvent(0, np.array([1]), np.array([1]))))
+    assert ui.stimulus_ringbuffer.buffer.dtype == np.uint8
+
+
 def testRaw():
     """[summary]
     """    
@@ -1347,9 +1743,9 @@ def testFileProxy2(filename):
         else:
             emptycount=0
         if nsamp > 0:
-            data.append(ui.data_ringbuffer[-nsamp:,:].copy())
+            data.append(ui.data_ringbuffer.with_timestamps(slice(-nsamp,None)))
         if nstim > 0:
-            stim.append(ui.stimulus_ringbuffer[-nstim:,:].copy())
+            stim.append(ui.stimulus_ringbuffer.with_timestamps(slice(-nstim,None)))
     # convert to single data block
     data = np.vstack(data)
     stim = np.vstack(stim)
@@ -35,7 +35,17 @@ import matplotlib.pyplot as plt
 import gc
 import re
 
-def analyse_dataset(X:np.ndarray, Y:np.ndarray, coords, outfile, model:str='cca', test_idx=None, cv=True, tau_ms:float=300, fs:float=None,  rank:int=1, evtlabs=None, offset_ms=0, center=True, tuned_parameters=None, ranks=None, retrain_on_all=True, **kwargs):
+METRICSFILE = 'metrics.txt'
+
+def write_metrics(msg:str, metrics:list=None):
+    """append a message to the metrics file, or to the metrics list when collecting per-file results"""
+    if metrics is not None:
+        metrics.append(msg)
+    else:
+        with open(METRICSFILE, 'a') as outfile:
+            outfile.write(msg)
+
+def analyse_dataset(X:np.ndarray, Y:np.ndarray, coords, outfile, model:str='cca', test_idx=None, cv=True, tau_ms:float=300, fs:float=None,  rank:int=1, evtlabs=None, offset_ms=0, center=True, tuned_parameters=None, ranks=None, retrain_on_all=True, metrics:list=None, **kwargs):
     """ cross-validated training on a single datasets and decoing curve estimation
 
     Args:
@@ -50,6 +60,7 @@ def analyse_dataset(X:np.ndarray, Y:np.ndarray, coords, outfile, model:str='cca'
         rank (int, optional): rank of the decomposition in factored models such as cca. Defaults to 1.
         evtlabs ([type], optional): The types of events to used to model the brain response, as used in `stim2event.py`. Defaults to None.
         offset_ms ((2,):float, optional): Offset for analysis window from start/end of the event response. Defaults to 0.
+        metrics (list-of-str, optional): list to collect the metrics lines in, rather than writing them to the METRICSFILE. Defaults to None.
 
     Raises:
         NotImplementedError: if you use for a model which isn't implemented
@@ -65,13 +76,11 @@ def analyse_dataset(X:np.ndarray, Y:np.ndarray, coords, outfile, model:str='cca'
         fs = coords[1]['fs'] 
         print("X({})={}, Y={} @{}hz".format([c['name'] for c in coords], X.shape, Y.shape, fs))
         # Write metrics to file
-        with open('metrics.txt', 'a') as outfile:
-            outfile.write("X({})={}, Y={} @{}hz \n".format([c['name'] for c in coords], X.shape, Y.shape, fs))
+        write_metrics("X({})={}, Y={} @{}hz \n".format([c['name'] for c in coords], X.shape, Y.shape, fs), metrics)
     else:
         print("X={}, Y={} @{}hz".format(X.shape, Y.shape, fs))
         # Write metrics to file
-        with open('metrics.txt', 'a') as outfile:
-            outfile.write("X={}, Y={} @{}hz \n".format(X.shape, Y.shape, fs))
+        write_metrics("X={}, Y={} @{}hz \n".format(X.shape, Y.shape, fs), metrics)
     tau = int(tau_ms*fs/1000)
     offset=int(offset_ms*fs/1000)
 
@@ -80,8 +89,7 @@ def analyse_dataset(X:np.ndarray, Y:np.ndarray, coords, outfile, model:str='cca'
     C = .1/Cscale
 
     # Write metrics to file
-    with open('metrics.txt', 'a') as outfile:
-        outfile.write('Cscale={} \n'.format(Cscale))
+    write_metrics('Cscale={} \n'.format(Cscale), metrics)
 
     # create the model if not provided
     if isinstance(model,BaseSequence2Sequence):
@@ -168,8 +176,7 @@ def analyse_dataset(X:np.ndarray, Y:np.ndarray, coords, outfile, model:str='cca'
     print(clsfr)
     print("score={}".format(score))
 
-    with open('metrics.txt', 'a') as outfile:
-        outfile.write("score={} \n".format(score))
+    write_metrics("score={} \n".format(score), metrics)
 
     # compute decoding curve
     (dc) = decodingCurveSupervised(rawFy, marginalizedecis=True, minDecisLen=clsfr.minDecisLen, bwdAccumulate=clsfr.bwdAccumulate, priorsigma=(clsfr.sigma0_,clsfr.priorweight), softmaxscale=clsfr.softmaxscale_, nEpochCorrection=clsfr.startup_correction)
@@ -177,7 +184,94 @@ def analyse_dataset(X:np.ndarray, Y:np.ndarray, coords, outfile, model:str='cca'
     return score, dc, Fy, clsfr, res
 
 
-def analyse_datasets(dataset:str, model:str='cca', dataset_args:dict=None, loader_args:dict=None, preprocess_args:dict=None, clsfr_args:dict=None, tuned_parameters:dict=None, **kwargs):
+def analyse_file(loader, filename:str, loader_args:dict=None, preprocess_args:dict=None, model:str='cca', tuned_parameters:dict=None, clsfr_args:dict=None, buffer_output:bool=False, **kwargs):
+    """load, pre-process and analyse a single dataset file, capturing any errors
+
+    Args:
+        loader (function): the dataset loader function, as returned by `get_dataset`
+        filename (str): the file to load
+        loader_args ([dict], optional): additional arguments for the dataset loader. Defaults to None.
+        preprocess_args ([dict], optional): arguments for preprocess. Defaults to None.
+        model (str, optional): The type of model to fit. Defaults to 'cca'.
+        tuned_parameters ([dict], optional): sets of hyper-parameters to tune by GridCVSearch
+        clsfr_args ([dict], optional): additional aguments for the model_fitter. Defaults to None.
+        buffer_output (bool, optional): collect the printed output and metrics and return them, rather than writing them directly, e.g. when running in a worker process. Defaults to False.
+
+    Returns:
+        score (float): the cv score for this dataset, None if an error occured
+        decoding_curve (tuple): the decoding curve info as returned by `decodingCurveSupervised.py`
+        nout (int): the number of outputs in this dataset
+        error (str): the error message and traceback if an error occured, None otherwise
+        output (str): the captured printed output, if buffer_output
+        metrics (str): the captured metrics, if buffer_output
+    """
+    import io
+    import contextlib
+    import traceback
+    if loader_args is None: loader_args = dict()
+    if clsfr_args is None: clsfr_args = dict()
+    score, decoding_curve, nout, error = None, None, None, None
+    stdout = io.StringIO() if buffer_output else None
+    metrics = [] if buffer_output else None
+    with contextlib.redirect_stdout(stdout) if buffer_output else contextlib.nullcontext():
+        try:
+            X, Y, coords = loader(filename, **loader_args)
+            if preprocess_args is not None:
+                X, Y, coords = preprocess(X, Y, coords, **preprocess_args)
+            score, decoding_curve, _, _, _ = analyse_dataset(X, Y, coords, None, model, tuned_parameters=tuned_parameters, metrics=metrics, **clsfr_args, **kwargs)
+            nout = Y.shape[-1] if Y.ndim<=3 else Y.shape[-2]
+            del X, Y
+            gc.collect()
+        except Exception as ex:
+            error = "{}\n{}".format(ex, traceback.format_exc())
+    output = stdout.getvalue() if buffer_output else None
+    metrics = "".join(metrics) if buffer_output else None
+    return score, decoding_curve, nout, error, output, metrics
+
+
+def analyse_files_parallel(loader, filenames, n_jobs:int=-1, **kwargs):
+    """analyse a set of files in a pool of worker processes, yielding the results in file order
+
+    If a worker process dies, e.g. segfault or out-of-memory, then the file it was running is re-tried on its own
+    to identify which file caused the crash, and the unfinished files are re-started in a new pool.  The results
+    of the files which completed before the crash are kept.
+
+    Args:
+        loader (function): the dataset loader function, as returned by `get_dataset`
+        filenames (list-of-str): the files to analyse
+        n_jobs (int, optional): number of worker processes, <=0 for one per cpu. Defaults to -1.
+        kwargs: additional arguments for `analyse_file`
+
+    Yields:
+        (tuple): the results for each file, as returned by `analyse_file`
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from concurrent.futures.process import BrokenProcessPool
+    max_workers = n_jobs if n_jobs > 0 else None
+    executor = None
+    futures = dict()
+    for i, fi in enumerate(filenames):
+        if i not in futures: # (re)start the pool with the unfinished files
+            executor = ProcessPoolExecutor(max_workers=max_workers)
+            futures.update({j: executor.submit(analyse_file, loader, filenames[j], buffer_output=True, **kwargs)
+                            for j in range(i, len(filenames)) if j not in futures})
+        try:
+            yield futures.pop(i).result()
+        except BrokenProcessPool:
+            executor.shutdown()
+            # keep the results of the files which completed before the crash
+            futures = {j: f for j, f in futures.items() if f.done() and f.exception() is None}
+            # re-try this file on it's own to find if it is the cause
+            with ProcessPoolExecutor(max_workers=1) as single:
+                try:
+                    yield single.submit(analyse_file, loader, fi, buffer_output=True, **kwargs).result()
+                except BrokenProcessPool as ex:
+                    yield None, None, None, "worker process crashed: {!r}".format(ex), None, None
+    if executor is not None:
+        executor.shutdown()
+
+
+def analyse_datasets(dataset:str, model:str='cca', dataset_args:dict=None, loader_args:dict=None, preprocess_args:dict=None, clsfr_args:dict=None, tuned_parameters:dict=None, n_jobs:int=1, **kwargs):
     """analyse a set of datasets (multiple subject) and generate a summary decoding plot.
 
     Args:
@@ -187,30 +281,40 @@ def analyse_datasets(dataset:str, model:str='cca', dataset_args:dict=None, loade
         loader_args ([dict], optional): additional arguments for the dataset loader. Defaults to None.
         clsfr_args ([dict], optional): additional aguments for the model_fitter. Defaults to None.
         tuned_parameters ([dict], optional): sets of hyper-parameters to tune by GridCVSearch
+        n_jobs (int, optional): number of worker processes to analyse the files in parallel, <=0 for one per cpu. Results are reported in file order. Defaults to 1, i.e. in-process.
     """    
     if dataset_args is None: dataset_args = dict()
     if loader_args is None: loader_args = dict()
     if clsfr_args is None: clsfr_args = dict()
     loader, filenames, _ = get_dataset(dataset,**dataset_args)
+    file_args = dict(loader_args=loader_args, preprocess_args=preprocess_args, model=model, tuned_parameters=tuned_parameters, clsfr_args=clsfr_args, **kwargs)
+    if n_jobs is not None and n_jobs != 1 and len(filenames) > 1:
+        results = analyse_files_parallel(loader, filenames, n_jobs, **file_args)
+    else:
+        results = (analyse_file(loader, fi, **file_args) for fi in filenames)
+
     scores=[]
     decoding_curves=[]
     nout=[]
+    failed=[]
+    # N.B. collect the results in file order, so the output is deterministic
     for i, fi in enumerate(filenames):
         print("{}) {}".format(i, fi))
-        with open('metrics.txt', 'a') as outfile:
-            outfile.write("\n\n {}) {} \n".format(i, fi))
-        try:
-            X, Y, coords = loader(fi, **loader_args)
-            if preprocess_args is not None:
-                X, Y, coords = preprocess(X, Y, coords, **preprocess_args)
-            score, decoding_curve, _, _, _ = analyse_dataset(X, Y, coords, outfile, model, tuned_parameters=tuned_parameters, **clsfr_args, **kwargs)
-            nout.append(Y.shape[-1] if Y.ndim<=3 else Y.shape[-2])
-            scores.append(score)
-            decoding_curves.append(decoding_curve)
-            del X, Y
-            gc.collect()
-        except Exception as ex:
-            print("Error: {}\nSKIPPED".format(ex))
+        write_metrics("\n\n {}) {} \n".format(i, fi))
+        score, decoding_curve, nouti, error, output, metrics = next(results)
+        if output:
+            print(output, end='')
+        if metrics:
+            write_metrics(metrics)
+        if error is not None:
+            print("Error: {}\nSKIPPED".format(error))
+            failed.append(fi)
+            continue
+        nout.append(nouti)
+        scores.append(score)
+        decoding_curves.append(decoding_curve)
+    if failed:
+        print("{} of {} files failed: {}".format(len(failed), len(filenames), failed))
     avescore=sum(scores)/len(scores)
     avenout=sum(nout)/len(nout)
     print("\n--------\n\n Ave-score={}\n".format(avescore))
@@ -222,7 +326,7 @@ def analyse_datasets(dataset:str, model:str='cca', dataset_args:dict=None, loade
     plt.savefig("{}_decoding_curve.png".format(dataset))
     plt.show()
 
-    with open('metrics.txt', 'a') as outfile:
+    with open(METRICSFILE, 'a') as outfile:
         outfile.write("\n--------\n\n Ave-score={}\n".format(avescore))
         outfile.write("Ave-DC\n{}\n".format(print_decoding_curve(np.nanmean(int_len,0),np.nanmean(prob_err,0),np.nanmean(prob_err_est,0),np.nanmean(se,0),np.nanmean(st,0))))
 
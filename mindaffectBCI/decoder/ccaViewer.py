@@ -51,7 +51,7 @@ def run(ui: UtopiaDataInterface, timeout_ms: float=np.inf, tau_ms: float=500,
     irf_times = np.linspace(irf_range_ms[0], irf_range_ms[1], irflen_samp)
 
     # initialize the arrays to hold the stimulus responses, and their label info, and a current cursor
-    irf = np.zeros((nstimulus_events, irflen_samp, ui.data_ringbuffer.shape[-1] - 1)) # (nERP,irflen,d)
+    irf = np.zeros((nstimulus_events, irflen_samp, ui.data_ringbuffer.shape[-1])) # (nERP,irflen,d)
     irf_lab = np.zeros((nstimulus_events, len(evtlabs)), dtype=int)  # (nErp,nstim)
     nY = np.zeros(len(evtlabs),dtype=int)
 
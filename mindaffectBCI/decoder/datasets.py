@@ -28,6 +28,7 @@ from mindaffectBCI.decoder.offline.load_twofinger import load_twofinger
 from mindaffectBCI.decoder.offline.load_brainsonfire import load_brainsonfire
 from mindaffectBCI.decoder.offline.load_ninapro_db2 import load_ninapro_db2
 from mindaffectBCI.decoder.offline.load_mindaffectBCI import load_mindaffectBCI
+from mindaffectBCI.decoder.offline.dataset_cache import cached_loader
 from mindaffectBCI.decoder.utils import testSignal
 
 def plos_one():
@@ -199,18 +200,34 @@ def test_loader(loadfn, filenames, dataroot, **kwargs):
         except Exception as ex:
             print("ds={}\nFAILED\n{}".format(fn, ex))
 
-def get_dataset(dsname,*args, **kwargs):
+def get_dataset(dsname,*args, cache:bool=True, cachedir:str=None, **kwargs):
+    """get the loader function and filenames for the named dataset
+
+    Args:
+        dsname (str): the name of the dataset
+        cache (bool, optional): if True then wrap the loader with an on-disk cache of the loaded+pre-processed data, see `offline.dataset_cache`. Defaults to True.
+        cachedir (str, optional): the directory for the dataset cache.  Defaults to None, i.e. $MINDAFFECTBCI_CACHE_DIR or ~/.cache/mindaffectBCI/datasets
+
+    Returns:
+        loader (function): function to load a single dataset file, as `X, Y, coords = loader(filename, **loader_args)`
+        filenames (list-of-str): the files in this dataset
+        dataroot (str): the root directory for the dataset
+    """
     if dsname == 'openBMI_SSVEP':
-        return openBMI("SSVEP")
+        res = openBMI("SSVEP")
     elif dsname == 'openBMI_ERP':
-        return openBMI("ERP")
+        res = openBMI("ERP")
     elif dsname == 'openBMI_MI':
-        return openBMI("MI")
+        res = openBMI("MI")
     else:
         try:
-            return eval(dsname)(*args,**kwargs)
+            res = eval(dsname)(*args,**kwargs)
         except:
             raise NotImplementedError("don't know dataset {}".format(dsname))
+    if cache:
+        loader, filenames, dataroot = res
+        res = (cached_loader(loader, cachedir=cachedir), filenames, dataroot)
+    return res
 
 def testcase():
     datasets=["openBMI_MI","tactileP3","toy","mark_EMG","brainsonfire","twofinger","ninapro_db2","openBMI_MI","openBMI_ERP","openBMI_SSVEP","cocktail","lowlands","plos_one",'p300_prn',"mTRF_audio"]
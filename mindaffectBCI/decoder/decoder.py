@@ -24,12 +24,17 @@ from mindaffectBCI.decoder.model_fitting import BaseSequence2Sequence, MultiCCA
 from mindaffectBCI.decoder.decodingSupervised import decodingSupervised
 from mindaffectBCI.decoder.decodingCurveSupervised import decodingCurveSupervised, plot_decoding_curve
 from mindaffectBCI.decoder.scoreOutput import dedupY0
-from mindaffectBCI.decoder.updateSummaryStatistics import updateSummaryStatistics, plot_summary_statistics, plot_erp
-from mindaffectBCI.decoder.utils import search_directories_for_file
+from mindaffectBCI.decoder.stim2event import get_eventspec
+from mindaffectBCI.decoder.updateSummaryStatistics import updateSummaryStatistics, forgetting_weight, plot_summary_statistics, plot_erp
+from mindaffectBCI.decoder.utils import search_directories_for_file, RingBuffer
+from mindaffectBCI.decoder.model_snapshot import save_model_snapshot, load_model_snapshot, preprocessor_config
 from mindaffectBCI.decoder.normalizeOutputScores import normalizeOutputScores
+from mindaffectBCI.decoder.normalizeOutputScores_streamed import StreamedNormalizeOutputScores
 from mindaffectBCI.decoder.zscore2Ptgt_softmax import softmax
 import os
 import traceback
+import threading
+from collections import deque
 
 PYDIR = os.path.dirname(os.path.abspath(__file__))
 LOGDIR = os.path.join(PYDIR,'../../logs/')
@@ -128,7 +133,7 @@ def getCalibration_dataset(ui:UtopiaDataInterface):
         ui (UtopiaDataInterface): the data interface object
 
     Returns:
-        (list (data,stimulus)): list of pairs of time-stamped data and stimulus information as 2d (time,ch) (or (time,output)) numpy arrays
+        (list (data,data_ts,stimulus,stimulus_ts)): list of data and stimulus information as 2d (time,ch) (or (time,output)) numpy arrays, in the ring buffer types, with their time-stamps
     """
     
     # run until we get a mode change gathering training data in trials
@@ -140,6 +145,8 @@ def getCalibration_dataset(ui:UtopiaDataInterface):
         # get new messages from utopia-hub
         newmsgs, _, _ = ui.update()
         #  print("Extact_msgs:"); print("{}".format(newmsgs))
+        if ui.isEOF():
+            isCalibrating = False
 
         # incremental extract trial limits
         trials, start_ts, newmsgs = get_trial_start_end(newmsgs, start_ts)
@@ -147,10 +154,11 @@ def getCalibration_dataset(ui:UtopiaDataInterface):
         # extract any complete trials data/msgs
         for (bgn_ts, end_ts) in trials:
             # N.B. be sure to make a copy so isn't changed outside us..
-            data = ui.extract_data_segment(bgn_ts, end_ts)
-            stimulus = ui.extract_stimulus_segment(bgn_ts, end_ts)
+            # N.B. time-stamps kept separately, so the data keeps its (float32/uint8) ring buffer type
+            data, data_ts = ui.extract_data_segment_ts(bgn_ts, end_ts)
+            stimulus, stimulus_ts = ui.extract_stimulus_segment_ts(bgn_ts, end_ts)
             print("Extract trl: {}->{}: data={} stim={}".format(bgn_ts, end_ts, data.shape, stimulus.shape))
-            dataset.append((data, stimulus))
+            dataset.append((data, data_ts, stimulus, stimulus_ts))
 
         # check for end-calibration messages
         for i, m in enumerate(newmsgs):
@@ -163,11 +171,26 @@ def getCalibration_dataset(ui:UtopiaDataInterface):
 
     return dataset
 
+def split_dataset_trial(trial):
+    """get the data and stimulus, and their time-stamps, for a dataset trial
+
+    Args:
+        trial (tuple): (data,data_ts,stimulus,stimulus_ts), or (data,stimulus) with the time-stamps in the last channel as in older saved datasets
+
+    Returns:
+        (data,data_ts,stimulus,stimulus_ts): the data (time,ch), stimulus (time,outputs) and their time-stamps
+    """
+    if len(trial) == 4:
+        return trial
+    data, stimulus = trial
+    return data[:, :-1], data[:, -1], stimulus[:, :-1], stimulus[:, -1]
+
+
 def dataset_to_XY_ndarrays(dataset):
-    """convert a dataset, consisting of a list of pairs of time-stamped data and stimulus events, to 3-d matrices of X=(trials,samples,channels) and Y=(trials,samples,outputs)
+    """convert a dataset, consisting of a list of time-stamped data and stimulus events, to 3-d matrices of X=(trials,samples,channels) and Y=(trials,samples,outputs)
 
     Args:
-        dataset ([type]): list of pairs of time-stamped data and stimulus events
+        dataset ([type]): list of time-stamped data and stimulus events, see `split_dataset_trial`
 
     Returns:
         X (tr,samp,d): the per-trial data
@@ -178,39 +201,38 @@ def dataset_to_XY_ndarrays(dataset):
     if dataset is None or not hasattr(dataset, '__iter__'):
         print("Warning: empty dataset input!")
         return None, None, None, None
+    dataset = [split_dataset_trial(trl) for trl in dataset]
     # get length of each trial
     trlen = [trl[0].shape[0] for trl in dataset]
-    trstim = [trl[1].shape[0] for trl in dataset]
+    trstim = [trl[2].shape[0] for trl in dataset]
     print("Trlen: {}".format(trlen))
     print("Trstim: {}".format(trstim))
     # set array trial length to 90th percential length
     trlen = int(np.percentile(trlen, 75))
     trstim = max(20, int(np.percentile(trstim, 75)))
     # filter the trials to only be the  ones long enough to be worth processing
-    dataset = [d for d in dataset if d[0].shape[0] > trlen//2 and d[1].shape[0] > trstim//2]
+    dataset = [d for d in dataset if d[0].shape[0] > trlen//2 and d[2].shape[0] > trstim//2]
     if trlen == 0 or len(dataset) == 0:
         return None, None, None, None
 
     # map to single fixed size matrix + upsample stimulus to he EEG sample rate
-    Y = np.zeros((len(dataset), trlen, 256), dtype=dataset[0][1].dtype)
-    X = np.zeros((len(dataset), trlen, dataset[0][0].shape[-1]-1), dtype=dataset[0][0].dtype)  # zero-padded data, w/o time-stamps
+    Y = np.zeros((len(dataset), trlen, dataset[0][2].shape[-1]), dtype=dataset[0][2].dtype)
+    X = np.zeros((len(dataset), trlen, dataset[0][0].shape[-1]), dtype=dataset[0][0].dtype)  # zero-padded data
     X_ts = np.zeros((len(dataset),trlen),dtype=int)
     Y_ts = np.zeros((len(dataset),trlen),dtype=int)
-    for ti, (data, stimulus) in enumerate(dataset):
-        # extract the data & remove the timestamp channel and insert into the ndarray
+    for ti, (data, data_ts, stimulus, stimulus_ts) in enumerate(dataset):
+        # insert the data into the ndarray
         # guard for slightly different sizes..
         if X.shape[1] <= data.shape[0]:
-            X[ti, :, :] = data[:X.shape[1], :-1]
-            X_ts[ti, :] = data[:X.shape[1], -1]
+            X[ti, :, :] = data[:X.shape[1], :]
+            X_ts[ti, :] = data_ts[:X.shape[1]]
         else:  # pad end with final value
-            X[ti, :data.shape[0], :] = data[:, :-1]
-            X[ti, data.shape[0]:, :] = data[-1, :-1]
-            X_ts[ti, :data.shape[0]] = data[:, -1]
+            X[ti, :data.shape[0], :] = data
+            X[ti, data.shape[0]:, :] = data[-1, :]
+            X_ts[ti, :data.shape[0]] = data_ts
 
         # upsample stimulus to the data-sample rate and insert into ndarray
-        data_ts = data[:, -1]  # data timestamp per sample
-        stimulus_ts = stimulus[:, -1]  # stimulus timestamp per stimulus event
-        stimulus, data_i = upsample_stimseq(data_ts, stimulus[:, :-1], stimulus_ts)
+        stimulus, data_i = upsample_stimseq(data_ts, stimulus, stimulus_ts)
         # store -- compensating for any variable trial lengths.
         if Y.shape[1] < stimulus.shape[0]: # long trial
             Y[ti, :, :] = stimulus[:Y.shape[1], :]
@@ -247,7 +269,7 @@ def load_previous_dataset(f:str):
         f (str, file-like): buffered interface to the data and stimulus streams
 
     Returns:
-        (list of (data,stimulus)): list of stimulus,data pairs for each trial
+        (list of tuple): list of the data and stimulus for each trial, see `split_dataset_trial`
     """
     import pickle
     import glob
@@ -269,6 +291,46 @@ def load_previous_dataset(f:str):
     return dataset
 
 
+def load_model(f:str):
+    """
+    search standard directory locations and load a previously saved model snapshot, see `save_model`
+
+    Args:
+        f (str, file-like): the snapshot file to load, can include wildcards, in which case the most recent match is used
+
+    Returns:
+        clsfr (BaseSequence2Sequence): the fitted classifier
+        preprocessor (TransformerMixin): the data pre-processor configured as when the model was fitted, or None
+        fs (float): the sample rate of the data the model was fitted to
+    """
+    import glob
+    if isinstance(f,str): # filename to load from
+        # search in likely model locations for the file to load
+        f = search_directories_for_file(f,
+                                        PYDIR,
+                                        os.path.join(PYDIR,'..','..'),
+                                        LOGDIR)
+        # pick the most recent if multiple files match
+        f = max(glob.glob(f), key=os.path.getctime)
+    return load_model_snapshot(f)
+
+
+def save_model(clsfr: BaseSequence2Sequence, ui: UtopiaDataInterface):
+    """
+    save a snapshot of the fitted model to the LOGDIR, for fast warm starts with the `model` argument to `run`
+
+    Args:
+        clsfr (BaseSequence2Sequence): the fitted classifier
+        ui (UtopiaDataInterface): the data interface, for the sample rate and pre-processor configuration
+    """
+    try:
+        fn = os.path.join(LOGDIR,'model_{}.npz'.format(UNAME))
+        print('Saving model to {}'.format(fn))
+        save_model_snapshot(fn, clsfr, fs=ui.fs, preprocessor=ui.data_preprocessor)
+    except:
+        print('Error saving model')
+
+
 def doCalibrationSupervised(ui: UtopiaDataInterface, clsfr: BaseSequence2Sequence, **kwargs):
     """
     do a calibration phase = basically just extract  the training data and train a classifier from the utopiaInterface
@@ -331,11 +393,11 @@ def doModelFitting(clsfr: BaseSequence2Sequence, dataset,
             print("Warning: couldn't load / user prior_dataset: {}".format(prior_dataset))
             prior_dataset = None
     if prior_dataset is not None: # combine with the old calibration data
-        p_n_ch = [ x.shape[-1] for (x,_) in prior_dataset ]
+        p_n_ch = [ split_dataset_trial(trl)[0].shape[-1] for trl in prior_dataset ]
         p_n_ch = max(p_n_ch) if len(p_n_ch)>0 else -1
         if dataset is not None:
             # validate the 2 datasets are compatiable -> same number channels in X
-            d_n_ch = [ x.shape[-1] for (x,_) in dataset ]
+            d_n_ch = [ split_dataset_trial(trl)[0].shape[-1] for trl in dataset ]
             d_n_ch = max(d_n_ch) if len(d_n_ch)>0 else -1
             if d_n_ch == p_n_ch and d_n_ch > 0: # match the max channels info
                 dataset.extend(prior_dataset)
@@ -429,7 +491,51 @@ def doModelFitting(clsfr: BaseSequence2Sequence, dataset,
     return perr, dataset, X, Y
 
 
-def doPrediction(clsfr: BaseSequence2Sequence, data, stimulus, prev_stimulus=None):
+def needs_float_stimulus(clsfr: BaseSequence2Sequence):
+    """
+    check if the classifiers brain event coding needs the stimulus as float, i.e. signed values
+
+    Args:
+        clsfr (BaseSequence2Sequence): the trained classifier
+
+    Returns:
+        bool: True if the stimulus should be converted to float before prediction
+    """
+    evtlabs = getattr(clsfr, 'evtlabs', None)
+    return evtlabs is not None and any('grad' in e for e in evtlabs)
+
+
+# event types which only depend on the last few samples of the same outputs stimulus
+# N.B. patterns must also include a 1, so they don't match an output before it's first stimulus
+STREAMABLE_EVENT_OPS = ('pattern', 'diff', 'grad', 'raw')
+
+def get_clsfr_eventspec(clsfr: BaseSequence2Sequence):
+    """get the pre-compiled brain event coding of the classifier, or None for the raw stimulus"""
+    evtlabs = getattr(clsfr, 'evtlabs', None)
+    if evtlabs is None:
+        return None
+    return get_eventspec((evtlabs,) if isinstance(evtlabs, str) else tuple(evtlabs))
+
+
+def is_streamable(clsfr: BaseSequence2Sequence):
+    """
+    check if the classifiers brain event coding can be computed incrementally, i.e. an outputs events only depend on the last few samples of it's stimulus
+
+    N.B. events which depend on the other outputs, e.g. non-target or 'rest', on the whole trial, e.g. 'onset', or which
+    match an output before it is first stimulated, e.g. '0', are not streamable
+
+    Args:
+        clsfr (BaseSequence2Sequence): the trained classifier
+
+    Returns:
+        bool: True if the classifier can be applied with a `StreamingPredictor`
+    """
+    spec = get_clsfr_eventspec(clsfr)
+    return spec is None or all(op in STREAMABLE_EVENT_OPS and modifier is None and (not op == 'pattern' or '1' in arg)
+                               for op, arg, modifier in spec.ops)
+
+
+def doPrediction(clsfr: BaseSequence2Sequence, data, stimulus, prev_stimulus=None, data_ts=None, stimulus_ts=None):
     """
     given the current trials data, apply the classifier and decoder to make target predictions
 
@@ -438,19 +544,22 @@ def doPrediction(clsfr: BaseSequence2Sequence, data, stimulus, prev_stimulus=Non
         data (np.ndarray (time,channels)): the pre-processed EEG data
         stimulus (np.ndarray (time,outputs)): the raw stimulus information
         prev_stimulus (np.ndarray, optional): previous stimulus before stimulus -- poss needed for correct event coding. Defaults to None.
+        data_ts (np.ndarray (time,), optional): time-stamps for data. If None then the last channel of data is the time-stamp. Defaults to None.
+        stimulus_ts (np.ndarray (time,), optional): time-stamps for stimulus. If None then the last channel of stimulus is the time-stamp. Defaults to None.
 
     Returns:
         (np.ndarray (time,outputs)): Fy scores for each output at each time-point
     """    
     
-    X = data[:, :-1]
-    X_ts = data[:, -1]
-    Y = stimulus[:, :-1]
-    Y_ts = stimulus[:, -1]
+    X, X_ts = (data[:, :-1], data[:, -1]) if data_ts is None else (data, data_ts)
+    Y, Y_ts = (stimulus[:, :-1], stimulus[:, -1]) if stimulus_ts is None else (stimulus, stimulus_ts)
     if X_ts.size == 0 or Y_ts.size == 0: # fast path empty inputs
         return None
     # strip outputs that we don't use, to save compute time
     Y, used_idx = strip_unused(Y)
+    # N.B. keep the stimulus state packed, unless need float, e.g. for the gradient of un-signed stimulus state
+    if needs_float_stimulus(clsfr):
+        Y = Y.astype(np.float32)
     # strip the true target info if it's a copy, so it doesn't mess up Py computation
     #Y = dedupY0(Y, zerodup=False, yfeatdim=False)
     # up-sample Y to the match the rate of X
@@ -464,6 +573,278 @@ def doPrediction(clsfr: BaseSequence2Sequence, data, stimulus, prev_stimulus=Non
     return Fy
 
 
+class StreamingPredictor:
+    """
+    incrementally apply a trained classifier to a data and stimulus stream
+
+    N.B. only the outputs stimulated so far are scored, so this is only equivalent to scoring the whole trial
+    if the brain event coding is incremental, see `is_streamable`.
+
+    Each update only processes the new samples, plus the response length (tau) overlap needed to
+    compute complete responses, and the output scores are kept in a fixed size ring-buffer, so
+    the cost of an update is independent of the trial length.  The output score normalization
+    is also incremental, see `StreamedNormalizeOutputScores`.
+    """
+
+    def __init__(self, clsfr: BaseSequence2Sequence, maxDecisLen_samp:int, histlen:int=None):
+        """
+        incrementally apply a trained classifier to a data and stimulus stream
+
+        Args:
+            clsfr (BaseSequence2Sequence): the trained classifier to apply to the data
+            maxDecisLen_samp (int): the maximum number of samples of output scores to keep
+            histlen (int, optional): number of samples of stimulus history needed to compute the brain events. Defaults to None, i.e. at least 3 or the longest event pattern.
+        """
+        self.clsfr = clsfr
+        self.maxDecisLen_samp = maxDecisLen_samp
+        if histlen is None:
+            spec = get_clsfr_eventspec(clsfr)
+            histlen = max(3, spec.patlen-1) if spec is not None else 3
+        offset = clsfr.offset if clsfr.offset is not None else 0
+        offsets = clsfr.prediction_offsets if clsfr.prediction_offsets is not None else (0,)
+        if not hasattr(offsets, '__iter__'):
+            offsets = (offsets,)
+        # samples before the first new sample needed to compute it's score
+        self.lead = histlen + max(0, -offset) + max(0, max(offsets))
+        # samples after the last new sample needed to compute it's score
+        self.tail = clsfr.tau + max(0, offset) + max(0, -min(offsets))
+        self.Fy_ringbuffer = None
+        priorsigma = (clsfr.sigma0_, clsfr.priorweight) if getattr(clsfr, 'sigma0_', None) is not None else None
+        self.normalizer = StreamedNormalizeOutputScores(minDecisLen=clsfr.minDecisLen, nEpochCorrection=clsfr.startup_correction, priorsigma=priorsigma)
+        self.reset()
+
+    def reset(self, start_ts:float=None):
+        """
+        start a new trial, clearing the output score history
+
+        Args:
+            start_ts (float, optional): time-stamp of the start of the trial. Defaults to None.
+        """
+        self.next_ts = start_ts # start of the next block to process
+        self.nscored = 0 # samples at the start of the next block which are already scored
+        self.used_idx = np.zeros((256,), dtype=bool) # outputs used in this trial
+        self.used_idx[0] = True # force include 0
+        if self.Fy_ringbuffer is not None:
+            self.Fy_ringbuffer.clear()
+        self.normalizer.reset()
+
+    def update(self, data, data_ts, stimulus, stimulus_ts):
+        """
+        score a new block of data and stimulus, extracted from `next_ts`
+
+        Args:
+            data (np.ndarray (time,channels)): the pre-processed EEG data
+            data_ts (np.ndarray (time,)): time-stamps for data
+            stimulus (np.ndarray (time,256)): the raw stimulus information
+            stimulus_ts (np.ndarray (time,)): time-stamps for stimulus
+
+        Returns:
+            int: the number of new samples of output scores
+        """
+        bgn = self.nscored
+        end = data.shape[0] - self.tail
+        if end <= bgn or stimulus.shape[0] == 0:
+            return 0
+        # track the outputs used in this trial, and strip the unused ones to save compute time
+        self.used_idx = np.logical_or(self.used_idx, np.any(stimulus, 0))
+        # N.B. keep the stimulus state packed, unless need float, e.g. for the gradient of un-signed stimulus state
+        Y = stimulus[:, self.used_idx]
+        if needs_float_stimulus(self.clsfr):
+            Y = Y.astype(np.float32)
+        # up-sample Y to the match the rate of X
+        Y, _ = upsample_stimseq(data_ts, Y, stimulus_ts)
+        Fy_1 = self.clsfr.predict(data, Y, dedup0=-1)  # predict, removing objID==0
+        # keep only the complete new scores, mapped-back to 256
+        Fy = np.zeros(Fy_1.shape[:-2]+(end-bgn, 256), dtype=Fy_1.dtype)
+        Fy[..., self.used_idx] = Fy_1[..., bgn:end, :]
+        self.normalizer.update(Fy)
+
+        # store with time as the first axis
+        Fy = np.moveaxis(Fy, -2, 0)[-self.maxDecisLen_samp:, ...]
+        if self.Fy_ringbuffer is None or not self.Fy_ringbuffer.elementshape == Fy.shape[1:]:
+            self.Fy_ringbuffer = RingBuffer(self.maxDecisLen_samp, Fy.shape[1:], dtype=Fy.dtype)
+        self.Fy_ringbuffer.extend(Fy)
+
+        # start the next block lead samples before the first un-scored sample
+        # N.B. +1 as the segment extraction includes the sample before the start time-stamp
+        if end >= self.lead:
+            self.next_ts = data_ts[end - self.lead + 1]
+            self.nscored = self.lead
+        else: # not enough samples before, so re-start from the same place
+            self.nscored = end
+        return Fy.shape[0]
+
+    def Fy(self):
+        """
+        get the output scores for the current trial, upto maxDecisLen_samp long
+
+        Returns:
+            (np.ndarray (...,time,256)): view of the Fy scores for each output at each time-point
+        """
+        if self.Fy_ringbuffer is None:
+            return None
+        return np.moveaxis(self.Fy_ringbuffer.unwrap(), 0, -2)
+
+    def decode_proba(self, used_idx=None, marginalizemodels:bool=True, marginalizedecis:bool=False):
+        """
+        get the target probabilities for the current trial, as for `clsfr.decode_proba(Fy[...,used_idx])`
+
+        Args:
+            used_idx (np.ndarray (256,) bool, optional): the outputs to decode. Defaults to the used outputs.
+            marginalizemodels (bool, optional): flag if we should marginalize over models. Defaults to True.
+            marginalizedecis (bool, optional): flag if we should marginalize over decision points. Defaults to False.
+
+        Returns:
+            Ptgt (np.ndarray (tr,nDecis,nY)): probability of each output being the target for each decision point
+        """
+        if used_idx is None:
+            used_idx = self.used_idx
+        if self.clsfr.bwdAccumulate or self.Fy_ringbuffer.n > self.maxDecisLen_samp:
+            # sliding window or backward accumulation -> batch normalization
+            return self.clsfr.decode_proba(self.Fy()[..., used_idx], marginalizemodels=marginalizemodels, marginalizedecis=marginalizedecis,
+                                           minDecisLen=self.clsfr.minDecisLen, bwdAccumulate=self.clsfr.bwdAccumulate)
+        softmaxscale = getattr(self.clsfr, 'softmaxscale_', None)
+        Ptgt = self.normalizer.decode_proba(used_idx, softmaxscale=softmaxscale if softmaxscale is not None else 3.5,
+                                            marginalizemodels=marginalizemodels, marginalizedecis=marginalizedecis)
+        if marginalizemodels and Ptgt.ndim>3 and Ptgt.shape[-4]==1: # hide our internal (marginalized) model dimension
+            Ptgt = Ptgt[0,...]
+        return Ptgt
+
+
+class OnlineModelUpdater:
+    """
+    incrementally adapt a fitted `MultiCCA` model to the data from the prediction trials
+
+    After each selection the trial's data, labelled with the selected output, is folded into exponentially
+    weighted summary statistics, starting from the calibration statistics, and the model is re-solved in a
+    background thread.  The new model is only copied into the live classifier by `swap`, which should be
+    called from the prediction thread between trials, so adaptation never delays or changes a running prediction.
+    """
+
+    def __init__(self, clsfr: MultiCCA, halflife_samp:float=None):
+        """
+        incrementally adapt a fitted `MultiCCA` model to the data from the prediction trials
+
+        Args:
+            clsfr (MultiCCA): the fitted live classifier, with the calibration summary statistics in `summary_statistics_`
+            halflife_samp (float, optional): half-life in samples of the exponential forgetting, None for no forgetting. Defaults to None.
+        """
+        self.clsfr = clsfr
+        self.halflife_samp = halflife_samp
+        # exponentially weighted sums, starting from the calibration statistics, with weight 1 per trial
+        Cxx, Cxy, Cyy, muX, nTrl = clsfr.summary_statistics_
+        self.Cxx, self.Cxy, self.Cyy, self.muX = (nTrl*Cxx, nTrl*Cxy, nTrl*Cyy, nTrl*muX)
+        self.N = nTrl
+        self.ntrials = 0
+        self.trials = deque() # trials waiting to be processed by the update thread
+        self.new_trial = threading.Event()
+        self.stop = threading.Event()
+        self.update = None # (version, W, R, A, b) of the latest re-solved model
+        self.version = 0 # version of the model in the live classifier
+        self.thread = threading.Thread(target=self.update_loop, daemon=True, name='OnlineModelUpdater')
+        self.thread.start()
+
+    def add_trial(self, data, data_ts, stimulus, stimulus_ts, objID:int):
+        """
+        queue a completed trial for folding into the model
+
+        Args:
+            data (np.ndarray (time,channels)): the pre-processed EEG data
+            data_ts (np.ndarray (time,)): time-stamps for data
+            stimulus (np.ndarray (time,256)): the raw stimulus information
+            stimulus_ts (np.ndarray (time,)): time-stamps for stimulus
+            objID (int): the selected output, which is used as the true target
+        """
+        # N.B. copy as the data may be changed when the ring-buffers wrap
+        self.trials.append((np.array(data), np.array(data_ts), np.array(stimulus), np.array(stimulus_ts), objID))
+        self.new_trial.set()
+
+    def update_loop(self):
+        """main loop for the update thread, fold in the queued trials and re-solve the model"""
+        while not self.stop.is_set():
+            self.new_trial.wait(.5)
+            self.new_trial.clear()
+            self.process_trials()
+
+    def process_trials(self):
+        """fold in all the queued trials, and re-solve the model if any were added"""
+        nnew = 0
+        while self.trials:
+            try:
+                nnew += self.fold_trial(*self.trials.popleft())
+            except:
+                traceback.print_exc()
+        if nnew > 0:
+            try:
+                self.solve()
+            except:
+                traceback.print_exc()
+
+    def fold_trial(self, data, data_ts, stimulus, stimulus_ts, objID:int):
+        """add a trial to the exponentially weighted summary statistics, returns the number of trials added"""
+        clsfr = self.clsfr
+        if data.shape[0] <= clsfr.tau or stimulus.shape[0] == 0:
+            return 0
+        if objID is None or objID < 0 or objID >= stimulus.shape[-1]:
+            print("Warning: unknown selected output {}, trial ignored".format(objID))
+            return 0
+        # put the selected output first, as the true target, followed by the other used outputs
+        used = np.flatnonzero(np.any(stimulus, 0))
+        Y = stimulus[:, np.concatenate(([objID], used[used != objID]))]
+        if needs_float_stimulus(clsfr):
+            Y = Y.astype(np.float32)
+        Y, _ = upsample_stimseq(data_ts, Y, stimulus_ts)
+        if not np.any(Y[:, 0]):
+            print("Warning: selected output {} not stimulated, trial ignored".format(objID))
+            return 0
+        Y_true = clsfr.stim2event(Y[np.newaxis, ...])[..., 0:1, :] # (1,samp,1,e)
+        X = data[np.newaxis, ...]
+        wght = forgetting_weight(X.shape[1], self.halflife_samp)
+        self.Cxx, self.Cxy, self.Cyy = updateSummaryStatistics(X, Y_true, None, Cxx=self.Cxx, Cxy=self.Cxy, Cyy=self.Cyy,
+                                                               halflife_samp=self.halflife_samp, tau=clsfr.tau, offset=clsfr.offset,
+                                                               badEpThresh=clsfr.badEpThresh, center=clsfr.center, toeplitz=clsfr.toeplitzCyy)
+        self.muX = wght*self.muX + np.mean(data, 0)
+        self.N = wght*self.N + 1
+        self.ntrials += 1
+        return 1
+
+    def solve(self):
+        """re-solve the model from the weighted statistics, and make it available to `swap`"""
+        import copy
+        # fit a shallow copy, so the live model is unchanged
+        clsfr = copy.copy(self.clsfr)
+        clsfr.fit_cca(self.Cxx/self.N, self.Cxy/self.N, self.Cyy/self.N, dtype=self.clsfr.W_.dtype)
+        clsfr.fit_b(muX=self.muX/self.N)
+        # N.B. single assignment, so the prediction thread always sees a complete model
+        self.update = (self.ntrials, clsfr.W_, clsfr.R_, clsfr.A_, clsfr.b_)
+        print("Online update: model re-fit with {} trials".format(self.ntrials))
+
+    def swap(self):
+        """
+        copy the latest re-solved model into the live classifier, N.B. call from the prediction thread
+
+        Returns:
+            bool: True if the live model was changed
+        """
+        update = self.update
+        if update is None or update[0] == self.version:
+            return False
+        self.version, self.clsfr.W_, self.clsfr.R_, self.clsfr.A_, self.clsfr.b_ = update
+        return True
+
+    def close(self):
+        """stop the update thread, fold any still queued trials, and store the latest model and statistics in the live classifier"""
+        self.stop.set()
+        self.new_trial.set()
+        self.thread.join()
+        # N.B. the thread may exit before processing the last trials
+        self.process_trials()
+        self.swap()
+        # so the next prediction phase continues from the adapted statistics
+        N = self.N
+        self.clsfr.summary_statistics_ = (self.Cxx/N, self.Cxy/N, self.Cyy/N, self.muX/N, N)
+
+
 def combine_Ptgt(pvals_objIDs):
     """combine target probabilities in a correct way
 
@@ -524,14 +905,21 @@ def send_prediction(ui: UtopiaDataInterface, Ptgt, used_idx=None, timestamp:int=
     ui.sendMessage(PredictedTargetDist(timestamp, used_idx, Ptgt))
     
 
-def doPredictionStatic(ui: UtopiaDataInterface, clsfr: BaseSequence2Sequence, model_apply_type:str='trial', timeout_ms:float=None, block_step_ms:float=100, maxDecisLen_ms:float=8000):
+def doPredictionStatic(ui: UtopiaDataInterface, clsfr: BaseSequence2Sequence, model_apply_type:str='stream', timeout_ms:float=None, block_step_ms:float=100, maxDecisLen_ms:float=8000,
+                       online_update:bool=False, online_halflife_ms:float=None):
     """ 
     do the prediction stage = basically extract data/msgs from trial start and generate a prediction from them '''
 
     Args:
         ui (UtopiaDataInterface): buffered interface to the data and stimulus streams
         clsfr (BaseSequence2Sequence): the trained classification model
+        model_apply_type (str, optional): how to apply the model to the data stream, one-of:
+              'stream' - incrementally score only the new data, see `StreamingPredictor`,
+              'trial' - re-score all the data from the trial start at every update,
+              'block' - score non-overlapping blocks and accumulate the scores.  Defaults to 'stream'.
         maxDecisLen_ms (float, optional): the maximum amount of data to use to make a prediction, i.e. prediction sliding window size.  Defaults to 8000
+        online_update (bool, optional): adapt the model to the selected trials, see `OnlineModelUpdater`. Defaults to False.
+        online_halflife_ms (float, optional): half-life of the online model adaption, None for no forgetting. Defaults to None.
 
     """
     if not clsfr.is_fitted():
@@ -551,12 +939,28 @@ def doPredictionStatic(ui: UtopiaDataInterface, clsfr: BaseSequence2Sequence, mo
     overlap_ms = overlap_samp * 1000 / ui.fs
     maxDecisLen_samp = int(maxDecisLen_ms * ui.fs / 1000)
     Fy = None # (1,nSamp,nY):float score for each output for each sample
+    if model_apply_type == 'stream' and not is_streamable(clsfr):
+        # the events for an output depend on more than the last few samples of it's stimulus
+        print("Warning: streaming prediction not supported for evtlabs={}, using 'trial'".format(clsfr.evtlabs))
+        model_apply_type = 'trial'
+    predictor = StreamingPredictor(clsfr, maxDecisLen_samp) if model_apply_type == 'stream' else None
+    updater = None
+    if online_update:
+        if getattr(clsfr, 'summary_statistics_', None) is not None:
+            halflife_samp = online_halflife_ms * ui.fs / 1000 if online_halflife_ms is not None else None
+            updater = OnlineModelUpdater(clsfr, halflife_samp)
+        else:
+            print("Warning: online update needs a model with summary statistics.  Ignored!")
+    online_trials = [] # (bgn_ts,end_ts,objID) of selected trials waiting for their final responses
     trial_start_ts = None
     isPredicting = True
     # run until we get a mode change gathering training data in trials
     while isPredicting:
         # get new messages from utopia-hub
         newmsgs, ndata, nstim = ui.update(timeout_ms=timeout_ms,mintime_ms=timeout_ms//2)
+        # stop at the end of a replayed save file, after processing the final messages
+        if ui.isEOF():
+            isPredicting = False
 
         # TODO[]: Fix to not re-process the same data if no new stim to be processed..
         if len(newmsgs) == 0 and nstim == 0 and ndata == 0:
@@ -572,14 +976,29 @@ def doPredictionStatic(ui: UtopiaDataInterface, clsfr: BaseSequence2Sequence, mo
         
         # incremental extract trial limits
         otrial_start_ts = trial_start_ts
+        selections = {m.timestamp: m.objID for m in newmsgs if m.msgID == Selection.msgID}
         trials, trial_start_ts, newmsgs = get_trial_start_end(newmsgs, trial_start_ts)
 
+        if updater is not None:
+            online_trials.extend((bgn_ts, end_ts, selections[end_ts]) for (bgn_ts, end_ts) in trials if end_ts in selections)
+            # fold in the selected trials, once the responses to the last stimuli have arrived
+            while online_trials and online_trials[0][1] + overlap_ms <= ui.data_timestamp:
+                bgn_ts, end_ts, objID = online_trials.pop(0)
+                data, data_ts = ui.extract_data_segment_ts(bgn_ts, end_ts + overlap_ms, copy=False)
+                stimulus, stimulus_ts = ui.extract_stimulus_segment_ts(bgn_ts, end_ts, copy=False)
+                updater.add_trial(data, data_ts, stimulus, stimulus_ts, objID)
+
         # change in trial-start -> end-of-trial / start new trial detected
         if not trial_start_ts == otrial_start_ts:
             print("New trial! tr_start={}".format(trial_start_ts))
 
+            # use the latest adapted model from the next trial
+            if updater is not None and updater.swap():
+                print("Online update: using model v{}".format(updater.version))
             Fy = None
             block_start_ts = trial_start_ts
+            if predictor is not None:
+                predictor.reset(trial_start_ts)
 
         # compute the start/end of the segement to apply the model to
         if model_apply_type == 'trial':
@@ -606,49 +1025,66 @@ def doPredictionStatic(ui: UtopiaDataInterface, clsfr: BaseSequence2Sequence, mo
 
             # extract and apply to this block
             print("Extract block: {}->{} = {}ms".format(block_start_ts, block_end_ts, block_end_ts-block_start_ts))
-            data = ui.extract_data_segment(block_start_ts, block_end_ts)
-            stimulus = ui.extract_stimulus_segment(block_start_ts, block_end_ts)
+            # N.B. no copy, as the block is used before the next ui.update
+            data, data_ts = ui.extract_data_segment_ts(block_start_ts, block_end_ts, copy=False)
+            stimulus, stimulus_ts = ui.extract_stimulus_segment_ts(block_start_ts, block_end_ts, copy=False)
             # skip if no data/stimulus to process
             if data.size == 0 or stimulus.size == 0:
                 continue
 
-            print('got: data {}->{} ({})  stimulus {}->{} ({}>0)'.format(data[0, -1], data[-1, -1], data.shape[0],
-                                                              stimulus[0, -1], stimulus[-1, -1], np.sum(stimulus[:,0])))
+            print('got: data {}->{} ({})  stimulus {}->{} ({}>0)'.format(data_ts[0], data_ts[-1], data.shape[0],
+                                                              stimulus_ts[0], stimulus_ts[-1], np.sum(stimulus[:,0])))
             if model_apply_type == 'block':
                 # update the start point for the next block
                 # start next block at overlap before the end of this blocks data
                 # so have sample accurate predictions, with no missing data, and no overlaps
-                block_start_ts = data[-overlap_samp+1, -1]  # ~= block_end_ts - overlap_ms +1-sample
+                block_start_ts = data_ts[-overlap_samp+1]  # ~= block_end_ts - overlap_ms +1-sample
                 bend = block_start_ts + block_step_ms + overlap_ms
                 print("next block {}->{}: in {}ms".format(block_start_ts, bend, bend - ui.data_timestamp))
 
-            # get predictions for this data block
-            block_Fy = doPrediction(clsfr, data, stimulus)
-            # strip predictions from the overlap period
-            block_Fy = block_Fy[..., :-overlap_samp, :]
+            if model_apply_type == 'stream':
+                # only score the new data, the scores for the (length limited) trial are in the predictor
+                block_Fy = None
+                if predictor.update(data, data_ts, stimulus, stimulus_ts) > 0:
+                    block_Fy = Fy = predictor.Fy()
+                    used_idx = predictor.used_idx.copy()
+                # start the next block from the first un-scored sample
+                block_start_ts = predictor.next_ts
+
+            else:
+                # get predictions for this data block
+                block_Fy = doPrediction(clsfr, data, stimulus, data_ts=data_ts, stimulus_ts=stimulus_ts)
+                # strip predictions from the overlap period
+                if block_Fy is not None:
+                    block_Fy = block_Fy[..., :-overlap_samp, :]
 
             # if got valid predictions...
             if block_Fy is not None:
-                # accumulate or store the predictions
-                if model_apply_type == 'trial':
-                    Fy = block_Fy
-                elif model_apply_type == 'block':  # accumulate blocks in the trial
-                    if Fy is None:  # restart accumulation
+                if not model_apply_type == 'stream':
+                    # accumulate or store the predictions
+                    if model_apply_type == 'trial':
                         Fy = block_Fy
-                    else:
-                        Fy = np.append(Fy, block_Fy, -2)
-                # limit the trial length
-                if maxDecisLen_ms > 0 and Fy.shape[-2] > maxDecisLen_samp:
-                    print("limit trial length {} -> {}".format(Fy.shape[-2], maxDecisLen_samp))
-                    Fy = Fy[..., -maxDecisLen_samp:, :]
+                    elif model_apply_type == 'block':  # accumulate blocks in the trial
+                        if Fy is None:  # restart accumulation
+                            Fy = block_Fy
+                        else:
+                            Fy = np.append(Fy, block_Fy, -2)
+                    # limit the trial length
+                    if maxDecisLen_ms > 0 and Fy.shape[-2] > maxDecisLen_samp:
+                        print("limit trial length {} -> {}".format(Fy.shape[-2], maxDecisLen_samp))
+                        Fy = Fy[..., -maxDecisLen_samp:, :]
+
+                    # only process the used-subset
+                    used_idx = np.any(Fy.reshape((-1, Fy.shape[-1])), 0)
+                    used_idx[0] = True # force include 0
 
                 # send prediction event
-                # only process the used-subset
-                used_idx = np.any(Fy.reshape((-1, Fy.shape[-1])), 0)
-                used_idx[0] = True # force include 0
                 # map to probabilities, including the prior over sigma! as the clsfr is configured
-                Ptgt = clsfr.decode_proba(Fy[...,used_idx], marginalizedecis=True, marginalizemodels=True,
-                                          minDecisLen=clsfr.minDecisLen, bwdAccumulate=clsfr.bwdAccumulate)
+                if model_apply_type == 'stream':
+                    Ptgt = predictor.decode_proba(used_idx, marginalizedecis=True, marginalizemodels=True)
+                else:
+                    Ptgt = clsfr.decode_proba(Fy[...,used_idx], marginalizedecis=True, marginalizemodels=True,
+                                              minDecisLen=clsfr.minDecisLen, bwdAccumulate=clsfr.bwdAccumulate)
                 # BODGE: only  use the last (most data?) prediction...
                 Ptgt = Ptgt[-1, -1, :] if Ptgt.ndim==3 else Ptgt[0,-1,-1,:]
                 if PREDICTIONPLOTS and guiplots and len(Ptgt)>1:
@@ -676,6 +1112,16 @@ def doPredictionStatic(ui: UtopiaDataInterface, clsfr: BaseSequence2Sequence, mo
                 # return unprocessed messages to stack. Q: why i+1?
                 ui.push_back_newmsgs(newmsgs[i:])
 
+    if updater is not None:
+        # fold the selected trials still waiting for their final responses, with the data we have
+        for bgn_ts, end_ts, objID in online_trials:
+            data, data_ts = ui.extract_data_segment_ts(bgn_ts, end_ts + overlap_ms, copy=False)
+            stimulus, stimulus_ts = ui.extract_stimulus_segment_ts(bgn_ts, end_ts, copy=False)
+            updater.add_trial(data, data_ts, stimulus, stimulus_ts, objID)
+        if online_trials:
+            print("Online update: {} trials folded with partial responses".format(len(online_trials)))
+        updater.close()
+
 axPtgt, axFy, axPy = (None, None, None)
 def plot_trial_summary(Ptgt, Fy=None, Py=None, fs:float=None):
     """Plot a summary of the trial decoding information
@@ -732,11 +1178,12 @@ def plot_trial_summary(Ptgt, Fy=None, Py=None, fs:float=None):
     # fig.canvas.draw()
 
 def run(ui: UtopiaDataInterface=None, clsfr: BaseSequence2Sequence=None, msg_timeout_ms: float=100, 
-        host:str=None, prior_dataset:str=None,
+        host:str=None, prior_dataset:str=None, model:str=None,
         tau_ms:float=450, offset_ms:float=0, out_fs:float=100, evtlabs=None, 
         stopband=((45,65),(5.5,25,'bandpass')), ftype='butter', order:int=6, cv:int=5,
-        prediction_offsets=None, logdir=None,
-        calplots:bool=False, predplots:bool=False, label:str=None, **kwargs):
+        prediction_offsets=None, logdir=None, model_apply_type:str='stream',
+        calplots:bool=False, predplots:bool=False, label:str=None, threaded:bool=False, 
+        online_update:bool=False, online_halflife_ms:float=None, **kwargs):
     """ run the main decoder processing loop
 
     Args:
@@ -755,7 +1202,12 @@ def run(ui: UtopiaDataInterface=None, clsfr: BaseSequence2Sequence=None, msg_tim
         calplots (bool, optional): flag if we make plots after calibration. Defaults to False.
         predplots (bool, optional): flag if we make plots after each prediction trial. Defaults to False.
         prior_dataset ([str,(dataset)]): calibration data from a previous run of the system.  Used to pre-seed the model.  Defaults to None.
+        model (str, optional): model snapshot file from a previous run of the system, see `save_model`.  Used instead of the prior_dataset, and also sets the pre-processor configuration.  Defaults to None.
         prediction_offsets ([ListInt], optional): a list of stimulus offsets to try at prediction time to cope with stimulus timing jitter.  Defaults to None.
+        model_apply_type (str, optional): how to apply the model at prediction time, one-of 'stream','trial','block', see `doPredictionStatic`.  Defaults to 'stream'.
+        threaded (bool, optional): acquire and pre-process the data in a background thread, so model fitting and plotting don't stall data capture.  Defaults to False.
+        online_update (bool, optional): adapt the model to the selected trials during prediction, see `OnlineModelUpdater`.  Defaults to False.
+        online_halflife_ms (float, optional): half-life of the online model adaption, None for no forgetting.  Defaults to None.
     """
     global CALIBRATIONPLOTS, PREDICTIONPLOTS, UNAME, LOGDIR
     CALIBRATIONPLOTS = calplots
@@ -778,8 +1230,30 @@ def run(ui: UtopiaDataInterface=None, clsfr: BaseSequence2Sequence=None, msg_tim
 
     print("LOGDIR={}".format(LOGDIR))
 
+    # load the model snapshot, with the pre-processor it was fitted with
+    model_fs, ppfn = None, None
+    if model is not None:
+        try:
+            clsfr, ppfn, model_fs = load_model(model)
+            print("Loaded model: {}".format(clsfr))
+        except:
+            traceback.print_exc()
+            print("Warning: couldn't load model: {}".format(model))
+        if ui is not None and ppfn is not None:
+            model_pp, ui_pp = preprocessor_config(ppfn), preprocessor_config(ui.data_preprocessor)
+            # N.B. ignore the input sample rate, as it is set from the data header
+            for pp in (model_pp, ui_pp):
+                if pp is not None:
+                    pp['params'].pop('fs', None)
+            if not model_pp == ui_pp:
+                print("Warning: model pre-processor {} not used, as the data interface is given.  Using {}".format(model_pp, ui_pp))
+
     # create data interface with bandpass and downsampling pre-processor, running about 10hz updates
-    if ui is None:
+    if ui is None and ppfn is not None:
+        ui = UtopiaDataInterface(data_preprocessor=ppfn,
+                                 stimulus_preprocessor=None,
+                                 timeout_ms=100, mintime_ms=55, clientid='decoder', threaded=threaded) # 20hz updates
+    elif ui is None:
         try:
             from  scipy.signal import butter
             ppfn = butterfilt_and_downsample(order=order, stopband=stopband, fs_out=out_fs, ftype=ftype)
@@ -789,7 +1263,7 @@ def run(ui: UtopiaDataInterface=None, clsfr: BaseSequence2Sequence=None, msg_tim
         #ppfn = None
         ui = UtopiaDataInterface(data_preprocessor=ppfn,
                                  stimulus_preprocessor=None,
-                                 timeout_ms=100, mintime_ms=55, clientid='decoder') # 20hz updates
+                                 timeout_ms=100, mintime_ms=55, clientid='decoder', threaded=threaded) # 20hz updates
     ui.connect(host=host, queryifhostnotfound=False)
     ui.update()
     
@@ -801,21 +1275,34 @@ def run(ui: UtopiaDataInterface=None, clsfr: BaseSequence2Sequence=None, msg_tim
         print('clsfr={}'.format(clsfr))
 
     # pre-train the model if the prior_dataset is given
-    if prior_dataset is not None:
+    if prior_dataset is not None and not clsfr.is_fitted():
         doModelFitting(clsfr, None, cv=cv, prior_dataset=prior_dataset, fs=ui.fs, n_ch=ui.data_ringbuffer.shape[-1])
+        if clsfr.is_fitted():
+            save_model(clsfr, ui)
 
     current_mode = "idle"
     # clean shutdown when told shutdown
     while current_mode.lower != "shutdown".lower():
 
+        # check the loaded model matches the data, once the data header has arrived
+        if model_fs is not None and ui.fs is not None and ui.data_ringbuffer is not None:
+            n_ch = ui.data_ringbuffer.shape[-1]
+            if clsfr.is_fitted() and (abs(ui.fs - model_fs) > .1*model_fs or not n_ch == clsfr.W_.shape[-1]):
+                print("Warning: model ({}ch@{}hz) not compatiable with the data ({}ch@{}hz).  Ignored!".format(clsfr.W_.shape[-1], model_fs, n_ch, ui.fs))
+                clsfr.clear()
+            model_fs = None # only check once
+
         if  current_mode.lower() in ("calibration.supervised","calibrate.supervised"):
             prior_dataset, _, _ = doCalibrationSupervised(ui, clsfr, cv=cv, prior_dataset=prior_dataset)
+            if clsfr.is_fitted():
+                save_model(clsfr, ui)
                 
         elif current_mode.lower() in ("prediction.static","predict.static"):
             if not clsfr.is_fitted() and prior_dataset is not None:
                 doModelFitting(clsfr, None, cv=cv, prior_dataset=prior_dataset, fs=ui.fs, n_ch=ui.data_ringbuffer.shape[-1])
 
-            doPredictionStatic(ui, clsfr)
+            doPredictionStatic(ui, clsfr, model_apply_type=model_apply_type, 
+                               online_update=online_update, online_halflife_ms=online_halflife_ms)
 
         elif current_mode.lower() in ("reset"):
             prior_dataset = None
@@ -833,6 +1320,10 @@ def run(ui: UtopiaDataInterface=None, clsfr: BaseSequence2Sequence=None, msg_tim
                 ui.push_back_newmsgs(newmsgs[i+1:])
                 # stop processing messages
                 break
+
+        # stop at the end of a replayed save file, once the final mode change is done
+        if ui.isEOF() and current_mode == "idle":
+            break
         
         # BODGE: re-draw plots so they are interactive.
         redraw_plots()
@@ -847,16 +1338,118 @@ def parse_args():
     parser.add_argument('--evtlabs', type=str, help='comma separated list of stimulus even types to use', default='re,fe')
     parser.add_argument('--stopband',type=json.loads, help='set of notch filters to apply to the data before analysis', default=((45,65),(5.5,25,'bandpass')))
     parser.add_argument('--cv',type=int, help='number cross validation folds', default=5)
+    parser.add_argument('--model_apply_type',type=str, help='how to apply the model at prediction time, one-of: stream, trial, block', default='stream')
     parser.add_argument('--predplots', action='store_true', help='flag make decoding plots are prediction time')
     parser.add_argument('--calplots', action='store_false', help='turn OFF model and decoding plots after calibration')
     parser.add_argument('--savefile', type=str, help='run decoder using this file as the proxy data source', default=None)
     parser.add_argument('--savefile_fs', type=float, help='effective sample rate for the save file', default=None)
+    parser.add_argument('--savefile_fast', action='store_true', help='replay the save file as fast as possible')
+    parser.add_argument('--threaded', action='store_true', help='acquire and pre-process data in a background thread')
+    parser.add_argument('--online_update', action='store_true', help='adapt the model to the selected trials during prediction')
+    parser.add_argument('--online_halflife_ms', type=float, help='half-life of the online model adaption', default=None)
     parser.add_argument('--logdir', type=str, help='directory to save log/data files', default='~/Desktop/logs')
     parser.add_argument('--prior_dataset', type=str, help='prior dataset to fit initial model to', default='~/Desktop/logs/calibration_dataset*.pk')
+    parser.add_argument('--model', type=str, help='model snapshot to start predicting with, e.g. ~/Desktop/logs/model_*.npz', default=None)
 
     args = parser.parse_args()
     return args
 
+def test_streaming_predictor(block_size:int=7):
+    """check the 'stream' prediction matches the 'trial' prediction for every event type, with outputs starting at different times in the trial"""
+    from mindaffectBCI.decoder.utils import testSignal, extract_ringbuffer_segment_ts
+    np.random.seed(0)
+    X, Y, st, A, B = testSignal(nTrl=10, d=4, nE=2, nY=10, isi=5, tau=10, nSamp=500)
+    Y = Y[..., 0] # stimulus sequence
+    # test trial, output k first stimulated at sample 20*k
+    x = X[0, ...].astype(np.float32)
+    y = np.zeros((x.shape[0], 256), dtype=np.uint8)
+    y[:, 1:Y.shape[-1]+1] = Y[0, ...]
+    for k in range(Y.shape[-1]):
+        y[:20*k, k+1] = 0
+    ts = np.arange(x.shape[0]) * 10.0
+    cases = [(('re','fe'), 0), (('re','fe'), 3), (('re','fe'), -3), (('1',), 0), (('0',), 0), (('short','long'), 0), (('100000',), 0),
+             (('diff',), 0), (('grad',), 0), (('raw',), 0), (None, 0),
+             (('re','onset'), 0), (('re','rest'), 0), (('re','ntre'), 0), (('re','anyre'), 0)]
+    for evtlabs, offset in cases:
+        clsfr = MultiCCA(tau=10, evtlabs=evtlabs, offset=offset)
+        clsfr.fit(X, Y)
+        Fy_trial = doPrediction(clsfr, x, y, data_ts=ts, stimulus_ts=ts)
+        # stream the trial in blocks
+        rbx = RingBuffer(1000, x.shape[1:], ts_dtype=np.float64)
+        rby = RingBuffer(1000, y.shape[1:], dtype=np.uint8, ts_dtype=np.float64)
+        predictor = StreamingPredictor(clsfr, 1000)
+        predictor.reset(ts[0])
+        for i in range(0, x.shape[0], block_size):
+            rbx.extend(x[i:i+block_size, :], ts[i:i+block_size])
+            rby.extend(y[i:i+block_size, :], ts[i:i+block_size])
+            data, data_ts = extract_ringbuffer_segment_ts(rbx, predictor.next_ts)
+            stimulus, stimulus_ts = extract_ringbuffer_segment_ts(rby, predictor.next_ts)
+            predictor.update(data, data_ts, stimulus, stimulus_ts)
+        Fy_stream = predictor.Fy()
+        n = Fy_stream.shape[-2]
+        err = np.max(np.abs(Fy_stream - Fy_trial[..., :n, :]))
+        print("evtlabs={} offset={} streamable={} : |Fy_stream-Fy_trial|={:g} over {} samples".format(evtlabs, offset, is_streamable(clsfr), err, n))
+        # N.B. doPredictionStatic falls back to 'trial' for the non-streamable ones
+        if is_streamable(clsfr):
+            assert err < 1e-4, "stream != trial for evtlabs={}".format(evtlabs)
+
+    # multiple models: the model dimension is only removed when marginalized
+    clsfr = MultiCCA(tau=10, evtlabs=('re','fe'), prediction_offsets=(-1,0,1)).fit(X, Y)
+    predictor = StreamingPredictor(clsfr, 1000)
+    predictor.reset(ts[0])
+    predictor.update(x, ts, y, ts)
+    Ptgt, Ptgt_m = (predictor.decode_proba(marginalizemodels=True), predictor.decode_proba(marginalizemodels=False))
+    print("Ptgt marginalized={} per-model={}".format(Ptgt.shape, Ptgt_m.shape))
+    assert Ptgt.shape == Ptgt_m.shape[1:] and Ptgt_m.shape[0] == 3
+
+
+def test_online_model_updater(halflife_samp:float=500):
+    """check the online updates match a batch re-fit, and that forgetting down-weights the old trials"""
+    from mindaffectBCI.decoder.utils import testSignal
+    def wcorr(Wa, Wb):
+        Wa, Wb = Wa.ravel(), Wb.ravel()
+        return abs(np.dot(Wa, Wb)) / np.sqrt(np.dot(Wa, Wa) * np.dot(Wb, Wb))
+    def fold(updater, X, Y):
+        ts = np.arange(X.shape[1]) * 10.0
+        for x, y in zip(X, Y):
+            stimulus = np.zeros((y.shape[0], 256), dtype=np.uint8)
+            stimulus[:, 1:y.shape[-1]+1] = y
+            updater.add_trial(x, ts, stimulus, ts, 1) # true target is output 1
+        updater.close()
+        return updater.clsfr.W_
+    np.random.seed(0)
+    X, Y, st, A, B = testSignal(nTrl=10, d=4, nE=2, nY=10, isi=5, tau=10, nSamp=500)
+    Y = Y[..., 0]
+    X = X.astype(np.float32)
+    # different spatial mixing -> different optimal model
+    X2, Y2, st, A2, B2 = testSignal(nTrl=10, d=4, nE=2, nY=10, isi=5, tau=10, nSamp=500)
+    Y2 = Y2[..., 0]
+    X2 = X2.astype(np.float32)
+    W2 = MultiCCA(tau=10, evtlabs=('re','fe')).fit(X2, Y2).W_
+
+    # no forgetting: folding the calibration trials again == a batch fit on the calibration data
+    clsfr = MultiCCA(tau=10, evtlabs=('re','fe')).fit(X, Y)
+    W = clsfr.W_
+    updater = OnlineModelUpdater(clsfr, None)
+    Wu = fold(updater, X, Y)
+    print("no-forgetting: ntrials={} N={} corr(W_update,W_batch)={:g}".format(updater.ntrials, updater.N, wcorr(Wu, W)))
+    assert updater.ntrials == X.shape[0] and updater.N == 2*X.shape[0]
+    assert wcorr(Wu, W) > .9999
+
+    # no forgetting: new trials are averaged with the calibration ones
+    updater = OnlineModelUpdater(MultiCCA(tau=10, evtlabs=('re','fe')).fit(X, Y), None)
+    Wn = fold(updater, X2, Y2)
+    # forgetting: the calibration trials are down-weighted -> closer to the new data model
+    updater = OnlineModelUpdater(MultiCCA(tau=10, evtlabs=('re','fe')).fit(X, Y), halflife_samp)
+    Wf = fold(updater, X2, Y2)
+    print("halflife={} : N={:g} corr(W_forget,W_new)={:g} corr(W_noforget,W_new)={:g}".format(halflife_samp, updater.N, wcorr(Wf, W2), wcorr(Wn, W2)))
+    # effective number of trials, weight 1/2 per trial of halflife_samp samples
+    wght = .5 ** (X2.shape[1] / halflife_samp)
+    nnew = X2.shape[0]
+    assert abs(updater.N - (wght**nnew * X.shape[0] + (1 - wght**nnew) / (1 - wght))) < 1e-6
+    assert wcorr(Wf, W2) > wcorr(Wn, W2)
+
+
 if  __name__ == "__main__":
     args = parse_args()
 
@@ -873,7 +1466,7 @@ if  __name__ == "__main__":
         setattr(args,'predplots',True) # prediction plots -- useful for prediction perf debugging
         setattr(args,'prior_dataset',None)
         from mindaffectBCI.decoder.FileProxyHub import FileProxyHub
-        U = FileProxyHub(args.savefile,use_server_ts=True)
+        U = FileProxyHub(args.savefile,use_server_ts=True,fast=args.savefile_fast)
         ppfn = butterfilt_and_downsample(order=6, stopband=args.stopband, fs_out=args.out_fs, ftype='butter')
         ui = UtopiaDataInterface(data_preprocessor=ppfn,
                                  stimulus_preprocessor=None,
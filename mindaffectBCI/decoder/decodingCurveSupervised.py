@@ -16,8 +16,13 @@
 # along with pymindaffectBCI.  If not, see <http://www.gnu.org/licenses/>
 
 import numpy as np
-from mindaffectBCI.decoder.decodingSupervised import decodingSupervised
+from mindaffectBCI.decoder.decodingSupervised import decodingSupervised, decodeNormalizedScores
+from mindaffectBCI.decoder.normalizeOutputScores import normalizeOutputScores_curve
 from mindaffectBCI.decoder.scoreOutput import dedupY0
+
+# the decodingSupervised options which are used by the score normalization
+NORMALIZE_ARGS = ('badFyThresh', 'centFy', 'detrendFy', 'nEpochCorrection', 'minDecisLen', 'maxDecisLen', 'bwdAccumulate', 'priorsigma')
+
 def decodingCurveSupervised(Fy,objIDs=None,nInt=(30,25),dedup0=True,**kwargs):
     '''
     Compute a decoding curve, i.e. mistake-probability over time for probability based stopping from the per-epoch output scores
@@ -92,6 +97,9 @@ def decodingCurveSupervised(Fy,objIDs=None,nInt=(30,25),dedup0=True,**kwargs):
 def compute_decoding_curve(Fy:np.ndarray, objIDs, integerationLengths, **kwargs):
     """compute the decoding curves from the given epoch+output scores in Fy
 
+    N.B. for forward accumulation with a single decision point, the scores for all the integeration
+    lengths are normalized in a single pass, see `normalizeOutputScores_curve`
+
     Args:
         Fy (float: ((nM,)nTrl,nEp,nY)) : per-epoch output scores
         objIDs (float: (nY,)) : the objectIDs for the outputs in Fy
@@ -107,9 +115,20 @@ def compute_decoding_curve(Fy:np.ndarray, objIDs, integerationLengths, **kwargs)
     Yest=-np.ones((Fy.shape[-3], len(integerationLengths)),dtype=int) # (nTrl,nInt)
     Perr= np.ones((Fy.shape[-3], len(integerationLengths)),dtype=np.float32) # (nTrl,nInt)
 
+    # single-pass normalization for all the integeration lengths, if supported for these options
+    onepass = kwargs.get('minDecisLen', 0) == 0 and not kwargs.get('bwdAccumulate', False) and kwargs.get('nocontrolamplitude', None) is None
+    if onepass:
+        normkwargs = {k:v for k,v in kwargs.items() if k in NORMALIZE_ARGS and not k in ('minDecisLen', 'maxDecisLen', 'bwdAccumulate')}
+        deckwargs = {k:v for k,v in kwargs.items() if not k in NORMALIZE_ARGS+('nocontrolamplitude',)}
+        normalized = normalizeOutputScores_curve(Fy, integerationLengths, **normkwargs)
+
     print("Int Lens:", end='')
     for li,nep in enumerate(integerationLengths):
-        Yidxli,Perrli,_,_,_=decodingSupervised(Fy[..., :nep, :], **kwargs)
+        ssFy, validTgt = next(normalized) if onepass else (None, None)
+        if ssFy is not None:
+            Yidxli,Perrli,_,_,_=decodeNormalizedScores(ssFy, validTgt, **deckwargs)
+        else:
+            Yidxli,Perrli,_,_,_=decodingSupervised(Fy[..., :nep, :], **kwargs)
         # BODGE: only use result from first-model & last decision point!!!!
         if Yidxli.ndim>1:
             if  Yidxli.shape[-1]>1 or (Yidxli.ndim>2 and Yidxli.shape[0]>1):
@@ -78,6 +78,31 @@ def decodingSupervised(Fy, softmaxscale=3.5, marginalizemodels=True,
     # ssFy=np.concatenate((ssFy,nocontrolamplitude+mussFy),0)
     # validtgtTrl=np.concatenate((validtgtTrl,np.ones([1,size(validtgtTrl,2),size(validtgtTrl,3),size(validtgtTrl,4)])))
 
+  return decodeNormalizedScores(ssFy, validTgt, softmaxscale=softmaxscale,
+                                marginalizemodels=marginalizemodels, marginalizedecis=marginalizedecis,
+                                prior=prior, tiebreaking_noise=tiebreaking_noise)
+
+
+def decodeNormalizedScores(ssFy, validTgt=None, softmaxscale=3.5, marginalizemodels=True,
+                           marginalizedecis=False, prior=None, tiebreaking_noise=1e-3):
+  """true-target estimator and error-probility estimator from already normalized scores, see `decodingSupervised`
+
+   Args:
+      ssFy (nModel,nTrl,nDecis,nY): the normalized summed output scores, as from `normalizeOutputScores`
+      validTgt (nModel,nTrl,nY): which outputs are used in which trial. Defaults to None.
+      softmaxscale (float, optional): the scale length to pass to zscore2Ptgt_softmax.py. Defaults to 3.5.
+      marginalizemodels (bool, optional): [description]. Defaults to True.
+      marginalizedecis (bool, optional): [description]. Defaults to False.
+      prior ([type], optional): [description]. Defaults to None.
+      tiebreaking_noise ([type], optional): [description]. Defaults to 1e-3.
+
+   Returns:
+      Yest (nTrl,nDecis): the most likely / minimum error output for each decision point
+      Perr (nTrl,nDecis): the probability that this selection is an ERROR for each decision point
+      Ptgt (nTrl,nDecis,nY): the probability each target is the true target for each decision point
+      decisMdl, 
+      decisEp
+  """
   # compute the target probabilities over output for each model+trial
   # use the softmax approach to get Ptgt for all outputs
   Ptgt = zscore2Ptgt_softmax(ssFy,
@@ -16,7 +16,15 @@
 # along with pymindaffectBCI.  If not, see <http://www.gnu.org/licenses/>
 
 import numpy as np
+from itertools import chain
 from mindaffectBCI.utopiaclient import StimulusEvent
+
+
+def _as_seq(x):
+    """ normalise a message field which may be a scalar or a sequence to a sequence """
+    return x if hasattr(x, '__len__') else (x,)
+
+
 def devent2stimSequence(devents):
     '''
     convert a set of STIMULUSEVENT messages into a stimulus-sequence array with stimulus-times as expected by the utopia RECOGNISER
@@ -26,51 +34,60 @@ def devent2stimSequence(devents):
             i.e. a decoded utopia STIMULUSEVENT message, should be of type
              { msgID:'E'byte, timeStamp:int, objIDs:(nObj:byte), objState:(nObj:byte) }
     Outputs:
-     Me     - (nEvt,nY :int) The extract stimulus sequence
+     Me     - (nEvt,nY :uint8) The extract stimulus sequence
      objIDs - (nY :byte) The set of used object IDs
      stimTimes_ms - (nEvt :int) The timestamp of each event in milliseconds
      isistimEvent - (nEp :bool) Indicator which input events are stimulus events
+
+    Note: the stimulus events are gathered into a sparse (event,objID,state) table
+     and then forward-filled in one pass, so memory scales with the number of *used*
+     objIDs rather than 256.  An object's state is held over consecutive stimulus
+     events, and is reset to 0 by any intervening non-stimulus message.
       
     Copyright (c) MindAffect B.V. 2018
     '''
     if devents is None:
         return (None,None,None,None)
-    Me = np.zeros((len(devents), 256), dtype=int)
-    stimTimes_ms = np.zeros(len(devents))
-    allobjIDs = np.arange(0, 256)
-    usedobjIDs = np.zeros((256), dtype=bool)
-    isstimEvent = np.zeros((len(devents)), dtype=bool)
-
-    # loop over the messages, extracting info from stimEvents and putting into the stim-sequence
-    for ei, evt in enumerate(devents):
-        if not evt.msgID == StimulusEvent.msgID:
-            continue
-        isstimEvent[ei] = True
-        # extract the stimulusState info
-        timeStamp = evt.timestamp
-        objIDs = evt.objIDs
-        objState = evt.objState
-        stimTimes_ms[ei] = timeStamp
-        # hold value of used objIDs from previous time stamp
-        if ei > 0 and np.any(usedobjIDs):
-            Me[ei, usedobjIDs] = Me[ei-1, usedobjIDs]
-        # 2) overwrite with updated state
-        # N.B. indexing hack with [int,tuple,] to index correctly
-        Me[ei, objIDs, ] = objState
-        usedobjIDs[objIDs, ] = True
-    
-    # restrict to only stim-event info
-    # Note: horrible integer indexing tricks to get only the elements we want..
-    Me = Me[np.flatnonzero(isstimEvent)[:, np.newaxis], usedobjIDs]
-    stimTimes_ms = stimTimes_ms[isstimEvent]
-    objIDs = allobjIDs[usedobjIDs]
+    isstimEvent = np.fromiter((evt.msgID == StimulusEvent.msgID for evt in devents), dtype=bool, count=len(devents))
+    stimidx = np.flatnonzero(isstimEvent)
+    stimevts = [devents[ei] for ei in stimidx]
+    stimTimes_ms = np.fromiter((evt.timestamp for evt in stimevts), dtype=float, count=len(stimevts))
+
+    # sparse event table: (row=stim-event, objID, state)
+    evtobjIDs = [_as_seq(evt.objIDs) for evt in stimevts]
+    nobj = np.fromiter((len(o) for o in evtobjIDs), dtype=int, count=len(evtobjIDs))
+    rows = np.repeat(np.arange(len(stimevts)), nobj)
+    ids = np.fromiter(chain.from_iterable(evtobjIDs), dtype=int, count=rows.size)
+    states = np.fromiter(chain.from_iterable(_as_seq(evt.objState) for evt in stimevts), dtype=int, count=rows.size)
+
+    objIDs, cols = np.unique(ids, return_inverse=True)
+    if len(stimevts) == 0 or objIDs.size == 0:
+        return np.zeros((len(stimevts), 0), dtype=np.uint8), stimTimes_ms, objIDs, isstimEvent
+
+    # scatter the updates, N.B. later updates of the same object in an event win
+    V = np.zeros((len(stimevts), objIDs.size), dtype=np.uint8)
+    V[rows, cols] = states
+    # index of the last event which set each object, forward-filled along the events
+    last = np.full(V.shape, -1, dtype=np.intp)
+    last[rows, cols] = rows
+    np.maximum.accumulate(last, axis=0, out=last)
+    # first event of each run of consecutive stimulus events, holds don't cross a run start
+    runstart = np.flatnonzero(np.diff(stimidx, prepend=-2) != 1)
+    runstart = runstart[np.searchsorted(runstart, np.arange(len(stimevts)), side='right')-1]
+    held = last >= runstart[:, np.newaxis]
+    Me = np.where(held, np.take_along_axis(V, np.maximum(last, 0), axis=0), 0).astype(np.uint8)
     return Me, stimTimes_ms, objIDs, isstimEvent
 
 
 
 def upsample_stimseq(sample_ts, ss, stimulus_ts, objIDs=None, usedobjIDs=None, trlen=None):
     ''' upsample a set of timestamped stimulus states to a sample rate
-     WARNING: assumes sample_ts and stimulus_ts are in *ascending* sorted order! '''
+     WARNING: assumes sample_ts and stimulus_ts are in *ascending* sorted order!
+
+     Each stimulus is placed at the last sample at or before its timestamp, with every
+     stimulus consuming at least one sample, and the state is held until the next stimulus.
+     Stimuli time-stamped after the last data sample, or placed after trlen, are dropped.
+    '''
     if trlen is None:
         trlen = len(sample_ts)
 
@@ -82,42 +99,70 @@ def upsample_stimseq(sample_ts, ss, stimulus_ts, objIDs=None, usedobjIDs=None, t
         obj_idx = slice(len(usedobjIDs))
 
     else: # match objIDs and to get idxs to use
-        obj_idx = np.zeros((len(objIDs),), dtype=int)
-        for oi, oid in enumerate(objIDs):
-            obj_idx[oi] = np.flatnonzero(usedobjIDs == oid)[0]
-   
+        ismatch = np.asarray(usedobjIDs)[np.newaxis, :] == np.asarray(objIDs)[:, np.newaxis]
+        if not np.all(np.any(ismatch, axis=-1)):
+            raise IndexError("objIDs not in usedobjIDs")
+        obj_idx = np.argmax(ismatch, axis=-1)
+
     # convert to sample-rate version
     Y = np.zeros((trlen, len(usedobjIDs)), dtype=ss.dtype)
-    samp_ts_iterator = enumerate(iter(sample_ts))
-    data_i=None
+    stimulus_ts = np.asarray(stimulus_ts)
     stimulus_idx=np.zeros(stimulus_ts.shape,dtype=int)
-    for stim_i, stim_ts in enumerate(stimulus_ts):
-        #print("{}) ts={} ".format(stim_i,stim_ts),end='')
-        odata_i = data_i # store when old stim sample index
-        for data_i, data_ts in samp_ts_iterator:
-            #print("{}={} ".format(data_i,data_ts),end='')
-            # N.B. assumes samp_ts are already interpolated!
-            if data_ts > stim_ts:
-                #print("*")
-                break
-        if data_i is None:
-            raise ValueError("Ran out of data!")
-        if data_i > Y.shape[0]:
-            # events after end of the allowed trial length
-            break
-        # data_i is one sample too far?
-        data_i = max(data_i-1, 0)
-        # nearest index for the stim_ts
-        if odata_i is not None:
-            # hold the previous stimulus state until now
-            Y[odata_i:data_i+1, obj_idx] = Y[odata_i, obj_idx]
-        # insert the new state
-        stimulus_idx[stim_i] = data_i
-        Y[data_i, obj_idx] = ss[stim_i, :]
-                
+    if len(stimulus_ts) == 0:
+        return (Y, stimulus_idx)
+    if len(sample_ts) == 0:
+        raise ValueError("Ran out of data!")
+
+    # index of the 1st sample after each stimulus, advancing at least one sample per stimulus
+    nxt = np.searchsorted(sample_ts, stimulus_ts, side='right')
+    offset = np.arange(len(nxt))
+    nxt = np.maximum.accumulate(nxt - offset) + offset
+    # events after the end of the allowed trial length, or after the last data sample
+    nstim = min(np.searchsorted(nxt, min(trlen, len(sample_ts)), side='right'),
+                np.searchsorted(stimulus_ts, sample_ts[-1], side='right'))
+    if nstim == 0:
+        return (Y, stimulus_idx)
+    # nearest index for the stim_ts
+    data_i = np.maximum(nxt[:nstim]-1, 0)
+    stimulus_idx[:nstim] = data_i
+    # hold each stimulus state until the next one, i.e. forward-fill by stimulus index
+    samp_stim = np.searchsorted(data_i, np.arange(data_i[0], data_i[-1]+1), side='right')-1
+    Y[data_i[0]:data_i[-1]+1, obj_idx] = ss[samp_stim, :]
     return (Y, stimulus_idx)
 
 
+def testcase(nevt=216000, nobj=10, verb=1):
+    """ check the vectorized conversion on an hour of 60hz stimulus events
+
+    Args:
+        nevt (int, optional): number of stimulus events. Defaults to 216000.
+        nobj (int, optional): number of objects per event. Defaults to 10.
+        verb (int, optional): verbosity level. Defaults to 1.
+    """
+    import time
+    se = [StimulusEvent(i*1000//60, tuple(range(1, nobj+1)), tuple(np.random.randint(0, 2, nobj))) for i in range(nevt)]
+    t0 = time.perf_counter()
+    Me, st, oid, isse = devent2stimSequence(se)
+    t1 = time.perf_counter()
+    samp_ts = np.arange(0, st[-1]+1000, 4) # 250hz
+    Y, stim_idx = upsample_stimseq(samp_ts, Me, st, oid)
+    t2 = time.perf_counter()
+    if verb > 0:
+        print("devent2stimSequence: {} evt -> {} in {:.3f}s".format(nevt, Me.shape, t1-t0))
+        print("upsample_stimseq: {} -> {} in {:.3f}s".format(Me.shape, Y.shape, t2-t1))
+    return Me, Y
+
+
+def test_upsample_stimseq_end():
+    """ check stimuli after the last data sample are dropped, and the one at the last sample is kept """
+    samp_ts = np.arange(10) * 10.0
+    ss = np.arange(1, 5, dtype=np.uint8)[:, np.newaxis]
+    Y, stim_idx = upsample_stimseq(samp_ts, ss, np.array([45, 90, 95, 200]))
+    print("Y={} stim_idx={}".format(Y[:, 0], stim_idx))
+    assert np.array_equal(Y[:, 0], [0, 0, 0, 0, 1, 1, 1, 1, 1, 2])
+    assert np.array_equal(stim_idx, [4, 9, 0, 0])
+
+
 if __name__=="__main__":
     from devent2stimsequence import devent2stimSequence
     from mindaffectBCI.utopiaclient import StimulusEvent
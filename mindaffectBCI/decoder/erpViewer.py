@@ -40,7 +40,7 @@ def erpViewer(ui: UtopiaDataInterface, timeout_ms: float=np.inf, tau_ms: float=5
     irf_times = np.linspace(irf_range_ms[0], irf_range_ms[1], irflen_samp)
 
     # initialize the arrays to hold the stimulus responses, and their label info, and a current cursor
-    irf = np.zeros((nstimulus_events, irflen_samp, ui.data_ringbuffer.shape[-1] - 1)) # (nERP,irflen,d)
+    irf = np.zeros((nstimulus_events, irflen_samp, ui.data_ringbuffer.shape[-1])) # (nERP,irflen,d)
     irf_lab = np.zeros((nstimulus_events, len(evtlabs)), dtype=int)  # (nErp,nstim)
     cursor = 0
 
@@ -149,7 +149,7 @@ def erpViewer(ui: UtopiaDataInterface, timeout_ms: float=np.inf, tau_ms: float=5
             continue
 
         # get the new raw stimulus
-        rawstimulus = ui.stimulus_ringbuffer[-nstim:, :]
+        rawstimulus = ui.stimulus_ringbuffer.with_timestamps(slice(-nstim, None))
 
         # split the time-stamp and the *true-target* stimulus info
         stimulus_ts = rawstimulus[:, -1]
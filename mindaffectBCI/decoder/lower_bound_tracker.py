@@ -179,7 +179,7 @@ class lower_bound_tracker():
                 self.reset(keep_model=True)
 
     def getX(self,y):
-        return ( y  - self.b ) / self.a 
+        return ( y  - self.b ) / self.a
 
     def getY(self,x):
         return self.a * x + self.b
@@ -16,7 +16,7 @@
 # along with pymindaffectBCI.  If not, see <http://www.gnu.org/licenses/>
 
 import numpy as np
-from mindaffectBCI.decoder.updateSummaryStatistics import updateSummaryStatistics, zero_outliers, crossautocov, updateCyy, updateCxy, autocov, updateCxx, plot_erp, plot_summary_statistics, plot_factoredmodel
+from mindaffectBCI.decoder.updateSummaryStatistics import updateSummaryStatistics, zero_outliers, crossautocov, updateCyy, updateCxy, autocov, updateCxx, plot_erp, plot_summary_statistics, plot_factoredmodel, perTrialSummaryStatistics, summaryStatisticsFromTrials
 from mindaffectBCI.decoder.multipleCCA import multipleCCA
 from mindaffectBCI.decoder.scoreOutput import scoreOutput, dedupY0
 from mindaffectBCI.decoder.utils import window_axis
@@ -107,8 +107,10 @@ class BaseSequence2Sequence(BaseEstimator, ClassifierMixin):
         if hasattr(self,"R_"): delattr(self,'R_')
         if hasattr(self,"A_"): delattr(self,'A_')
         if hasattr(self,"b_"): delattr(self,'b_')
+        if hasattr(self,"summary_statistics_"): delattr(self,'summary_statistics_')
+        if hasattr(self,"trial_summary_statistics_"): delattr(self,'trial_summary_statistics_')
 
-    def predict(self, X, Y, dedup0=True, prevY=None, offsets=None):
+    def predict(self, X, Y, dedup0=True, prevY=None, offsets=None, out=None):
         """Generate predictions with the fitted model for the paired data + stimulus-sequences
 
             N.B. this implementation assumes linear coefficients in W_ (nM,nfilt,d) and R_ (nM,nfilt,nE,tau)
@@ -119,6 +121,7 @@ class BaseSequence2Sequence(BaseEstimator, ClassifierMixin):
             dedup0 ([type], optional): remove duplicates of the Yidx==0, i.e. 1st, assumed true, output of Y. Defaults to True.
             prevY ([type], optional): previous stimulus sequence information. for partial incremental calls. Defaults to None.
             offsets ([ListInt], optional): list of offsets in Y to try when decoding, to override the class variable.  Defaults to None.
+            out (np.ndarray (mdl,tr,samp,nY), optional): buffer to write the scores into, see `scoreOutput`.  Defaults to None.
 
         Raises:
             NotFittedError: raised if try to predict without first fitting
@@ -140,7 +143,7 @@ class BaseSequence2Sequence(BaseEstimator, ClassifierMixin):
         # get output scores.  Optionally, include time-shifts in output.
         if offsets is None and self.prediction_offsets is not None:
             offsets = self.prediction_offsets
-        Fy = scoreOutput(Fe, Y, dedup0=dedup0, R=self.R_, offset=offsets) #(nM, nTrl, nSamp, nY)
+        Fy = scoreOutput(Fe, Y, dedup0=dedup0, R=self.R_, offset=offsets, out=out) #(nM, nTrl, nSamp, nY)
         
         # BODGE: strip un-needed model dimension
         if Fy.ndim > 3 and Fy.shape[0] == 1:
@@ -191,7 +194,7 @@ class BaseSequence2Sequence(BaseEstimator, ClassifierMixin):
         Yest, Perr, Ptgt, _, _ = decodingSupervised(Fy, minDecisLen=minDecisLen, bwdAccumulate=bwdAccumulate,
                                      marginalizemodels=marginalizemodels, marginalizedecis=marginalizedecis, 
                                      nEpochCorrection=self.startup_correction, **kwargs)
-        if marginalizemodels and Ptgt.ndim>3 and Ptgt.shape[-4]>0: # hide our internal model dimension?
+        if marginalizemodels and Ptgt.ndim>3 and Ptgt.shape[-4]==1: # hide our internal (marginalized) model dimension
             Yest=Yest[0,...]
             Perr=Perr[0,...]
             Ptgt=Ptgt[0,...]
@@ -301,6 +304,20 @@ class BaseSequence2Sequence(BaseEstimator, ClassifierMixin):
         if retrain_on_all:
             self.fit(X, Y, **fit_params)
 
+        return self.cv_calibrate(Fy, scores, return_estimator=return_estimator, calibrate_softmax=calibrate_softmax)
+
+    def cv_calibrate(self, Fy, scores, return_estimator:bool=True, calibrate_softmax:bool=True):
+        """Calibrate the prediction noise prior and softmax scale from cross-validated predictions
+
+        Args:
+            Fy (np.ndarray ((nM,)tr,samp,nY)): the cross-validated stimulus sequence scores
+            scores (list): the per-fold test scores
+            return_estimator (bool, optional): should we return the cross-validated predictions. Defaults to True.
+            calibrate_softmax (bool, optional): should we use the cross-validated predictions to calibrate the probability estimates. Defaults to True.
+
+        Returns:
+            results (dict): dictionary with the results
+        """
         self.sigma0_ = None
         self.softmaxscale_ = 1
 
@@ -343,9 +360,11 @@ class BaseSequence2Sequence(BaseEstimator, ClassifierMixin):
     
 class MultiCCA(BaseSequence2Sequence):
     ''' Sequence 2 Sequence learning using CCA as a bi-directional forward/backward learning method '''
-    def __init__(self, evtlabs=('re','fe'), tau=18, offset=0, rank=1, reg=(1e-8,None), rcond=(1e-4,1e-8), badEpThresh=6, symetric=False, center=True, CCA=True, priorweight=200, startup_correction=100, prediction_offsets=None, minDecisLen=100, bwdAccumulate=False, **kwargs):
+    def __init__(self, evtlabs=('re','fe'), tau=18, offset=0, rank=1, reg=(1e-8,None), rcond=(1e-4,1e-8), badEpThresh=6, symetric=False, center=True, CCA=True, priorweight=200, startup_correction=100, prediction_offsets=None, minDecisLen=100, bwdAccumulate=False, toeplitzCyy=False, **kwargs):
         super().__init__(evtlabs=evtlabs, tau=tau,  offset=offset, priorweight=priorweight, startup_correction=startup_correction, prediction_offsets=prediction_offsets, minDecisLen=minDecisLen, bwdAccumulate=bwdAccumulate, **kwargs)
         self.rank, self.reg, self.rcond, self.badEpThresh, self.symetric, self.center, self.CCA = (rank,reg,rcond,badEpThresh,symetric,center,CCA)
+        # keep Cyy block-Toeplitz, saves memory and whitening time for long tau
+        self.toeplitzCyy = toeplitzCyy
 
 
     def fit(self, X, Y, stimTimes=None):
@@ -356,30 +375,49 @@ class MultiCCA(BaseSequence2Sequence):
         Y_true = Y[..., 0:1, :] #  (tr,samp,1,e)
         # get summary statistics
         #print("X={} |X|={}".format(X.shape,np.sum(X**2,axis=(0,1))))
-        Cxx, Cxy, Cyy = updateSummaryStatistics(X, Y_true, stimTimes, tau=self.tau, offset=self.offset, badEpThresh=self.badEpThresh, center=self.center)
+        Cxx, Cxy, Cyy = updateSummaryStatistics(X, Y_true, stimTimes, tau=self.tau, offset=self.offset, badEpThresh=self.badEpThresh, center=self.center, toeplitz=self.toeplitzCyy)
         #print("diag(Cxx)={}".format(np.diag(Cxx)))
         # do the CCA fit
+        self.fit_cca(Cxx, Cxy, Cyy, dtype=X.dtype)
+        self.fit_b(X) #(nM,e)
+        # keep the statistics, for online updating of the model
+        muX = np.mean(X.reshape((-1,X.shape[-1])),0)
+        self.summary_statistics_ = (Cxx, Cxy, Cyy, muX, X.shape[0] if X.ndim > 2 else 1)
+        self.trial_summary_statistics_ = None
+
+        return self
+
+
+    def fit_cca(self, Cxx, Cxy, Cyy, dtype=np.float32):
+        """fit the spatial and temporal filters given the summary statistics
+
+        Args:
+            Cxx (np.ndarray (d,d)): the data covariance
+            Cxy (np.ndarray (nY,nE,tau,d)): the per-output ERPs
+            Cyy (np.ndarray (nY,nE,tau,nE,tau) or ToeplitzCyy): the response covariance
+            dtype (np.dtype, optional): the type of the data. Defaults to np.float32.
+        """
         J, W, R = multipleCCA(Cxx, Cxy, Cyy, reg=self.reg, rank=self.rank, rcond=self.rcond, CCA=self.CCA, symetric=self.symetric)
         # maintain type compatiability
-        W = W.astype(X.dtype)
-        R = R.astype(X.dtype)
+        W = W.astype(dtype)
+        R = R.astype(dtype)
         self.W_ = W #(nM,rank,d)
         self.R_ = R #(nM,rank,e,tau)
-        self.fit_b(X) #(nM,e)
         # store A_ for plotting later
         self.A_ = np.einsum("de,Mkd->Mke",Cxx,W)
-
         return self
 
 
-    def fit_b(self,X):
+    def fit_b(self,X=None,muX=None):
         """fit the bias parameter given the other parameters and a dataset
 
         Args:
             X (np.ndarray): the target data
+            muX (np.ndarray (d,), optional): the mean of the target data, used if X is None. Defaults to None.
         """        
         if self.center: # use bias terms to correct for data centering
-            muX = np.mean(X.reshape((-1,X.shape[-1])),0)
+            if muX is None:
+                muX = np.mean(X.reshape((-1,X.shape[-1])),0)
             self.b_ = -np.einsum("Mkd,d,Mket->Me",self.W_,muX,self.R_) # (nM,e)
             self.b_ = self.b_[0,:] # strip model dim..
         else:
@@ -389,12 +427,14 @@ class MultiCCA(BaseSequence2Sequence):
 
     def cv_fit(self, X, Y, cv=5, fit_params:dict=dict(), verbose:bool=0, 
                return_estimator:bool=True, calibrate_softmax:bool=True, retrain_on_all:bool=True, ranks=None):
-        ''' cross validated fit to the data.  N.B. write our own as sklearn doesn't work for getting the estimator values for structured output.'''
-        # fast path for cross validation over rank
-        cv_in = cv.copy() if hasattr(cv,'copy') else cv # save copy of cv info for later
-        if ranks is None :
-            # call the base version
-            return BaseSequence2Sequence.cv_fit(self, X, Y, cv=cv_in, fit_params=fit_params, verbose=verbose, 
+        ''' cross validated fit to the data.  N.B. write our own as sklearn doesn't work for getting the estimator values for structured output.
+
+        The per-trial summary statistics are computed once, the model for each fold is fit from the totals with
+        the held-out trials subtracted, and all the ranks are extracted from a single max-rank decomposition.
+        '''
+        if fit_params or X.ndim < 3:
+            # general fit parameters -> call the base version
+            return BaseSequence2Sequence.cv_fit(self, X, Y, cv=cv, fit_params=fit_params, verbose=verbose, 
                             return_estimator=return_estimator, calibrate_softmax=calibrate_softmax,  retrain_on_all=retrain_on_all)
 
         if cv == True:  cv = 5
@@ -403,9 +443,17 @@ class MultiCCA(BaseSequence2Sequence):
                 cv = StratifiedKFold(n_splits=min(cv, X.shape[0])).split(np.zeros(X.shape[0]), np.zeros(Y.shape[0]))
             else: # single trial, train/test on all...
                 cv = [(slice(1), slice(1))] # N.B. use slice to preserve dims..
+        rank_search = ranks is not None
+        if not rank_search:
+            ranks = [self.rank]
 
+        # pre-compute the per-trial summary statistics for the true target, once
+        Y_true = self.stim2event(Y)[..., 0:1, :] # (tr,samp,1,e)
+        stats = perTrialSummaryStatistics(X, Y_true, tau=self.tau, offset=self.offset, badEpThresh=self.badEpThresh)
+        sX = np.sum(X, 1) # (tr,d) per-trial data sum for the bias
+        # keep the per-trial statistics, for later incremental refits
+        self.trial_summary_statistics_ = stats
 
-        scores = []
         if verbose > 0:
             print("CV:", end='')
 
@@ -420,8 +468,13 @@ class MultiCCA(BaseSequence2Sequence):
                 print("Warning: no-validation trials!!! using all data!")
                 valid_idx = slice(X.shape[0])
 
-            # 1) fit with max-rank            
-            self.fit(X[train_idx, ...], Y[train_idx, ...], **fit_params)
+            # 1) fit with max-rank, from the total statistics without the held-out trials
+            istrain = np.zeros((X.shape[0],), dtype=bool)
+            istrain[train_idx] = True
+            exclude_idx = np.flatnonzero(np.logical_not(istrain))
+            Cxx, Cxy, Cyy, _ = summaryStatisticsFromTrials(stats, exclude_idx, center=self.center, toeplitz=self.toeplitzCyy)
+            self.fit_cca(Cxx, Cxy, Cyy, dtype=X.dtype)
+            muX = (np.sum(sX, 0) - np.sum(sX[exclude_idx, :], 0)) / max(1, np.sum(istrain)*X.shape[1])
 
             # 2) Extract the desired rank-sub-models and predict with them
             W = self.W_ #(nM,rank,d)
@@ -429,11 +482,11 @@ class MultiCCA(BaseSequence2Sequence):
             for ri,r in enumerate(ranks):
                 self.W_ = W[...,:r,:]
                 self.R_ = R[...,:r,:,:]
-                self.fit_b(X[train_idx,...])
+                self.fit_b(muX=muX)
                 # predict, forcing removal of copies of  tgt=0 so can score
                 Fyi = self.predict(X[valid_idx, ...], Y[valid_idx, ...], dedup0=False)
                 if i==0 and ri==0: # reshape Fy to include the extra model dim
-                    Fy = np.zeros((len(ranks),)+Fyi.shape[:-3]+Y.shape, dtype=np.float32)       
+                    Fy = np.zeros((len(ranks),)+Fyi.shape[:-3]+Y.shape, dtype=X.dtype)       
                 if Fyi.ndim > Y.ndim:
                     # Warning: strange indexing bug.  if use [ri,..] then dim-shapes get reversed!!
                     Fy[ri:ri+1,:,valid_idx,...]=Fyi
@@ -442,17 +495,30 @@ class MultiCCA(BaseSequence2Sequence):
                 scores[ri].append(self.audc_score(Fyi))
         
         #3) get the *best* rank
-        scores= np.mean(np.array(scores),axis=-1) # (ranks,folds) -> ranks
-        print("Rank score: " + ", ".join(["{}={:4.3f}".format(r,s) for (r,s) in zip(ranks,scores)]),end='')
-        maxri = np.argmax(scores)
+        maxri = 0
+        if rank_search:
+            mean_scores = np.mean(np.array(scores),axis=-1) # (ranks,folds) -> ranks
+            print("Rank score: " + ", ".join(["{}={:4.3f}".format(r,s) for (r,s) in zip(ranks,mean_scores)]),end='')
+            maxri = np.argmax(mean_scores)
         self.rank = ranks[maxri]
-        print(" -> best={}".format(self.rank))
+        if rank_search:
+            print(" -> best={}".format(self.rank))
 
-        # final retrain with all the data
-        # TODO[]: just use a normal fit, and get the Fy from the above CV loop 
-        res = BaseSequence2Sequence.cv_fit(self, X, Y, cv=cv_in, fit_params=fit_params, verbose=verbose, 
-                            return_estimator=return_estimator, calibrate_softmax=calibrate_softmax,  retrain_on_all=retrain_on_all)
-        res['Fy_rank']=Fy # store the pre-rank info
+        # final retrain with all the data, directly from the total statistics
+        if retrain_on_all:
+            Cxx, Cxy, Cyy, _ = summaryStatisticsFromTrials(stats, center=self.center, toeplitz=self.toeplitzCyy)
+            self.fit_cca(Cxx, Cxy, Cyy, dtype=X.dtype)
+            muX = np.sum(sX, 0) / (X.shape[0]*X.shape[1])
+            self.fit_b(muX=muX)
+            self.summary_statistics_ = (Cxx, Cxy, Cyy, muX, X.shape[0])
+        else: # use the best rank sub-model of the last fold
+            self.W_ = W[...,:self.rank,:]
+            self.R_ = R[...,:self.rank,:,:]
+            self.fit_b(muX=muX)
+
+        res = self.cv_calibrate(Fy[maxri,...], scores[maxri], return_estimator=return_estimator, calibrate_softmax=calibrate_softmax)
+        if rank_search:
+            res['Fy_rank']=Fy # store the pre-rank info
         return res
 
     
@@ -0,0 +1,167 @@
+#  Copyright (c) 2019 MindAffect B.V.
+#  Author: Jason Farquhar <jason@mindaffect.nl>
+# This file is part of pymindaffectBCI <https://github.com/mindaffect/pymindaffectBCI>.
+#
+# pymindaffectBCI is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pymindaffectBCI is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pymindaffectBCI.  If not, see <http://www.gnu.org/licenses/>
+
+import json
+import inspect
+import numpy as np
+from mindaffectBCI.decoder.updateSummaryStatistics import ToeplitzCyy
+
+# version of the snapshot format, increment on incompatible changes
+SNAPSHOT_VERSION = 1
+# the fitted model attributes in the snapshot
+MODEL_ATTRS = ('W_', 'R_', 'A_', 'b_', 'sigma0_', 'softmaxscale_')
+# names of the per-trial statistics, as returned by `perTrialSummaryStatistics`
+TRIAL_STATS = ('XX', 'sX', 'XY', 'sY', 'YY', 'N')
+
+
+def get_init_params(obj):
+    """get the constructor parameters of obj, i.e. the attributes with the same names as the __init__ arguments"""
+    params = dict()
+    for name, p in inspect.signature(type(obj).__init__).parameters.items():
+        if name == 'self' or p.kind in (p.VAR_POSITIONAL, p.VAR_KEYWORD):
+            continue
+        if hasattr(obj, name):
+            params[name] = getattr(obj, name)
+    return params
+
+
+def to_json(obj):
+    """json encoding of the non-standard types in the config, e.g. numpy scalars"""
+    return obj.tolist() if hasattr(obj, 'tolist') else str(obj)
+
+
+def preprocessor_config(preprocessor):
+    """the json compatible configuration of a data pre-processor, as saved in a snapshot, or None"""
+    if preprocessor is None:
+        return None
+    config = dict(type=type(preprocessor).__name__, params=get_init_params(preprocessor))
+    return json.loads(json.dumps(config, default=to_json))
+
+
+def save_model_snapshot(fname, clsfr, fs:float=None, preprocessor=None):
+    '''
+    save a fitted model in a compact, versioned, snapshot file, for fast warm starts with `load_model_snapshot`
+
+    The snapshot is a compressed numpy .npz file, holding the model configuration (as json), the fitted
+    parameters, and the summary statistics used to fit them, so the model can be incrementally refit later.
+    N.B. no pickled objects are stored, so a snapshot can be safely loaded by later versions of the code.
+
+    Args:
+        fname (str, file-like): the file to save to
+        clsfr (BaseSequence2Sequence): the fitted classifier to save
+        fs (float, optional): the sample rate of the data the model was fitted to. Defaults to None.
+        preprocessor (TransformerMixin, optional): the data pre-processor, e.g. `butterfilt_and_downsample`, only it's configuration is saved. Defaults to None.
+    '''
+    config = dict(version=SNAPSHOT_VERSION,
+                  model=type(clsfr).__name__, params=get_init_params(clsfr), fs=fs,
+                  preprocessor=preprocessor_config(preprocessor))
+    arrays = dict()
+    for a in MODEL_ATTRS:
+        v = getattr(clsfr, a, None)
+        if v is not None:
+            arrays[a] = np.asarray(v)
+
+    # summary statistics, for the online model updates
+    ss = getattr(clsfr, 'summary_statistics_', None)
+    if ss is not None:
+        Cxx, Cxy, Cyy, muX, N = ss
+        arrays.update(Cxx=np.asarray(Cxx), Cxy=np.asarray(Cxy), muX=np.asarray(muX), N=np.asarray(N))
+        if isinstance(Cyy, ToeplitzCyy): # only the diagonal blocks
+            arrays['Cyy_toeplitz'] = Cyy.Cyy_tyee
+        else:
+            arrays['Cyy'] = np.asarray(Cyy)
+
+    # per-trial statistics, for re-fitting with different trials
+    stats = getattr(clsfr, 'trial_summary_statistics_', None)
+    if stats is not None:
+        arrays.update({'trial_'+k: np.asarray(v) for k, v in zip(TRIAL_STATS, stats)})
+
+    np.savez_compressed(fname, config=np.array(json.dumps(config, default=to_json)), **arrays)
+
+
+def load_model_snapshot(fname):
+    '''
+    load a model snapshot saved with `save_model_snapshot`
+
+    Args:
+        fname (str, file-like): the file to load from
+
+    Raises:
+        ValueError: if the snapshot is from a newer, unsupported, version
+
+    Returns:
+        clsfr (BaseSequence2Sequence): the fitted classifier
+        preprocessor (TransformerMixin): a new (unfitted) data pre-processor with the saved configuration, or None
+        fs (float): the sample rate of the data the model was fitted to
+    '''
+    with np.load(fname, allow_pickle=False) as f:
+        config = json.loads(str(f['config']))
+        arrays = {k: f[k] for k in f.files if not k == 'config'}
+    if config.get('version', 0) > SNAPSHOT_VERSION:
+        raise ValueError("Unsupported model snapshot version: {}".format(config.get('version')))
+
+    import mindaffectBCI.decoder.model_fitting as model_fitting
+    # N.B. json has no tuples, so map top-level lists back to tuples
+    params = {k: tuple(v) if isinstance(v, list) else v for k, v in config['params'].items()}
+    clsfr = getattr(model_fitting, config['model'])(**params)
+    for a in MODEL_ATTRS:
+        if a in arrays:
+            v = arrays[a]
+            setattr(clsfr, a, v.item() if v.ndim == 0 else v)
+
+    if 'Cxx' in arrays:
+        Cyy = ToeplitzCyy(arrays['Cyy_toeplitz']) if 'Cyy_toeplitz' in arrays else arrays['Cyy']
+        clsfr.summary_statistics_ = (arrays['Cxx'], arrays['Cxy'], Cyy, arrays['muX'], arrays['N'].item())
+    if 'trial_N' in arrays:
+        clsfr.trial_summary_statistics_ = tuple(arrays['trial_'+k] for k in TRIAL_STATS)
+
+    preprocessor = None
+    if config.get('preprocessor') is not None:
+        import mindaffectBCI.decoder.UtopiaDataInterface as UtopiaDataInterface
+        pp = config['preprocessor']
+        preprocessor = getattr(UtopiaDataInterface, pp['type'])(**pp['params'])
+    return clsfr, preprocessor, config.get('fs')
+
+
+def testcase():
+    import os
+    import time
+    import tempfile
+    from mindaffectBCI.decoder.utils import testSignal
+    from mindaffectBCI.decoder.model_fitting import MultiCCA
+    from mindaffectBCI.decoder.UtopiaDataInterface import butterfilt_and_downsample
+    X, Y, st, A, B = testSignal(nTrl=20, d=8, nE=2, nY=10, isi=5, tau=10, nSamp=400)
+    Y = Y[..., 0] # stimulus sequence
+    clsfr = MultiCCA(tau=10, evtlabs=('re', 'fe'), rank=1)
+    clsfr.cv_fit(X, Y, cv=3)
+    ppfn = butterfilt_and_downsample(stopband=((45,65),(5.5,25,'bandpass')), fs_out=100)
+
+    fname = os.path.join(tempfile.mkdtemp(), 'model.npz')
+    save_model_snapshot(fname, clsfr, fs=100, preprocessor=ppfn)
+    print("Snapshot {} bytes".format(os.path.getsize(fname)))
+    t0 = time.perf_counter()
+    clsfr2, ppfn2, fs = load_model_snapshot(fname)
+    print("Loaded {} in {:.3f}s".format(clsfr2, time.perf_counter()-t0))
+    print("preprocessor={} fs={}".format(get_init_params(ppfn2), fs))
+    Fy = clsfr.predict(X, Y)
+    Fy2 = clsfr2.predict(X, Y)
+    print("max |Fy-Fy2| = {}".format(np.max(np.abs(Fy-Fy2))))
+    print("P(tgt) {} = {}".format(clsfr.decode_proba(Fy)[0,-1,:3], clsfr2.decode_proba(Fy2)[0,-1,:3]))
+
+
+if __name__ == "__main__":
+    testcase()
@@ -17,9 +17,13 @@
 
 import numpy as np
 import warnings
+from mindaffectBCI.decoder.updateSummaryStatistics import ToeplitzCyy
+
+# min number of models for the block-Toeplitz whitener, for fewer the full eigen-decomposition is faster
+TOEPLITZ_MIN_MODELS = 4
 
 def multipleCCA(Cxx=None, Cxy=None, Cyy=None,
-                reg=1e-8, rank=1, CCA=True, rcond=1e-4, symetric=False):
+                reg=1e-8, rank=1, CCA=True, rcond=1e-4, symetric=False, batch:bool=True):
     '''
     Compute multiple CCA decompositions using the given summary statistics
       [J,W,R]=multiCCA(Cxx,Cxy,Cyy,regx,regy,rank,CCA)
@@ -27,6 +31,7 @@ def multipleCCA(Cxx=None, Cxy=None, Cyy=None,
       Cxx  = (d,d) current data covariance
       Cxy  = (nM,nE,tau,d) current per output ERPs
       Cyy  = (nM,nE,tau,nE,tau) current response covariance for each output
+             OR ToeplitzCyy with (tau,nM,nE,nE) diagonal blocks, which is whitened without expanding
       reg  = (1,) :float or (2,):float linear weighting reg strength or separate values for Cxx and Cyy 
             OR (d,) regularisation ridge coefficients for Cxx  (0)
       rank= [1x1] number of top cca components to return (1)
@@ -36,6 +41,7 @@ def multipleCCA(Cxx=None, Cxy=None, Cyy=None,
                or [2x1] (-1<-0) negative values = keep this fraction of eigen-values
                or (2,1) <-1 keep this many eigenvalues
       symetric = [bool] us symetric whitener?
+      batch = [bool] solve all the models at once with stacked eigh/svd calls, or loop over models (true)
     Outputs:
       J     = (nM,) optimisation objective scores
       W     = (nM,rank,d) spatial filters for each output
@@ -72,9 +78,9 @@ def multipleCCA(Cxx=None, Cxy=None, Cyy=None,
     # 3d Cxy, Cyy for linear alg stuff, (nM,feat,feat) - N.B. add model dim if needed
     nM = Cxy.shape[0] if Cxy.ndim > 3 else 1
     if Cxx.ndim > 2:
-        Cxx2d = np.reshape(Cxx, (nM, Cxx.shape[-4]*Cxx.shape[-3], Cxx.shape[-2]*Cxx.shape[-1]))
+        Cxx2d = np.reshape(Cxx, (-1, Cxx.shape[-4]*Cxx.shape[-3], Cxx.shape[-2]*Cxx.shape[-1]))
     else:
-        Cxx2d = np.reshape(Cxx, (nM, Cxx.shape[-2], Cxx.shape[-1]))
+        Cxx2d = np.reshape(Cxx, (-1, Cxx.shape[-2], Cxx.shape[-1])) # (nM,d,d) or (1,d,d) if shared
 
     if Cxx.ndim < 4 and Cyy.ndim >= 4:
         Cxy2d = np.reshape(Cxy, (nM, Cxy.shape[-3]*Cxy.shape[-2], Cxy.shape[-1]))  # (nM,(nE*tau),d)
@@ -83,11 +89,18 @@ def multipleCCA(Cxx=None, Cxy=None, Cyy=None,
     elif Cxx.ndim >= 4 and Cyy.ndim >= 4:
         raise NotImplementedError("Not immplemented yet for double temporally embedded inputs")
         
-    if Cyy.ndim > 2:
-        Cyy2d = np.reshape(Cyy, (nM, Cyy.shape[-4]*Cyy.shape[-3], Cyy.shape[-2] * Cyy.shape[-1]))  # (nM,(nE*tau),(nE*tau))
+    if isinstance(Cyy, ToeplitzCyy):
+        # keep the block structure, with a model dim, for the whitener
+        Cyy_tyee = Cyy.Cyy_tyee
+        Cyy2d = ToeplitzCyy(np.reshape(Cyy_tyee, (Cyy_tyee.shape[0], -1, Cyy_tyee.shape[-2], Cyy_tyee.shape[-1]))) # (tau,nM,nE,nE)
+        nfeaty = Cyy.shape[-2] * Cyy.shape[-1]
+    elif Cyy.ndim > 2:
+        Cyy2d = np.reshape(Cyy, (-1, Cyy.shape[-4]*Cyy.shape[-3], Cyy.shape[-2] * Cyy.shape[-1]))  # (nM,(nE*tau),(nE*tau))
+        nfeaty = Cyy2d.shape[-1]
     else:
-        Cyy2d = np.reshape(Cyy, (nM, Cyy.shape[-2], Cyy.shape[-1]))  # (nM,e,e)    
-    rank = min(min(rank, Cxy2d.shape[-1]), Cyy2d.shape[-1])
+        Cyy2d = np.reshape(Cyy, (-1, Cyy.shape[-2], Cyy.shape[-1]))  # (nM,e,e)    
+        nfeaty = Cyy2d.shape[-1]
+    rank = min(min(rank, Cxy2d.shape[-1]), nfeaty)
 
     
     # convert to double precision if needed
@@ -95,10 +108,33 @@ def multipleCCA(Cxx=None, Cxy=None, Cyy=None,
         Cxx2d = np.array(Cxx2d, dtype=np.float64)
     if np.issubdtype(Cxy2d.dtype, np.float32) or np.issubdtype(Cxy2d.dtype, np.signedinteger):
         Cxy2d = np.array(Cxy2d, dtype=np.float64)
-    if np.issubdtype(Cyy2d.dtype, np.float32) or np.issubdtype(Cyy2d.dtype, np.signedinteger):
+    if isinstance(Cyy2d, ToeplitzCyy):
+        pass # N.B. the whitener works in double
+    elif np.issubdtype(Cyy2d.dtype, np.float32) or np.issubdtype(Cyy2d.dtype, np.signedinteger):
         Cyy2d = np.array(Cyy2d, dtype=np.float64)
     
-    # do CCA/PLS for each output in turn
+    if batch:
+        J, W, R = _multipleCCA_batch(Cxx2d, Cxy2d, Cyy2d, reg, rank, CCA, rcond, symetric)
+    else:
+        J, W, R = _multipleCCA_loop(Cxx2d, Cxy2d, Cyy2d, reg, rank, CCA, rcond, symetric)
+
+    # Map back to input shape
+    if Cyy.ndim > 2:
+        R = np.reshape(R, (R.shape[0], R.shape[1], Cyy.shape[-2], Cyy.shape[-1])) # (nM,rank,nE,tau)
+    if Cxx.ndim > 2:
+        W = np.reshape(W, (W.shape[0], W.shape[1], Cxx.shape[-2], Cxx.shape[-1]))
+
+    # strip model dim if not needed
+    if Cxy.ndim == 3:
+        R = R[0, ...]
+        W = W[0, ...]
+        J = J[0, ...]
+        
+    return J, W, R
+
+
+def _multipleCCA_loop(Cxx2d, Cxy2d, Cyy2d, reg, rank, CCA, rcond, symetric):
+    """ solve the CCA for each model in turn, see multipleCCA for the arguments """
     J = np.zeros((Cxy2d.shape[0]))  # [ nM ]
     W = np.zeros((Cxy2d.shape[0], rank, Cxy2d.shape[2]))  # (nM,rank,d)
     R = np.zeros((Cxy2d.shape[0], rank, Cxy2d.shape[1]))  # (nM,rank,(nE*tau)) 
@@ -109,7 +145,7 @@ def multipleCCA(Cxx=None, Cxy=None, Cyy=None,
         # Whitener for X
         if CCA[0]:
             # compute model specific whitener, or re-use the  last one
-            if mi <= Cxx2d.shape[0]:
+            if mi < Cxx2d.shape[0]:
                 isqrtCxx, _ = robust_whitener(Cxx2d[mi, :, :], reg[0], rcond[0], symetric)
             # compute whitened Cxy
             isqrtCxxCxym = np.dot(Cxym, isqrtCxx) # (nM,(nE*tau),d)
@@ -119,7 +155,7 @@ def multipleCCA(Cxx=None, Cxy=None, Cyy=None,
         # Whitener for Y
         if CCA[1]:
             # compute model-specific whitener, or re-use the last one
-            if mi <= Cyy2d.shape[0]:
+            if mi < Cyy2d.shape[0]:
                 isqrtCyy, _ = robust_whitener(Cyy2d[mi, :, :], reg[1], rcond[1], symetric)
             isqrtCxxCxymisqrtCyy = np.dot(isqrtCyy.T, isqrtCxxCxym)
         else:
@@ -148,86 +184,141 @@ def multipleCCA(Cxx=None, Cxy=None, Cyy=None,
         W[mi, :r, :] = Wm[:, slmidx[:r]].T  #(nM,rank,d)
         J[mi] = lm[slmidx[-1]]  # N.B. this is *wrong* for rank>1
         R[mi, :r, :] = Rm[:, slmidx[:r]].T  #(nM,rank,(nE*tau))
-        
-    # Map back to input shape
-    if Cyy.ndim > 2:
-        R = np.reshape(R, (R.shape[0], R.shape[1], Cyy.shape[-2], Cyy.shape[-1])) # (nM,rank,nE,tau)
-    if Cxx.ndim > 2:
-        W = np.reshape(W, (W.shape[0], W.shape[1], Cxx.shape[-2], Cxx.shape[-1]))
+    return J, W, R
 
-    # strip model dim if not needed
-    if Cxy.ndim == 3:
-        R = R[0, ...]
-        W = W[0, ...]
-        J = J[0, ...]
-        
+
+def _multipleCCA_batch(Cxx2d, Cxy2d, Cyy2d, reg, rank, CCA, rcond, symetric):
+    """ solve the CCA for all models at once with stacked whiteners and svd, see multipleCCA for the arguments 
+
+    N.B. a shared Cxx (or Cyy), i.e. with leading dim 1, is only whitened once and broadcast over the models
+    """
+    nM = Cxy2d.shape[0]
+    A = Cxy2d  # (nM,(nE*tau),d)
+    # Whitener for X
+    if CCA[0]:
+        isqrtCxx, _, nkeepx = batch_robust_whitener(Cxx2d, reg[0], rcond[0], symetric)  # (nM|1,d,d)
+        A = A @ isqrtCxx  # (nM,(nE*tau),d)
+    else:
+        nkeepx = np.full((1,), Cxy2d.shape[2])
+    # Whitener for Y
+    if CCA[1]:
+        isqrtCyy, _, nkeepy = batch_robust_whitener(Cyy2d, reg[1], rcond[1], symetric)  # (nM|1,(nE*tau),(nE*tau))
+        A = np.swapaxes(isqrtCyy, -1, -2) @ A
+    else:
+        nkeepy = np.full((1,), Cxy2d.shape[1])
+
+    # SVD for the double whitened cross covariance, N.B. singular values in DESCENDING order
+    # Rm=(nM,(nE*tau),k),lm=(nM,k),Wm=(nM,k,d)
+    Rm, lm, Wm = np.linalg.svd(A, full_matrices=False)
+    Wm = np.swapaxes(Wm, -1, -2)  # (nM,d,k)
+
+    # include relative component weighting directly in the  Left/Right singular values
+    nlm = lm / np.max(lm, -1, keepdims=True)  # normalize so predictions have unit average norm
+    Rm = Rm * nlm[:, np.newaxis, :]
+
+    # only keep the parts we want before pre-applying the whitener
+    r = min(lm.shape[-1], rank)  # guard rank>effective dim
+    Wm = Wm[..., :r]
+    Rm = Rm[..., :r]
+    # pre-apply the pre-whitener so can apply the result directly on input data
+    if CCA[0]:
+        Wm = isqrtCxx @ Wm
+    if CCA[1]:
+        Rm = isqrtCyy @ Rm
+
+    W = np.zeros((nM, rank, Cxy2d.shape[2]))  # (nM,rank,d)
+    R = np.zeros((nM, rank, Cxy2d.shape[1]))  # (nM,rank,(nE*tau))
+    W[:, :r, :] = np.swapaxes(Wm, -1, -2)
+    R[:, :r, :] = np.swapaxes(Rm, -1, -2)
+    # smallest singular value of the effective (non-truncated) solution, as for the loop
+    # N.B. this is *wrong* for rank>1
+    if symetric:
+        neff = np.full((nM,), lm.shape[-1])
+    else:
+        neff = np.minimum(np.minimum(nkeepx, nkeepy), lm.shape[-1]) * np.ones((nM,), dtype=int)
+    J = lm[np.arange(nM), np.maximum(neff, 1)-1]
     return J, W, R
 
 
-def robust_whitener(C:np.ndarray, reg:float=0, rcond:float=1e-6, symetric:bool=True, verb:int=0):
-    """compute a robust whitener for the input covariance matrix C, s.t. isqrtC*C*isqrtC.T = I
+def _whitener_eigs(C:np.ndarray, reg:float=0, rcond:float=1e-6, verb:int=0):
+    """regularised symetric eigen-decomposition of a stack of covariance matrices, with the bad/degenerate eigen-values marked
+
     Args:
-        C ((d,d) np.ndarray): Sample covariance matrix of the data
-        reg (float, optional): regularization strength when computing the whitener. Defaults to 0.
-        rcond (float, optional): reverse-condition number for truncating degenerate eigen-values when computing the inverse. Defaults to 1e-6.
-        symetric (bool, optional): flag to produce a symetric-whitener (which preserves location) or not. Defaults to True.
+        C ((...,d,d) np.ndarray): stack of sample covariance matrices
+        reg (float, optional): regularization strength. Defaults to 0.
+        rcond (float, optional): reverse-condition number for truncating degenerate eigen-values. Defaults to 1e-6.
         verb (int, optional): verbosity level. Defaults to 0.
 
     Returns:
-        W (np.ndarray): The whitening matrix
-        iW (np.ndarray): The inverse whitening matrix
-    """    
+        sigma ((...,d) np.ndarray): the eigen-values
+        U ((...,d,d) np.ndarray): the eigen-vectors
+        keep ((...,d) np.ndarray): bool flag for the eigen-values to keep
+    """
     assert not np.any(np.isnan(C.ravel())) and not np.any(np.isinf(C.ravel())), "NaN or Inf in inputs!"
 
     # ensure symetric
-    C = (C + C.T) / 2
+    C = (C + np.swapaxes(C, -1, -2)) / 2
 
     # include the regularisor if needed
     # TODO[]: include the ridge later, i.e. after the eigendecomp?
-    if not reg is None and not reg == 0:
+    if not reg is None and not np.all(np.equal(reg, 0)):
+        d = C.shape[-1]
         # TODO[]: Optimal shrinkage?
         if np.ndim(reg) == 0 or len(reg) == 1:  # weight w.r.t. same amplitude identity
-            C = (1-reg)*C + reg*np.eye(C.shape[0], dtype=C.dtype)*np.median(C.diagonal())
-        elif len(reg) == C.shape[0]:  # diag entries
-            np.fill_diagonal(C, C.diagonal()+reg)
+            reg = np.ravel(reg)[0]
+            mdiag = np.median(np.diagonal(C, axis1=-2, axis2=-1), -1)[..., np.newaxis, np.newaxis]
+            C = (1-reg)*C + reg*np.eye(d, dtype=C.dtype)*mdiag
+        elif len(reg) == d:  # diag entries
+            C = C + np.diag(reg).astype(C.dtype)
         else:  # full reg matrix
             C = C + reg
 
-    # eigen decomp
-    sigma, U = np.linalg.eig(C)  # sigma=(r,) U=(d,k)
-    U = U.real
-    
-    # identify bad/degenerate eigen-values, complex, negative, inf, nan or too small
-    bad = np.any(np.vstack((np.abs(sigma.imag > np.finfo(sigma.dtype).eps),  # complex
-                            np.isinf(sigma),  # inf
-                            np.isnan(sigma),  # nan
-                            np.abs(sigma)<np.finfo(sigma.dtype).eps)), 0)  # too-small
+    # symetric eigen decomp, N.B. real eigenvalues in ASCENDING order
+    sigma, U = np.linalg.eigh(C)  # sigma=(...,d) U=(...,d,d)
+
+    # identify bad/degenerate eigen-values, inf, nan or too small
+    bad = np.logical_or(np.logical_or(np.isinf(sigma), np.isnan(sigma)),
+                        np.abs(sigma) < np.finfo(sigma.dtype).eps)
     if verb:
-        print("{} bad eig".format(sum(bad)))
+        print("{} bad eig".format(np.sum(bad)))
     # zero these bad ones
     sigma[bad] = 0
 
     # additional badness conditions based on eigen-spectrum
     if not rcond is None:
-        #print('rcond={}\nsigma\{}'.format(rcond,sigma))
         # identify eigen-values we want to remove due to rcond
         if 0 <= rcond:  # value threshold
-            #print('bad={}'.format(bad))
-            bad = np.logical_or(bad, sigma.real < rcond*np.median(np.abs(sigma)))
-            #print('bad={}'.format(bad))
-        elif -1 < rcond and rcond < 0:  # fraction
-            si = np.argsort(sigma)  # N.B. Ascending
-            bad[si[:int(len(si)*abs(rcond))]] = True  # up to this fraction are bad
+            bad = np.logical_or(bad, sigma < rcond*np.median(np.abs(sigma), -1, keepdims=True))
+        elif -1 < rcond and rcond < 0:  # fraction, N.B. sigma is sorted ascending
+            bad[..., :int(sigma.shape[-1]*abs(rcond))] = True  # up to this fraction are bad
         elif rcond < -1:  # number to discard
-            si = np.argsort(sigma)
-            bad[si[:abs(rcond)]] = True  # this many are bad
+            bad[..., :int(abs(rcond))] = True  # this many are bad
 
     if verb:
-        print("{} rcond+bad eig".format(sum(bad)))
+        print("{} rcond+bad eig".format(np.sum(bad)))
+    return sigma, U, np.logical_not(bad)
+
+
+def robust_whitener(C:np.ndarray, reg:float=0, rcond:float=1e-6, symetric:bool=True, verb:int=0):
+    """compute a robust whitener for the input covariance matrix C, s.t. isqrtC*C*isqrtC.T = I
+    Args:
+        C ((d,d) np.ndarray): Sample covariance matrix of the data
+        reg (float, optional): regularization strength when computing the whitener. Defaults to 0.
+        rcond (float, optional): reverse-condition number for truncating degenerate eigen-values when computing the inverse. Defaults to 1e-6.
+        symetric (bool, optional): flag to produce a symetric-whitener (which preserves location) or not. Defaults to True.
+        verb (int, optional): verbosity level. Defaults to 0.
+
+    Returns:
+        W (np.ndarray): The whitening matrix
+        iW (np.ndarray): The inverse whitening matrix
+    """    
+    if isinstance(C, ToeplitzCyy):
+        isqrtC, _, _ = block_toeplitz_whitener(C, reg, rcond, symetric, verb)
+        return (isqrtC, isqrtC)
+    sigma, U, keep = _whitener_eigs(C, reg, rcond, verb)
 
     # compute the whitener (and it's inverse)
-    if not all(bad):
-        keep = np.logical_not(bad)
+    if any(keep):
         Ukeep = U[:, keep]  # (d,r)
         sqrtsigmakeep = np.sqrt(np.abs(sigma[keep]))  #(r,)
         # non-symetric (and rank  reducing) version
@@ -245,6 +336,141 @@ def robust_whitener(C:np.ndarray, reg:float=0, rcond:float=1e-6, symetric:bool=T
     return (isqrtC, isqrtC)
 
 
+def batch_robust_whitener(C:np.ndarray, reg:float=0, rcond:float=1e-6, symetric:bool=True, verb:int=0):
+    """compute robust whiteners for a stack of covariance matrices with a single batched eigen-decomposition
+
+    As for robust_whitener, but as the number of retained components can differ between the matrices,
+    the non-symetric whiteners are zero-padded to full size, i.e. removed components have zero columns.
+
+    Args:
+        C ((...,d,d) np.ndarray): stack of sample covariance matrices
+        reg (float, optional): regularization strength when computing the whitener. Defaults to 0.
+        rcond (float, optional): reverse-condition number for truncating degenerate eigen-values when computing the inverse. Defaults to 1e-6.
+        symetric (bool, optional): flag to produce a symetric-whitener (which preserves location) or not. Defaults to True.
+        verb (int, optional): verbosity level. Defaults to 0.
+
+    Returns:
+        W ((...,d,d) np.ndarray): The whitening matrices
+        iW ((...,d,d) np.ndarray): The inverse whitening matrices
+        nkeep ((...) np.ndarray): the number of retained components for each matrix
+    """
+    if isinstance(C, ToeplitzCyy):
+        return block_toeplitz_whitener(C, reg, rcond, symetric, verb)
+    sigma, U, keep = _whitener_eigs(C, reg, rcond, verb)
+    sqrtsigma = np.sqrt(np.abs(sigma))
+    isqrtsigma = np.zeros_like(sqrtsigma)
+    isqrtsigma[keep] = 1.0 / sqrtsigma[keep]
+    sqrtsigma[~keep] = 0
+    sqrtC = U * sqrtsigma[..., np.newaxis, :]
+    isqrtC = U * isqrtsigma[..., np.newaxis, :]
+    # post apply U to get symetric version if wanted
+    if symetric:
+        Ut = np.swapaxes(U, -1, -2)
+        sqrtC = sqrtC @ Ut
+        isqrtC = isqrtC @ Ut
+
+    nkeep = np.sum(keep, -1)
+    # identity for fully degenerate inputs
+    degenerate = nkeep == 0
+    if np.any(degenerate):
+        warnings.warn('Degenerate C matrices input!')
+        sqrtC[degenerate] = np.eye(C.shape[-1], dtype=sqrtC.dtype)
+        isqrtC[degenerate] = np.eye(C.shape[-1], dtype=isqrtC.dtype)
+    return (isqrtC, sqrtC, nkeep)
+
+
+def block_toeplitz_whitener(C:ToeplitzCyy, reg:float=0, rcond:float=1e-6, symetric:bool=False, verb:int=0):
+    """compute whiteners for a (stack of) block-Toeplitz covariance matrices directly from their diagonal blocks
+
+    Uses the block Levinson (Whittle) recursion to get the block LDL' factorization of the inverse,
+    i.e. C^-1 = L' D^-1 L with L unit lower block-triangular, for all the matrices at once in O(tau^2 nE^3),
+    rather than the O((tau nE)^3) eigen-decomposition of each full matrix.  The whitener is then L' D^-1/2.
+    As the symetric whitener, non-scalar regularisors and rcond fractions/counts need the eigen-spectrum,
+    these cases (and matrices with an innovation variance below rcond * the median variance) fall back to
+    `batch_robust_whitener` on the full matrix, as do small stacks, i.e. < TOEPLITZ_MIN_MODELS, where it's faster.
+    N.B. the inverse whitener is not computed, as that is a full matrix product, use C @ W if it's needed.
+
+    Args:
+        C (ToeplitzCyy): the block-Toeplitz covariance with (tau,nM,nE,nE) or (tau,nE,nE) diagonal blocks
+        reg (float, optional): regularization strength when computing the whitener. Defaults to 0.
+        rcond (float, optional): reverse-condition number for the ill-conditioned fallback. Defaults to 1e-6.
+        symetric (bool, optional): flag to produce a symetric-whitener (which preserves location) or not. Defaults to False.
+        verb (int, optional): verbosity level. Defaults to 0.
+
+    Returns:
+        W (((nM,) nE*tau,nE*tau) np.ndarray): The whitening matrices
+        iW (None): The inverse whitening matrices are not computed
+        nkeep (((nM,)) np.ndarray): the number of retained components for each matrix
+    """
+    R = np.array(C.Cyy_tyee, dtype=np.float64)
+    squeeze = R.ndim < 4
+    if squeeze:
+        R = R[:, np.newaxis, ...]
+    tau, nM, nE = R.shape[0], R.shape[1], R.shape[-1]
+
+    if symetric or np.size(reg) > 1 or (rcond is not None and rcond < 0) or nM < TOEPLITZ_MIN_MODELS:
+        bad = np.ones((nM,), dtype=bool)
+    else:
+        # ensure symetric, and include the regularisor, which keeps the Toeplitz structure
+        R[0] = (R[0] + R[0].swapaxes(-1, -2)) / 2
+        if not reg is None and not np.all(np.equal(reg, 0)):
+            reg = np.ravel(reg)[0]
+            mdiag = np.median(np.diagonal(R[0], axis1=-2, axis2=-1), -1)[..., np.newaxis, np.newaxis]
+            R = (1-reg)*R
+            R[0] = R[0] + reg*np.eye(nE)*mdiag
+        thresh = max(rcond if rcond is not None else 0, np.finfo(R.dtype).eps) * \
+                 np.abs(np.median(np.diagonal(R[0], axis1=-2, axis2=-1), -1)) # (nM,)
+        ridge = thresh[:, np.newaxis, np.newaxis]*np.eye(nE)
+
+        # block Levinson: forward/backward predictors A/B, and their error covariances Sf/Sb
+        # N.B. block (i,j) of C is R(j-i), with R(-k) = R(k)'
+        Rt = np.ascontiguousarray(R.swapaxes(-1, -2).transpose((1, 0, 2, 3))) # (nM,tau,nE,nE) R(k)'
+        A = np.zeros((nM, nE, 0, nE)) # (nM,nE,k,nE) forward predictor for lag k+1
+        B = np.zeros((nM, nE, 0, nE)) # (nM,nE,k,nE) backward predictor for lag k+1
+        Sf = R[0].copy()
+        Sb = R[0].copy()
+        Linv = np.zeros((nM, tau, nE, tau, nE)) # L^-1, rows are the innovations
+        isqrtD = np.zeros((nM, tau, nE, nE)) # D^-1/2 for each innovation
+        bad = np.zeros((nM,), dtype=bool)
+        for n in range(tau):
+            # innovation of sample n, given all the previous ones
+            sigma, U = np.linalg.eigh((Sf + Sf.swapaxes(-1, -2)) / 2)
+            bad |= sigma[:, 0] < thresh
+            sigma = np.maximum(sigma, thresh[:, np.newaxis]) # N.B. bad are replaced later
+            isqrtD[:, n] = (U / np.sqrt(sigma)[:, np.newaxis, :]).swapaxes(-1, -2)
+            Linv[:, n, :, n, :] = np.eye(nE)
+            Linv[:, n, :, :n, :] = -A[:, :, ::-1, :]
+            if n+1 == tau:
+                break
+            # extend the predictors by one lag
+            Delta = Rt[:, n+1] - A.reshape((nM, nE, n*nE)) @ Rt[:, n:0:-1].reshape((nM, n*nE, nE))
+            Kf = np.linalg.solve(Sb + bad[:, np.newaxis, np.newaxis]*ridge, Delta.swapaxes(-1, -2)).swapaxes(-1, -2)
+            Kb = np.linalg.solve(Sf + bad[:, np.newaxis, np.newaxis]*ridge, Delta).swapaxes(-1, -2)
+            A, B = (np.concatenate((A - (Kf @ B[:, :, ::-1, :].reshape((nM, nE, n*nE))).reshape(A.shape), Kf[:, :, np.newaxis, :]), 2),
+                    np.concatenate((B - (Kb @ A[:, :, ::-1, :].reshape((nM, nE, n*nE))).reshape(B.shape), Kb[:, :, np.newaxis, :]), 2))
+            Sf = Sf - Kf @ Delta.swapaxes(-1, -2)
+            Sb = Sb - Kb @ Delta
+
+        # W' = D^-1/2 L^-1, with the rows of W in (nE,tau) order
+        Wt = isqrtD @ Linv.reshape((nM, tau, nE, tau*nE)) # (nM,tau,nE,tau*nE)
+        isqrtC = Wt.reshape((nM, tau*nE, tau, nE)).transpose((0, 3, 2, 1)).reshape((nM, nE*tau, tau*nE))
+        nkeep = np.full((nM,), nE*tau)
+
+    if np.any(bad):
+        if verb:
+            print("{} using eigen-whitener".format(np.sum(bad)))
+        Cfull = np.reshape(C.full(), (-1, nE*tau, nE*tau))[bad, ...].astype(np.float64)
+        bisqrtC, _, bnkeep = batch_robust_whitener(Cfull, reg, rcond, symetric, verb)
+        if np.all(bad):
+            isqrtC, nkeep = bisqrtC, bnkeep
+        else:
+            isqrtC[bad], nkeep[bad] = bisqrtC, bnkeep
+
+    if squeeze:
+        isqrtC, nkeep = isqrtC[0, ...], nkeep[0]
+    return (isqrtC, None, nkeep)
+
+
 
 
 def cvSupervised(Xe, Me, stimTimes, evtlabs=('re', 'fe'), n_splits=10, rank=1):
@@ -289,6 +515,90 @@ def cvSupervised(Xe, Me, stimTimes, evtlabs=('re', 'fe'), n_splits=10, rank=1):
     return (W, R, Fy)
     
 
+def benchmark_multipleCCA(ds=(8, 32, 64), taus=(10, 50), nMs=(1, 10, 50), nE:int=2, nrep:int=3, **kwargs):
+    """benchmark the batched vs. per-model looped multipleCCA solvers
+
+    Args:
+        ds (tuple, optional): numbers of channels to test. Defaults to (8, 32, 64).
+        taus (tuple, optional): response lengths to test. Defaults to (10, 50).
+        nMs (tuple, optional): numbers of models to test. Defaults to (1, 10, 50).
+        nE (int, optional): number of event types. Defaults to 2.
+        nrep (int, optional): number of repetitions, the fastest is reported. Defaults to 3.
+        kwargs: additional arguments for multipleCCA
+
+    Returns:
+        list-of-dict: the timing results
+    """
+    import time
+    res = []
+    for d in ds:
+        for tau in taus:
+            for nM in nMs:
+                X = np.random.standard_normal((max(1000, 2*d), d))
+                Cxx = X.T @ X  # shared data covariance
+                Cxy = np.random.standard_normal((nM, nE, tau, d))
+                Y = np.random.standard_normal((nM, max(1000, 2*nE*tau), nE*tau))
+                Cyy = np.einsum('mti,mtj->mij', Y, Y).reshape((nM, nE, tau, nE, tau))
+                t = dict()
+                for batch in (False, True):
+                    t[batch] = np.inf
+                    for _ in range(nrep):
+                        t0 = time.perf_counter()
+                        multipleCCA(Cxx, Cxy, Cyy, batch=batch, **kwargs)
+                        t[batch] = min(t[batch], time.perf_counter() - t0)
+                res.append(dict(d=d, tau=tau, nM=nM, loop_ms=t[False]*1000, batch_ms=t[True]*1000))
+                print("d={:3d} tau={:3d} nM={:3d} : loop {:8.2f}ms  batch {:8.2f}ms  = {:5.1f}x".format(
+                      d, tau, nM, t[False]*1000, t[True]*1000, t[False]/t[True]))
+    return res
+
+
+def benchmark_toeplitz_multipleCCA(taus=(20, 45, 80), nMs=(1, 36), d:int=32, nE:int=2, nSamp:int=6000, nrep:int=3):
+    """benchmark multipleCCA with the full vs. block-Toeplitz Cyy, for stimulus sequence based Cyy, checking they give the same results
+
+    Args:
+        taus (tuple, optional): response lengths to test. Defaults to (20, 45, 80).
+        nMs (tuple, optional): numbers of models (outputs) to test. Defaults to (1, 36).
+        d (int, optional): number of channels. Defaults to 32.
+        nE (int, optional): number of event types. Defaults to 2.
+        nSamp (int, optional): number of samples of data. Defaults to 6000.
+        nrep (int, optional): number of repetitions, the fastest is reported. Defaults to 3.
+
+    Returns:
+        list-of-dict: the timing results
+    """
+    import time
+    from mindaffectBCI.decoder.updateSummaryStatistics import updateSummaryStatistics
+    res = []
+    for tau in taus:
+        for nM in nMs:
+            X = np.random.standard_normal((1, nSamp, d)).astype(np.float32)
+            Y = (np.random.uniform(size=(1, nSamp, nM, nE)) < .1).astype(np.uint8)
+            Cxx, Cxy, Cyy = updateSummaryStatistics(X, Y, tau=tau)
+            _, _, Ct = updateSummaryStatistics(X, Y, tau=tau, toeplitz=True)
+            # check the Toeplitz products match the dense Cyy, with and without the output dim
+            Cyy2d = Cyy.reshape((nM, nE*tau, nE*tau))
+            B = np.random.standard_normal((nM, nE*tau, 3))
+            assert np.allclose(Ct @ B, Cyy2d @ B, rtol=1e-4, atol=1e-4*np.max(np.abs(Cyy2d @ B)))
+            assert np.allclose(Ct[0] @ B[0], Cyy2d[0] @ B[0], rtol=1e-4, atol=1e-4*np.max(np.abs(Cyy2d[0] @ B[0])))
+            t, JWR = dict(), dict()
+            for key, C in (('full', Cyy), ('toeplitz', Ct)):
+                t[key] = np.inf
+                for _ in range(nrep):
+                    t0 = time.perf_counter()
+                    JWR[key] = multipleCCA(Cxx, Cxy, C)
+                    t[key] = min(t[key], time.perf_counter() - t0)
+            # check they fit the same model, N.B. up to the sign of each component
+            (J, W, R), (Jt, Wt, Rt) = JWR['full'], JWR['toeplitz']
+            Wcorr = np.abs(np.sum(W*Wt, -1)) / np.sqrt(np.sum(W*W, -1)*np.sum(Wt*Wt, -1))
+            print("|J-Jt|={:g} min W corr={:g}".format(np.max(np.abs(J-Jt)), np.min(Wcorr)))
+            assert np.allclose(J, Jt, rtol=1e-3, atol=1e-4) and np.all(Wcorr > .999), "Toeplitz and full Cyy models differ"
+            res.append(dict(tau=tau, nM=nM, full_ms=t['full']*1000, toeplitz_ms=t['toeplitz']*1000,
+                            full_bytes=Cyy.nbytes, toeplitz_bytes=Ct.Cyy_tyee.nbytes))
+            print("tau={:3d} nM={:3d} : full {:8.2f}ms {:8d}b  toeplitz {:8.2f}ms {:8d}b = {:5.1f}x".format(
+                  tau, nM, t['full']*1000, Cyy.nbytes, t['toeplitz']*1000, Ct.Cyy_tyee.nbytes, t['full']/t['toeplitz']))
+    return res
+
+
 def testcase():
     from mindaffectBCI.decoder.utils import testNoSignal, testSignal, sliceData, sliceY
     #from multipleCCA import *
@@ -335,6 +645,59 @@ def testcase():
 
 
 
+def test_whitener_reference(d:int=8, tau:int=10, tol:float=1e-8):
+    """regression check of the whiteners and the CCA solution against reference implementations
+
+    N.B. before the symetric eigh solver was used, the whitener for the Cyy from `testSignal`, which has repeated
+    eigen-values, was not orthogonal (W'CW-I ~.7), so fitted models (and their calibration) differed from these references.
+    """
+    from scipy.linalg import sqrtm, eigh
+    from mindaffectBCI.decoder.utils import testSignal
+    from mindaffectBCI.decoder.updateSummaryStatistics import updateSummaryStatistics
+    rng = np.random.RandomState(0)
+
+    # full-rank: symetric whitener is the inverse matrix square root
+    A = rng.standard_normal((d, 2*d))
+    C = A @ A.T / (2*d)
+    isqrtC, _ = robust_whitener(C, reg=0, rcond=0, symetric=True)
+    err = np.max(np.abs(isqrtC - np.linalg.inv(np.real(sqrtm(C)))))
+    print("symetric whitener vs. inv(sqrtm(C)) = {:g}".format(err))
+    assert err < tol
+
+    # Cyy with repeated eigen-values: the kept components must be orthonormal w.r.t. C
+    np.random.seed(0)
+    X, Y, st, A, B = testSignal(nTrl=10, nSamp=500, d=d, nY=10, tau=tau)
+    Cxx, Cxy, Cyy = updateSummaryStatistics(X, Y[..., 0:1, :], tau=tau)
+    Cyy2d = Cyy.reshape((-1, Cyy.shape[-2]*Cyy.shape[-1], Cyy.shape[-2]*Cyy.shape[-1]))
+    for symetric in (False, True):
+        isqrtC, _, nkeep = batch_robust_whitener(Cyy2d, reg=0, rcond=1e-4, symetric=symetric)
+        WCW = np.swapaxes(isqrtC, -1, -2) @ Cyy2d @ isqrtC
+        if symetric: # the projection onto the kept subspace
+            err = np.max(np.abs(WCW - WCW @ WCW))
+        else:
+            keep = np.any(isqrtC != 0, -2)
+            err = np.max(np.abs(WCW - np.eye(WCW.shape[-1]) * keep[..., np.newaxis, :]))
+        print("repeated eig Cyy: symetric={} nkeep={}/{} W'CW-I = {:g}".format(symetric, nkeep, Cyy2d.shape[-1], err))
+        assert err < tol
+        # the loop version must match
+        isqrtC1, _ = robust_whitener(Cyy2d[0], reg=0, rcond=1e-4, symetric=symetric)
+        WCW1 = isqrtC1.T @ Cyy2d[0] @ isqrtC1
+        assert np.max(np.abs(WCW1 - (WCW1 @ WCW1 if symetric else np.eye(WCW1.shape[-1])))) < tol
+
+    # CCA spatial filters vs. the generalized eigen-problem Cxy' inv(Cyy) Cxy w = rho^2 Cxx w, with w'Cxx w = 1
+    Cyy_reg = Cyy2d[0] + 1e-3*np.eye(Cyy2d.shape[-1]) # full-rank to compare with the reference
+    Cxy2d = Cxy.reshape((-1, d))
+    rho2, Wref = eigh(Cxy2d.T @ np.linalg.solve(Cyy_reg, Cxy2d), Cxx)
+    Wref = Wref[:, ::-1].T # descending
+    for batch in (True, False):
+        J, W, R = multipleCCA(Cxx, Cxy, Cyy_reg.reshape(Cyy.shape), reg=0, rcond=0, rank=2, batch=batch)
+        W = W.reshape((-1, d))
+        err = np.max(np.abs(np.abs(np.diag(W @ Cxx @ Wref[:2, :].T)) - 1)) # |cos| == 1, in Cxx norm
+        err = max(err, np.max(np.abs(W @ Cxx @ W.T - np.eye(2))))
+        print("multipleCCA batch={} W vs. reference = {:g}".format(batch, err))
+        assert err < 1e-6
+
+
 def fit_predict(X, Y, tau=10, uss_args=dict(), mcca_args=dict()):
     from mindaffectBCI.decoder.scoreStimulus import scoreStimulus
     from mindaffectBCI.decoder.scoreOutput import scoreOutput
@@ -100,9 +100,9 @@ def normalizeOutputScores(Fy, validTgt=None, badFyThresh=4,
 
     # compute the summed scores
     if abs(minDecisLen) > Fy.shape[-2]:
-        decisIdx = np.array(Fy.shape[-2]-1,dtype=int)
+        decisIdx = np.array([Fy.shape[-2]-1],dtype=int)
         N = nEp[:, np.newaxis] # (nTrl, nDecis) [nDecis x nTrl] number elements in the sum
-        sFy = np.sum(Fy, -2)
+        sFy = np.sum(Fy, -2, keepdims=True) # (nTrl, nDecis, nY)
     else:
         if (bwdAccumulate): # (nM, nTrl, nEp, nY) # [nY, nEp, nTrl, nM]
             if not np.all(nEp == nEp[0]):
@@ -170,6 +170,86 @@ def normalizeOutputScores(Fy, validTgt=None, badFyThresh=4,
 
     return ssFy, sFy_scale, decisIdx, nEp, nY
 
+def normalizeOutputScores_curve(Fy, integerationLengths, badFyThresh=4, centFy=True, detrendFy=False,
+                                nEpochCorrection=0, priorsigma=None):
+    '''
+    single-pass version of `normalizeOutputScores` for a set of integeration lengths
+
+    Gives the same result as calling normalizeOutputScores(Fy[...,:nep,:]) for each nep, for forward
+    accumulation with a single decision point, but from one cumsum of Fy. The only part of the
+    noise variance estimate which depends on the integeration length is the number of active outputs
+    used to center the scores, so it's computed once for each distinct set of active outputs.
+
+    Args:
+      Fy (nM,nTr,nEp,nY): float
+      integerationLengths (nInt,): the integeration lengths to normalize for
+      badFyThresh, centFy, detrendFy, nEpochCorrection, priorsigma: see `normalizeOutputScores`
+
+    Yields:
+      ssFy (nM,nTr,1,nY): scaled summed scores for Fy[...,:nep,:], or None if there is no data
+      validTgt (nM,nTr,nY): bool indication of which outputs are used in Fy[...,:nep,:]
+    '''
+    # compress out the model dimension
+    Fyshape = Fy.shape # (nM,nTrl,nEp,nY)
+    if Fy.ndim > 3:
+        Fy = np.reshape(Fy, (np.prod(Fy.shape[:-2]), )+Fy.shape[-2:]) # ((nM*nTrl), nEp, nY)
+    if Fy.ndim < 3: # ensure has trial dim
+        Fy = Fy[np.newaxis, :, :]
+    nEp = Fy.shape[-2]
+
+    validFy = Fy != 0
+    validEp = np.any(validFy, -1) # (nTrl, nEp)
+    # index of the last active epoch upto each epoch
+    lastEp = np.maximum.accumulate(np.where(validEp, np.arange(nEp), -1), axis=-1) # (nTrl, nEp)
+    # index of the first active epoch for each output
+    firstEpY = np.where(np.any(validFy, -2), np.argmax(validFy, -2), nEp) # (nTrl, nY)
+    del validFy
+    N = np.cumsum(validEp, -1) # (nTrl,nEp) number valid epochs upto each epoch
+    Nf = N.astype(Fy.dtype)
+    sFy = np.cumsum(Fy, -2) # (nTrl, nEp, nY)
+
+    muvar2csFy_cache = dict()
+    for nep in integerationLengths:
+        nep = min(int(nep), nEp)
+        validTgt = (firstEpY < nep).reshape(Fyshape[:-2]+Fyshape[-1:])
+        maxnEp = max(int(np.max(lastEp[:, nep-1])), 0) if nep > 0 else 0
+        if maxnEp < 1: # guard no data to analyse
+            yield None, validTgt
+            continue
+        decisIdx = np.array([maxnEp-1], dtype=int)
+        # data length actually used for the noise estimate, see normalizeOutputScores
+        ntrunc = maxnEp if decisIdx[-1] < min(nep*0.7, nep-100) else nep
+        nY = np.sum(firstEpY < ntrunc, -1).astype(Fy.dtype) # number active outputs in this trial
+        cent = centFy and np.all(nY>3)
+
+        # ave-cumsum-var-slope, as for estimate_Fy_noise_variance_2
+        key = (cent, nY.tobytes())
+        muvar2csFy = muvar2csFy_cache.get(key)
+        if muvar2csFy is None:
+            scFy = sFy
+            if cent:
+                muFy_y = np.sum(scFy, -1, keepdims=True) / nY[:, np.newaxis, np.newaxis] # mean at each time-point
+                scFy = scFy - muFy_y
+            var2csFy = np.sum(scFy**2, -1) / np.maximum(.1,nY[:,np.newaxis]-1) # (nTr,nEp) var over outputs for each cumsum
+            nvar2csFy = var2csFy / np.maximum(.1, Nf) # ave var per-time-step
+            muvar2csFy = np.cumsum(nvar2csFy, -1) / np.maximum(.1, Nf)
+            muvar2csFy_cache[key] = muvar2csFy
+        sigma2 = muvar2csFy[:, decisIdx] # (nTr,nDecis)
+        if priorsigma is not None and priorsigma[0]>0 :
+            sigma2 = (sigma2*decisIdx.astype(sigma2.dtype) + np.array(priorsigma[0]*priorsigma[1],dtype=sigma2.dtype)) / ( decisIdx + priorsigma[1] ).astype(sigma2.dtype)
+
+        Ni = N[:, decisIdx]
+        sFy_scale = np.sqrt(sigma2*np.maximum(.01,Ni.astype(sigma2.dtype)))
+        if nEpochCorrection is not None and nEpochCorrection > 0 :
+            cf = c4(Ni/np.maximum(1, nEpochCorrection)) 
+            sFy_scale = sFy_scale / cf.astype(sigma2.dtype)
+        sFy_scale[sFy_scale == 0] = 1
+        ssFy = sFy[:, decisIdx, :]/sFy_scale[:, :, np.newaxis]
+
+        if len(Fyshape)>3 : # convert back to have model dimension
+            ssFy = np.reshape(ssFy, (Fyshape[:-2]+ssFy.shape[-2:]))
+        yield ssFy, validTgt
+
 def get_valid_epochs_outputs(Fy,validTgt=None):
     """get the number valid epoch and outputs from a zero-padded Fy set
 
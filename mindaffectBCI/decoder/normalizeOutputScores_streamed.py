@@ -16,6 +16,9 @@
 # along with pymindaffectBCI.  If not, see <http://www.gnu.org/licenses/>
 
 import numpy as np
+from mindaffectBCI.decoder.normalizeOutputScores import c4
+from mindaffectBCI.decoder.zscore2Ptgt_softmax import zscore2Ptgt_softmax
+
 def normalizeOutputScores_streamed(Fy, validTgt=None, badFyThresh=6,
                                    centFy=True, blockSize=30, filtLen=5):
     '''
@@ -98,6 +101,186 @@ def incremental_estimate_noise_variance(Fy, old_sigma2, filtLen):
     return sigma2
 
 
+class StreamedNormalizeOutputScores:
+    """
+    stateful incremental version of `normalizeOutputScores` + `zscore2Ptgt_softmax` for a single growing trial
+
+    Rather than re-computing the cumulative sums and noise variance estimate over the whole of Fy
+    at every prediction, running sums, non-zero sample counts and noise-variance accumulators are kept
+    for each output, so adding a new epoch costs O(nY), and the normalized scores give the same
+    result as the batch path on the concatenation of all the epochs added since the last `reset`.
+
+    N.B. forward accumulation only, i.e. bwdAccumulate=False and maxDecisLen=0.
+    """
+
+    def __init__(self, minDecisLen=0, centFy=True, nEpochCorrection=0, priorsigma=None):
+        """
+        stateful incremental version of `normalizeOutputScores` for a single growing trial
+
+        Args:
+            minDecisLen (int, optional): number of epochs to use as base for distribution of time-based decision points,
+                   OR: minDecisLen<0 => decision point every abs(minDeicsLen) epochs. Defaults to 0.
+            centFy (bool, optional): do we center Fy before computing the noise variance. Defaults to True.
+            nEpochCorrection (int, optional): number of epochs to use a base for correction of number epochs in the sum. Defaults to 0.
+            priorsigma ((float,float), optional): prior estimate of the variance and it's equivalent samples weight (sigma,N). Defaults to None.
+        """
+        self.minDecisLen, self.centFy, self.nEpochCorrection, self.priorsigma = (minDecisLen, centFy, nEpochCorrection, priorsigma)
+        self.reset()
+
+    def reset(self):
+        """clear the accumulated statistics, i.e. start a new trial"""
+        self.shape = None # shape of the leading dimensions of Fy, e.g. (nM,nTrl)
+        self.nEp = 0 # total number of epochs added
+        self.lastnz = None # (nR,) index of the last non-zero epoch for each row
+        self.valid = None # (nR,nY) flag if output is non-zero in any epoch
+        self.state = None # (sFy (nR,nY), N (nR,), A (nR,), B (nR,)) accumulated sums after the last epoch
+        self.prevnz_state = None # accumulated sums before the last non-zero epoch
+        self.decis_state = dict() # accumulated sums at the fixed decision points
+
+    def is_decision_point(self, idx):
+        """check if the epoch idx is a fixed, i.e. not dependent on the trial length, decision point"""
+        if self.minDecisLen > 0:
+            r = idx // self.minDecisLen
+            return idx % self.minDecisLen == 0 and r > 0 and (r & (r-1)) == 0 # power of 2
+        elif self.minDecisLen < 0:
+            return idx >= -self.minDecisLen-1 and (idx + 1) % -self.minDecisLen == 0
+        return False
+
+    def update(self, Fy):
+        """
+        add new epochs of output scores
+
+        Args:
+            Fy (np.ndarray (...,nEp,nY)): the new output scores, with leading dimensions, e.g. (nM,nTrl), which match previous calls
+        """
+        if Fy is None or Fy.shape[-2] == 0:
+            return self
+        if self.shape is None:
+            self.shape = Fy.shape[:-2]
+            nR = int(np.prod(self.shape))
+            self.lastnz = np.full((nR,), -1, dtype=int)
+            self.valid = np.zeros((nR, Fy.shape[-1]), dtype=bool)
+            self.state = (np.zeros((nR, Fy.shape[-1])), np.zeros((nR,)), np.zeros((nR,)), np.zeros((nR,)))
+        Fy = Fy.reshape((-1,)+Fy.shape[-2:]) # (nR,nEp,nY)
+        nEp = Fy.shape[-2]
+        sFy, N, A, B = self.state
+
+        # running cumulative sums over this block of epochs
+        nzFy = Fy != 0
+        nz = np.any(nzFy, -1) # (nR,nEp)
+        csFy = sFy[:, np.newaxis, :] + np.cumsum(Fy, -2, dtype=np.float64) # (nR,nEp,nY)
+        cN = N[:, np.newaxis] + np.cumsum(nz, -1) # (nR,nEp)
+        Nm = np.maximum(.1, cN)
+        # noise variance accumulators, i.e. sum_t sum_y csFy**2/N and sum_t (sum_y csFy)**2/N
+        cA = A[:, np.newaxis] + np.cumsum(np.sum(csFy**2, -1) / Nm, -1) # (nR,nEp)
+        cB = B[:, np.newaxis] + np.cumsum(np.sum(csFy, -1)**2 / Nm, -1) # (nR,nEp)
+        getstate = lambda i: self.state if i < 0 else (csFy[:, i, :], cN[:, i], cA[:, i], cB[:, i])
+
+        # record the state at the decision points
+        for i in range(nEp):
+            if self.is_decision_point(self.nEp + i):
+                self.decis_state[self.nEp + i] = tuple(np.copy(v) for v in getstate(i))
+        # record the state before the last non-zero epoch
+        anynz = np.flatnonzero(np.any(nz, 0))
+        if anynz.size > 0:
+            self.prevnz_state = tuple(np.copy(v) for v in getstate(anynz[-1]-1))
+            rownz = np.any(nz, -1)
+            self.lastnz[rownz] = self.nEp + nEp - 1 - np.argmax(nz[rownz, ::-1], -1)
+        self.valid = np.logical_or(self.valid, np.any(nzFy, -2))
+
+        self.state = tuple(np.copy(v) for v in getstate(nEp-1))
+        self.nEp = self.nEp + nEp
+        return self
+
+    def normalizeOutputScores(self, validY=None):
+        """
+        get the normalized accumulated scores at each decision point, as for `normalizeOutputScores`
+
+        Args:
+            validY (np.ndarray (nY,) bool, optional): subset of outputs to use. N.B. outputs not in this set must be all zero. Defaults to None.
+
+        Returns:
+          ssFy (...,nDecis,nY): scaled summed scores
+          sFy_scale (...,nDecis): the normalization scaling factor
+          decisIdx (nDecis,): index of the epoch for each decision point
+          nEp (...): the detected number epoch for each row
+          nY (...): the detected number of outputs for each row
+        """
+        if self.shape is None:
+            return None, None, 0, None, None
+        if validY is None:
+            validY = slice(None)
+        valid = self.valid[:, validY]
+        nYtot = valid.shape[-1]
+        nY = np.sum(valid, -1)
+        nEp = np.maximum(self.lastnz, 0)
+        maxnEp = np.max(nEp)
+        if maxnEp < 1:
+            ssFy = np.zeros(self.shape+(1, nYtot), dtype=np.float32)
+            return ssFy, None, 0, None, None
+
+        # get the decision points, and the accumulated sums at these points
+        if abs(self.minDecisLen) > self.nEp:
+            decisIdx = np.array([self.nEp-1], dtype=int)
+            states = [self.state]
+            wholetrial = True
+        else:
+            wholetrial = False
+            decisIdx = [i for i in sorted(self.decis_state.keys()) if i < maxnEp-1]
+            states = [self.decis_state[i] for i in decisIdx]
+            if self.minDecisLen > 0 and maxnEp-1 <= self.minDecisLen:
+                decisIdx, states = [], []
+            decisIdx = np.array(decisIdx + [maxnEp-1], dtype=int)
+            states = states + [self.prevnz_state]
+        sFy = np.stack([s[0][:, validY] for s in states], 1) # (nR,nDecis,nY)
+        N = np.stack([s[1] for s in states], 1) # (nR,nDecis)
+        A = np.stack([s[2] for s in states], 1)
+        B = np.stack([s[3] for s in states], 1)
+
+        # noise variance estimate, c.f. estimate_Fy_noise_variance_2,
+        #  N.B. sum_y (csFy-mu)**2 = sum_y csFy**2 + (nYtot/nY-2)/nY * (sum_y csFy)**2
+        if self.centFy and np.all(nY > 3):
+            A = A + ((nYtot/nY - 2)/nY)[:, np.newaxis] * B
+        sigma2 = A / np.maximum(.1, nY-1)[:, np.newaxis] / np.maximum(.1, N)
+        if self.priorsigma is not None and self.priorsigma[0] > 0:
+            sigma2 = (sigma2*decisIdx + self.priorsigma[0]*self.priorsigma[1]) / (decisIdx + self.priorsigma[1])
+
+        # scale the summed scores to z-scores
+        if wholetrial: # whole trial sum uses the last non-zero epoch index as the count
+            N = nEp[:, np.newaxis]
+        sFy_scale = np.sqrt(sigma2*np.maximum(.01, N))
+        if self.nEpochCorrection is not None and self.nEpochCorrection > 0:
+            sFy_scale = sFy_scale / c4(N/np.maximum(1, self.nEpochCorrection))
+        sFy_scale[sFy_scale == 0] = 1
+        ssFy = sFy / sFy_scale[:, :, np.newaxis]
+
+        ssFy = ssFy.astype(np.float32).reshape(self.shape+ssFy.shape[-2:])
+        sFy_scale = sFy_scale.astype(np.float32).reshape(self.shape+sFy_scale.shape[-1:])
+        return ssFy, sFy_scale, decisIdx, nEp.reshape(self.shape), nY.reshape(self.shape)
+
+    def decode_proba(self, validY=None, softmaxscale=3.5, marginalizemodels=True, marginalizedecis=False, prior=None):
+        """
+        get the target probabilities at each decision point, as for `decodingSupervised`
+
+        Args:
+            validY (np.ndarray (nY,) bool, optional): subset of outputs to use. Defaults to None.
+            softmaxscale (float, optional): the scale length to pass to zscore2Ptgt_softmax. Defaults to 3.5.
+            marginalizemodels (bool, optional): marginalize over the models. Defaults to True.
+            marginalizedecis (bool, optional): marginalize over the decision points. Defaults to False.
+            prior ([type], optional): prior over the outputs. Defaults to None.
+
+        Returns:
+            Ptgt (...,nDecis,nY): the probability each target is the true target for each decision point
+        """
+        ssFy, _, _, _, _ = self.normalizeOutputScores(validY)
+        if ssFy is None:
+            return None
+        validTgt = self.valid[:, validY if validY is not None else slice(None)]
+        validTgt = validTgt.reshape(self.shape+validTgt.shape[-1:])
+        return zscore2Ptgt_softmax(ssFy, softmaxscale, validTgt=validTgt, marginalizemodels=marginalizemodels,
+                                   marginalizedecis=marginalizedecis, prior=prior)
+
+
 def testcase(Fy=None):
     from normalizeOutputScores import mktestFy,  normalizeOutputScores, plot_normalizedScores
     from normalizeOutputScores_streamed import normalizeOutputScores_streamed, incremental_estimate_noise_variance
@@ -166,6 +349,30 @@ def testcase(Fy=None):
     plt.show()
 
 
+def test_StreamedNormalizeOutputScores(nY=10, nM=1, nEp=400, blksize=7, minDecisLen=(0, 50, -30), priorsigma=(3, 100)):
+    """check the incremental normalizer gives the same Ptgt as the batch decodingSupervised path"""
+    from mindaffectBCI.decoder.normalizeOutputScores import mktestFy
+    from mindaffectBCI.decoder.decodingSupervised import decodingSupervised
+    Fy, _ = mktestFy(nY=nY, nM=nM, nEp=nEp, nTrl=1, startupNoisefrac=.1, trlenfrac=0) # (nM,1,nEp,nY)
+    Fy = Fy.astype(np.float32)
+    Fy[..., -2:] = 0 # un-used outputs
+    for mdl in minDecisLen:
+        kwargs = dict(minDecisLen=mdl, nEpochCorrection=100, priorsigma=priorsigma)
+        snorm = StreamedNormalizeOutputScores(**kwargs)
+        maxerr = 0
+        for t in range(0, nEp, blksize):
+            snorm.update(Fy[..., t:t+blksize, :])
+            Ptgt = snorm.decode_proba(marginalizedecis=True)
+            _, _, Ptgt_batch, _, _ = decodingSupervised(Fy[..., :t+blksize, :], bwdAccumulate=False, marginalizedecis=True, **kwargs)
+            if Ptgt is None or Ptgt_batch is None:
+                assert Ptgt is None or not np.any(Ptgt)
+                continue
+            assert Ptgt.shape == Ptgt_batch.shape, "shape mismatch {}!={}".format(Ptgt.shape, Ptgt_batch.shape)
+            maxerr = max(maxerr, np.max(np.abs(Ptgt - Ptgt_batch)))
+        print("minDecisLen={} max |Ptgt_stream - Ptgt_batch| = {}".format(mdl, maxerr))
+        assert maxerr < 1e-4
+
+
 def compute_pval_curve(X,pval):
     thresh=np.zeros((X.shape[1]))
     for t in range(X.shape[1]):
@@ -0,0 +1,373 @@
+#  Copyright (c) 2019 MindAffect B.V.
+#  Author: Jason Farquhar <jason@mindaffect.nl>
+# This file is part of pymindaffectBCI <https://github.com/mindaffect/pymindaffectBCI>.
+#
+# pymindaffectBCI is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pymindaffectBCI is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pymindaffectBCI.  If not, see <http://www.gnu.org/licenses/>
+
+import os
+import json
+import glob
+import shutil
+import hashlib
+import inspect
+import tempfile
+import numpy as np
+
+# bump this when the on-disk layout changes to invalidate old entries
+CACHE_VERSION = 1
+CACHE_DIR_ENV = 'MINDAFFECTBCI_CACHE_DIR'
+
+
+def default_cache_dir():
+    """get the cache directory, from $MINDAFFECTBCI_CACHE_DIR or ~/.cache/mindaffectBCI/datasets
+
+    Returns:
+        str: the cache directory, or None if caching is disabled by setting the environment variable to ''
+    """
+    cachedir = os.environ.get(CACHE_DIR_ENV)
+    if cachedir is None:
+        cachedir = os.path.join('~', '.cache', 'mindaffectBCI', 'datasets')
+    if not cachedir:
+        return None
+    return os.path.expanduser(cachedir)
+
+
+def _resolve_source(filename):
+    """get the list of (abs-path) files which make up a loader source, empty if it can't be resolved"""
+    if not isinstance(filename, str):
+        return []
+    filename = os.path.expanduser(filename)
+    if os.path.isdir(filename):
+        files = [os.path.join(root, f) for root, _, fs in os.walk(filename) for f in fs]
+        return sorted(os.path.abspath(f) for f in files)
+    if os.path.isfile(filename):
+        return [os.path.abspath(filename)]
+    # loaders like load_mindaffectBCI accept a glob and use the newest match
+    files = glob.glob(filename)
+    if files:
+        return [os.path.abspath(max(files, key=os.path.getctime))]
+    return []
+
+
+def _hash_file(path:str, index:dict, blocksize:int=1<<20):
+    """sha1 of the file contents, re-using the digest in index if size+mtime are unchanged"""
+    st = os.stat(path)
+    stamp = [st.st_size, st.st_mtime_ns]
+    ent = index.get(path)
+    if ent is not None and ent[:2] == stamp:
+        return ent[2]
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for blk in iter(lambda: f.read(blocksize), b''):
+            h.update(blk)
+    index[path] = stamp + [h.hexdigest()]
+    return h.hexdigest()
+
+
+def source_hash(filename, cachedir:str=None):
+    """content hash for the source file(s) of a dataset
+
+    Args:
+        filename (str): the file/directory/glob passed to the loader
+        cachedir (str, optional): cache directory holding the file-digest index. Defaults to None.
+
+    Returns:
+        str: hex digest of the source contents, or None if the source is not on disk
+    """
+    files = _resolve_source(filename)
+    if not files:
+        return None
+    # index of previously computed file digests, so unchanged files are not re-read
+    indexfn = os.path.join(cachedir, 'index.json') if cachedir else None
+    index = dict()
+    if indexfn and os.path.exists(indexfn):
+        try:
+            with open(indexfn, 'r') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = dict()
+    nindex = len(index)
+    root = os.path.commonpath(files) if len(files) > 1 else os.path.dirname(files[0])
+    h = hashlib.sha1()
+    for fn in files:
+        h.update(os.path.relpath(fn, root).encode('utf8'))
+        h.update(_hash_file(fn, index).encode('ascii'))
+    if indexfn and len(index) != nindex:
+        _atomic_write_json(indexfn, index)
+    return h.hexdigest()
+
+
+def _code_files(loader):
+    """the source files of the loader's module and of the same-package modules it uses"""
+    module = inspect.getmodule(loader)
+    if module is None:
+        return []
+    pkg = module.__name__.split('.')[0]
+    mods = {module}
+    for v in vars(module).values():
+        if inspect.ismodule(v):
+            mods.add(v)
+        elif inspect.isfunction(v) or inspect.isclass(v):
+            mods.add(inspect.getmodule(v))
+    files = [getattr(m, '__file__', None) for m in mods if m is not None and m.__name__.split('.')[0] == pkg]
+    return sorted(os.path.abspath(f) for f in files if f and os.path.isfile(f))
+
+
+_code_index = dict() # file digests of the loader code, for this session
+
+
+def code_hash(loader):
+    """hash of the loader's source code, and of the package modules it uses, so changes to the
+    loading or pre-processing code invalidate the cache entries
+
+    Args:
+        loader (function): the dataset loader function
+
+    Returns:
+        str: hex digest of the loader code
+    """
+    loader = getattr(loader, 'func', loader) # unwrap functools.partial
+    h = hashlib.sha1()
+    try:
+        h.update(inspect.getsource(loader).encode('utf8'))
+    except (OSError, TypeError):
+        pass
+    for fn in _code_files(loader):
+        h.update(_hash_file(fn, _code_index).encode('ascii'))
+    return h.hexdigest()
+
+
+def args_key(loader, kwargs:dict):
+    """canonical string for the loader + its code + its (default filled) arguments
+
+    Args:
+        loader (function): the dataset loader function
+        kwargs (dict): the extra arguments passed to the loader
+
+    Returns:
+        str: a JSON string identifying this loader configuration
+    """
+    args = dict(kwargs)
+    try:
+        # include the defaults so that changing them invalidates the cache
+        ba = inspect.signature(loader).bind_partial(None, **kwargs)
+        ba.apply_defaults()
+        args = {k: v for k, v in list(ba.arguments.items())[1:]}
+        for k in [k for k, p in inspect.signature(loader).parameters.items() if p.kind == p.VAR_KEYWORD]:
+            args.update(args.pop(k, dict()))
+    except (TypeError, ValueError):
+        pass
+    args.pop('verb', None) # logging level doesn't change the data
+    name = "{}.{}".format(getattr(loader, '__module__', ''), getattr(loader, '__qualname__', repr(loader)))
+    return json.dumps(dict(loader=name, code=code_hash(loader), args=args, version=CACHE_VERSION), sort_keys=True, default=repr)
+
+
+def cache_key(loader, filename, kwargs:dict, cachedir:str=None):
+    """the content-address for this loader + source + args, None if it can't be cached"""
+    shash = source_hash(filename, cachedir)
+    if shash is None:
+        return None
+    return hashlib.sha1((shash + args_key(loader, kwargs)).encode('utf8')).hexdigest()
+
+
+def _atomic_write_json(fn:str, obj):
+    tmp = None
+    try:
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(fn), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(obj, f)
+        os.replace(tmp, fn)
+    except OSError:
+        if tmp is not None and os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _encode_coords(obj, dirname:str, prefix:str):
+    """make coords JSON-able, saving any numpy arrays as .npy files alongside"""
+    if isinstance(obj, dict):
+        return {k: _encode_coords(v, dirname, "{}_{}".format(prefix, k)) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_encode_coords(v, dirname, "{}_{}".format(prefix, i)) for i, v in enumerate(obj)]
+    if isinstance(obj, np.ndarray):
+        fn = prefix + '.npy'
+        np.save(os.path.join(dirname, fn), obj, allow_pickle=False)
+        return {'__npy__': fn}
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return obj
+
+
+def _decode_coords(obj, dirname:str, mmap_mode:str=None):
+    if isinstance(obj, dict):
+        if '__npy__' in obj:
+            return np.load(os.path.join(dirname, obj['__npy__']), mmap_mode=mmap_mode)
+        return {k: _decode_coords(v, dirname, mmap_mode) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_decode_coords(v, dirname, mmap_mode) for v in obj]
+    return obj
+
+
+def save_cache_entry(entrydir:str, X, Y, coords, meta:str=None):
+    """save a loaded dataset into the cache directory entrydir, atomically
+
+    Args:
+        entrydir (str): the directory for this cache entry
+        X (np.ndarray): the data
+        Y (np.ndarray): the stimulus info
+        coords (list-of-dict): the meta-info for the dimensions of X
+        meta (str, optional): the args key, saved for debugging. Defaults to None.
+    """
+    parent = os.path.dirname(entrydir)
+    os.makedirs(parent, exist_ok=True)
+    tmpdir = tempfile.mkdtemp(dir=parent, prefix='.tmp')
+    try:
+        np.save(os.path.join(tmpdir, 'X.npy'), np.asarray(X), allow_pickle=False)
+        np.save(os.path.join(tmpdir, 'Y.npy'), np.asarray(Y), allow_pickle=False)
+        with open(os.path.join(tmpdir, 'coords.json'), 'w') as f:
+            json.dump(_encode_coords(coords, tmpdir, 'coords'), f)
+        if meta is not None:
+            with open(os.path.join(tmpdir, 'args.json'), 'w') as f:
+                f.write(meta)
+        try:
+            os.rename(tmpdir, entrydir)
+        except OSError:
+            pass # another process got there first
+    finally:
+        if os.path.exists(tmpdir):
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def load_cache_entry(entrydir:str, mmap_mode:str='r'):
+    """load a dataset from the cache directory entrydir
+
+    Args:
+        entrydir (str): the directory for this cache entry
+        mmap_mode (str, optional): the np.load memory-map mode for X and Y. Defaults to 'r'.
+
+    Returns:
+        X, Y, coords: the cached dataset, or None if there is no valid entry
+    """
+    coordsfn = os.path.join(entrydir, 'coords.json')
+    if not os.path.exists(coordsfn):
+        return None
+    try:
+        X = np.load(os.path.join(entrydir, 'X.npy'), mmap_mode=mmap_mode)
+        Y = np.load(os.path.join(entrydir, 'Y.npy'), mmap_mode=mmap_mode)
+        with open(coordsfn, 'r') as f:
+            coords = _decode_coords(json.load(f), entrydir)
+    except (OSError, ValueError):
+        return None
+    return X, Y, coords
+
+
+class CachedLoader:
+    """wrap a dataset loader function so that its results are cached on disk
+
+    Entries are content addressed by the hash of the source file(s), the loader code and the loader arguments,
+    so changing the raw data, the loading/pre-processing code or the pre-processing parameters
+    (e.g. stopband, fs_out, order, offset_ms) gives a new entry.  X and Y are stored as .npy files and re-loaded memory-mapped.
+    """
+    def __init__(self, loader, cachedir:str=None, mmap_mode:str='r', verb:int=0):
+        """
+        Args:
+            loader (function): the dataset loader to wrap, with signature `loader(filename, **kwargs) -> (X, Y, coords)`
+            cachedir (str, optional): the cache directory. Defaults to None, meaning use `default_cache_dir()`.
+            mmap_mode (str, optional): the np.load memory-map mode for the cached X and Y. Defaults to 'r'.
+            verb (int, optional): verbosity level. Defaults to 0.
+        """
+        self.loader = loader
+        self.cachedir = cachedir if cachedir is not None else default_cache_dir()
+        self.mmap_mode = mmap_mode
+        self.verb = verb
+        self.__name__ = getattr(loader, '__name__', 'CachedLoader')
+        self.__doc__ = getattr(loader, '__doc__', None)
+
+    def __repr__(self):
+        return "CachedLoader({},{})".format(self.__name__, self.cachedir)
+
+    def __call__(self, filename, **kwargs):
+        key = cache_key(self.loader, filename, kwargs, self.cachedir) if self.cachedir else None
+        if key is None:
+            return self.loader(filename, **kwargs)
+        entrydir = os.path.join(self.cachedir, key)
+        res = load_cache_entry(entrydir, self.mmap_mode)
+        if res is not None:
+            if self.verb >= 0: print("Loaded {} from cache {}".format(filename, entrydir))
+            return res
+        X, Y, coords = self.loader(filename, **kwargs)
+        try:
+            save_cache_entry(entrydir, X, Y, coords, args_key(self.loader, kwargs))
+        except (OSError, TypeError, ValueError) as ex:
+            # un-cacheable, e.g. object arrays in the coords, just return the loaded data
+            if self.verb >= 0: print("Warning: couldn't cache {}: {}".format(filename, ex))
+        return X, Y, coords
+
+
+def cached_loader(loader, cachedir:str=None, mmap_mode:str='r', verb:int=0):
+    """wrap loader with an on-disk cache, see `CachedLoader`"""
+    if isinstance(loader, CachedLoader):
+        return loader
+    return CachedLoader(loader, cachedir=cachedir, mmap_mode=mmap_mode, verb=verb)
+
+
+def clear_cache(cachedir:str=None):
+    """remove all cache entries from cachedir"""
+    cachedir = cachedir if cachedir is not None else default_cache_dir()
+    if cachedir and os.path.isdir(cachedir):
+        shutil.rmtree(cachedir)
+
+
+def testcase():
+    import time
+    from mindaffectBCI.decoder.utils import testSignal
+    def toyloader(fn, fs_out:float=100, offset_ms=(-500, 500), **kwargs):
+        time.sleep(.5) # simulate slow parse + pre-process
+        X, Y, _, _, _ = testSignal(nTrl=20, nSamp=500, d=8)
+        coords = [dict(name='trial', coords=np.arange(X.shape[0])),
+                  dict(name='time', unit='ms', coords=np.arange(X.shape[1])/fs_out, fs=fs_out),
+                  dict(name='channel', coords=None)]
+        return X, Y, coords
+
+    cachedir = tempfile.mkdtemp()
+    srcfn = os.path.join(cachedir, 'src.txt')
+    with open(srcfn, 'w') as f:
+        f.write('raw data')
+    loader = cached_loader(toyloader, cachedir=os.path.join(cachedir, 'cache'))
+    t0 = time.perf_counter()
+    X, Y, coords = loader(srcfn, fs_out=100)
+    t1 = time.perf_counter()
+    Xc, Yc, coordsc = loader(srcfn, fs_out=100)
+    t2 = time.perf_counter()
+    print("uncached {:.3f}s  cached {:.3f}s".format(t1-t0, t2-t1))
+    assert np.array_equal(X, Xc) and np.array_equal(Y, Yc)
+    assert isinstance(Xc, np.memmap)
+    assert np.array_equal(coords[0]['coords'], coordsc[0]['coords']) and coordsc[1]['fs'] == 100
+    # different args -> different entry
+    loader(srcfn, fs_out=50)
+    assert len([d for d in os.listdir(loader.cachedir) if not d.endswith('.json')]) == 2
+    # changed loader code, same name + args -> different entry
+    def toyloader(fn, fs_out:float=100, offset_ms=(-500, 500), **kwargs):
+        X, Y, coords = loader.loader(fn, fs_out, offset_ms, **kwargs)
+        return X * 2, Y, coords
+    assert cache_key(toyloader, srcfn, dict(fs_out=100)) != cache_key(loader.loader, srcfn, dict(fs_out=100))
+    cached_loader(toyloader, cachedir=loader.cachedir)(srcfn, fs_out=100)
+    assert len([d for d in os.listdir(loader.cachedir) if not d.endswith('.json')]) == 3
+    # the loader's module is part of the code hash
+    assert os.path.abspath(__file__) in _code_files(toyloader)
+    shutil.rmtree(cachedir)
+
+
+if __name__ == "__main__":
+    testcase()
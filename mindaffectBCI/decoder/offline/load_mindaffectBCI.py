@@ -46,9 +46,6 @@ def load_mindaffectBCI(source, datadir:str=None, sessdir:str=None, fs_out:float=
 
     # TODO[]: get the header if there is one?
 
-    import pickle
-    pickle.dump(dict(data=X),open('raw_lmbci.pk','wb'))
-
     # strip the data time-stamp channel
     data_ts = X[...,-1].astype(np.float64) # (nsamp,)
     data_ts = unwrap(data_ts)
@@ -94,9 +91,6 @@ def load_mindaffectBCI(source, datadir:str=None, sessdir:str=None, fs_out:float=
     Me, stim_ts, objIDs, _ = devent2stimSequence(messages)
     stim_ts = unwrap(stim_ts.astype(np.float64))
 
-    import pickle
-    pickle.dump(dict(data=np.append(X,data_ts[:,np.newaxis],-1),stim=np.append(Me,stim_ts[:,np.newaxis],-1)),open('pp_lmbci.pk','wb'))
-
     # up-sample to stim rate
     Y, stim_samp = upsample_stimseq(data_ts, Me, stim_ts, objIDs)
     Y_ts = np.zeros((Y.shape[0],),dtype=int); 
@@ -164,10 +158,6 @@ def load_mindaffectBCI(source, datadir:str=None, sessdir:str=None, fs_out:float=
     del Xraw, Yraw
     if verb > 0: print("X={}\nY={}".format(X.shape,Y.shape))
 
-    import pickle
-    pickle.dump(dict(X=X,Y=Y,X_ts=Xe_ts,Y_ts=Ye_ts,ep_idx=ep_idx),open('sliced_lmbci.pk','wb'))
-
-
     # make coords array for the meta-info about the dimensions of X
     coords = [None]*X.ndim
     coords[0] = dict(name='trial', coords=trl_ts, trl_idx=ep_idx, trl_ts=Xe_ts, Y_ts=Ye_ts)
@@ -0,0 +1,402 @@
+#  Copyright (c) 2019 MindAffect B.V.
+#  Author: Jason Farquhar <jason@mindaffect.nl>
+# This file is part of pymindaffectBCI <https://github.com/mindaffect/pymindaffectBCI>.
+#
+# pymindaffectBCI is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pymindaffectBCI is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pymindaffectBCI.  If not, see <http://www.gnu.org/licenses/>
+
+"""compact binary container for mindaffectBCI session logs
+
+File layout (all little-endian):
+
+    MAGIC(8) version(uint32) reserved(uint32)
+    chunk ... chunk                 -- raw arrays, described in the footer
+    footer                          -- utf8 JSON index of the chunks and the trial boundaries
+    footer_offset(uint64) footer_len(uint64) MAGIC(8)
+
+There are 3 kinds of chunk, each a set of equal length per-message tables:
+   'data' : the DataPackets, with the samples stored as one (nsamp,nch) float32 array
+   'stim' : the StimulusEvents, with the objIDs/objState of all events stored in single arrays
+   'msg'  : all other messages, with the message specific fields as JSON
+All chunks have the columns seq (message order), ts, sts, rts (client, server, and recieved time-stamps) and ip (index into the client ip table).
+The footer holds the server time-stamp range of each chunk and the NewTarget/ModeChange times, so that a
+time-range or trial can be read without scanning the whole file.
+"""
+
+import os
+import json
+import struct
+import numpy as np
+from mindaffectBCI.utopiaclient import StimulusEvent, DataPacket, ModeChange, NewTarget, Selection, DataHeader
+from mindaffectBCI.decoder.offline.read_mindaffectBCI import DataPacketBatch, iter_mindaffectBCI_message_chunks
+
+MAGIC = b'MABCIBIN'
+VERSION = 1
+BINLOG_EXT = '.mabin'
+
+
+def is_binary_log(source):
+    """test if source is the file-name of a binary session log"""
+    if not isinstance(source, str) or not os.path.isfile(source):
+        return False
+    with open(source, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def _msg2dict(m):
+    """the message specific fields of the rare message types"""
+    if isinstance(m, ModeChange):
+        return dict(newmode=m.newmode)
+    elif isinstance(m, Selection):
+        return dict(objID=m.objID)
+    elif isinstance(m, DataHeader):
+        return dict(fsample=m.fsample, nchannels=m.nchannels, labels=m.labels)
+    return dict()
+
+
+def _dict2msg(msgName, ts, fields):
+    if msgName == ModeChange.msgName:
+        return ModeChange(ts, fields.get('newmode'))
+    elif msgName == NewTarget.msgName:
+        return NewTarget(ts)
+    elif msgName == Selection.msgName:
+        return Selection(ts, fields.get('objID'))
+    elif msgName == DataHeader.msgName:
+        return DataHeader(ts, fields.get('fsample'), fields.get('nchannels'), fields.get('labels'))
+    return None
+
+
+def _intcol(vals):
+    """int64 column, with None (missing) mapped to -1"""
+    return np.array([v if v is not None else -1 for v in vals], dtype=np.int64)
+
+
+def boundaries2trials(boundaries):
+    """get the trial time-ranges from the trial boundary messages
+
+    Args:
+        boundaries (list-of-(msgName,sts)): the NewTarget and ModeChange message names and server time-stamps, in log order
+
+    Returns:
+        list-of-(start,end): trials start at each NewTarget and end at the next NewTarget or ModeChange, end is None for the final trial
+    """
+    trials = []
+    for i, (name, sts) in enumerate(boundaries):
+        if name == NewTarget.msgName:
+            end = boundaries[i+1][1] if i+1 < len(boundaries) else None
+            trials.append((sts, end))
+    return trials
+
+
+def trial_range(trials, trial:int, pre_ms:float=0, post_ms:float=0):
+    """get the server time-stamp range for a trial
+
+    Args:
+        trials (list-of-(start,end)): the trial ranges, as returned by `boundaries2trials`
+        trial (int): the trial number
+        pre_ms (float, optional): extra time before the trial start. Defaults to 0.
+        post_ms (float, optional): extra time after the trial end. Defaults to 0.
+
+    Returns:
+        (start, end): the time-stamp range, end is None for the last trial
+    """
+    bgn, end = trials[trial]
+    return (bgn - pre_ms, end + post_ms if end is not None else None)
+
+
+class BinaryLogWriter:
+    """write messages to a binary session log file"""
+
+    def __init__(self, filename:str):
+        """
+        Args:
+            filename (str): the file to write to
+        """
+        self.filename = filename
+        self.file = open(filename, 'wb')
+        self.file.write(MAGIC + struct.pack('<II', VERSION, 0))
+        self.chunks = []
+        self.ips = []
+        self.ipidx = dict()
+        self.boundaries = []
+        self.seq = 0
+        self.block = 0
+
+    def _ip(self, ips):
+        for ip in set(ips):
+            if ip not in self.ipidx:
+                self.ipidx[ip] = len(self.ips)
+                self.ips.append(ip)
+        return np.array([self.ipidx[ip] for ip in ips], dtype=np.uint16)
+
+    def _write_chunk(self, kind:str, arrays:dict):
+        sts = arrays['sts']
+        info = dict(kind=kind, block=self.block, offset=self.file.tell(), n=len(sts),
+                    sts=[int(np.min(sts)), int(np.max(sts))] if len(sts) else [0, -1],
+                    arrays=dict())
+        for name, a in arrays.items():
+            a = np.ascontiguousarray(a)
+            a = a.astype(a.dtype.newbyteorder('<'), copy=False)
+            info['arrays'][name] = [a.dtype.str, list(a.shape), self.file.tell() - info['offset']]
+            self.file.write(a.tobytes())
+        self.chunks.append(info)
+
+    def write(self, msgs):
+        """write a block of messages, as returned by `iter_mindaffectBCI_message_chunks`
+
+        Args:
+            msgs (list-of-messages): the messages to write, DataPackets can be individual or `DataPacketBatch` blocks
+        """
+        seq = np.arange(self.seq, self.seq+len(msgs), dtype=np.int64)
+        self.seq = self.seq + len(msgs)
+        self.block = self.block + 1
+        dp = [(s, m) for s, m in zip(seq, msgs) if isinstance(m, (DataPacket, DataPacketBatch))]
+        se = [(s, m) for s, m in zip(seq, msgs) if isinstance(m, StimulusEvent)]
+        other = [(s, m) for s, m in zip(seq, msgs) if not isinstance(m, (DataPacket, DataPacketBatch, StimulusEvent))]
+
+        if dp:
+            # N.B. all packets in a batch share the seq of the batch
+            batches = [m if isinstance(m, DataPacketBatch) else
+                       DataPacketBatch(np.asarray(m.samples, dtype=np.float32), [len(m.samples)], [m.timestamp], [m.sts], [m.rts], [m.clientip])
+                       for _, m in dp]
+            nsamp = np.concatenate([np.asarray(b.nsamp, dtype=np.int32) for b in batches])
+            self._write_chunk('data', dict(
+                seq=np.concatenate([np.full(len(b), s, dtype=np.int64) for (s, _), b in zip(dp, batches)]),
+                ts=_intcol([t for b in batches for t in np.asarray(b.timestamp).tolist()]),
+                sts=_intcol([t for b in batches for t in np.asarray(b.sts).tolist()]),
+                rts=_intcol([t for b in batches for t in np.asarray(b.rts).tolist()]),
+                ip=self._ip([ip for b in batches for ip in b.clientip]),
+                nsamp=nsamp,
+                samples=np.concatenate([np.asarray(b.samples, dtype=np.float32) for b in batches], 0)))
+
+        if se:
+            nobj = np.array([len(m.objIDs) for _, m in se], dtype=np.int32)
+            objState = np.concatenate([np.asarray(m.objState, dtype=np.int32) for _, m in se])
+            if objState.size == 0 or (objState.min() >= 0 and objState.max() < 256):
+                objState = objState.astype(np.uint8)
+            self._write_chunk('stim', dict(
+                seq=np.array([s for s, _ in se], dtype=np.int64),
+                ts=_intcol([m.timestamp for _, m in se]),
+                sts=_intcol([m.sts for _, m in se]),
+                rts=_intcol([m.rts for _, m in se]),
+                ip=self._ip([m.clientip for _, m in se]),
+                nobj=nobj,
+                objIDs=np.concatenate([np.asarray(m.objIDs, dtype=np.int32) for _, m in se]),
+                objState=objState))
+
+        if other:
+            fields = json.dumps([[m.msgName, _msg2dict(m)] for _, m in other]).encode('utf8')
+            self._write_chunk('msg', dict(
+                seq=np.array([s for s, _ in other], dtype=np.int64),
+                ts=_intcol([m.timestamp for _, m in other]),
+                sts=_intcol([m.sts for _, m in other]),
+                rts=_intcol([m.rts for _, m in other]),
+                ip=self._ip([m.clientip for _, m in other]),
+                fields=np.frombuffer(fields, dtype=np.uint8)))
+            for _, m in other:
+                if isinstance(m, (NewTarget, ModeChange)) and m.sts is not None:
+                    self.boundaries.append([m.msgName, m.sts])
+
+    def close(self):
+        """write the footer index and close the file"""
+        if self.file is None:
+            return
+        footer = json.dumps(dict(version=VERSION, chunks=self.chunks, ips=self.ips, boundaries=self.boundaries)).encode('utf8')
+        offset = self.file.tell()
+        self.file.write(footer)
+        self.file.write(struct.pack('<QQ', offset, len(footer)) + MAGIC)
+        self.file.close()
+        self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class BinaryLogReader:
+    """random-access reader for a binary session log file"""
+
+    def __init__(self, filename:str):
+        """
+        Args:
+            filename (str): the binary log file to read
+        """
+        self.filename = filename
+        self.buf = np.memmap(filename, dtype=np.uint8, mode='r')
+        tail = self.buf[-(16+len(MAGIC)):].tobytes()
+        if self.buf[:len(MAGIC)].tobytes() != MAGIC or tail[16:] != MAGIC:
+            raise ValueError("{} is not a (complete) mindaffectBCI binary log".format(filename))
+        offset, length = struct.unpack('<QQ', tail[:16])
+        footer = json.loads(self.buf[offset:offset+length].tobytes().decode('utf8'))
+        self.chunks = footer['chunks']
+        self.ips = footer['ips']
+        self.boundaries = footer['boundaries']
+        self.trials = boundaries2trials(self.boundaries)
+
+    def _arrays(self, chunk):
+        arrays = dict()
+        for name, (dtype, shape, off) in chunk['arrays'].items():
+            dtype = np.dtype(dtype)
+            bgn = chunk['offset'] + off
+            end = bgn + int(np.prod(shape))*dtype.itemsize
+            arrays[name] = self.buf[bgn:end].view(dtype).reshape(shape)
+        return arrays
+
+    def trial_range(self, trial:int, pre_ms:float=0, post_ms:float=0):
+        """get the server time-stamp range for a trial, see `trial_range`"""
+        return trial_range(self.trials, trial, pre_ms, post_ms)
+
+    def _chunk_messages(self, chunk, trange, packet_batch:bool):
+        """decode the messages from a chunk, selecting only those in the time range, as (seq, msg) pairs"""
+        a = self._arrays(chunk)
+        sts = a['sts']
+        keep = np.ones(sts.shape, dtype=bool)
+        if trange is not None and trange[0] is not None:
+            keep &= sts >= trange[0]
+        if trange is not None and trange[1] is not None:
+            keep &= sts < trange[1]
+        if not np.any(keep):
+            return []
+        ips = [self.ips[i] for i in a['ip'].tolist()]
+        ts, stsl, rts, seq = a['ts'].tolist(), sts.tolist(), a['rts'].tolist(), a['seq'].tolist()
+        out = []
+        if chunk['kind'] == 'data':
+            offs = np.cumsum(np.append(0, a['nsamp']))
+            if np.all(keep):
+                samples, idx = a['samples'], np.arange(len(keep))
+            else:
+                idx = np.flatnonzero(keep)
+                samples = np.concatenate([a['samples'][offs[i]:offs[i+1]] for i in idx], 0)
+            batch = DataPacketBatch(samples, a['nsamp'][idx], a['ts'][idx], sts[idx], a['rts'][idx], [ips[i] for i in idx])
+            if packet_batch:
+                out.append((seq[idx[0]], batch))
+            else:
+                out.extend(zip([seq[i] for i in idx], batch.to_messages()))
+        elif chunk['kind'] == 'stim':
+            offs = np.cumsum(np.append(0, a['nobj'])).tolist()
+            objIDs = a['objIDs']
+            objState = a['objState'].astype(int).tolist()
+            for i in np.flatnonzero(keep):
+                m = StimulusEvent(ts[i], np.array(objIDs[offs[i]:offs[i+1]], dtype=int), objState[offs[i]:offs[i+1]])
+                m.sts, m.rts, m.clientip = stsl[i], rts[i], ips[i]
+                out.append((seq[i], m))
+        else:
+            fields = json.loads(a['fields'].tobytes().decode('utf8'))
+            for i in np.flatnonzero(keep):
+                m = _dict2msg(fields[i][0], ts[i], fields[i][1])
+                if m is not None:
+                    m.sts, m.rts, m.clientip = stsl[i], rts[i], ips[i]
+                    out.append((seq[i], m))
+        return out
+
+    def iter_messages(self, trange=None, packet_batch:bool=True):
+        """iterate over the messages in the log, in blocks, only reading the chunks which overlap the time range
+
+        Args:
+            trange ((start,end), optional): the server time-stamp range to read. Defaults to None, i.e. everything.
+            packet_batch (bool, optional): If True then return the data-packets as `DataPacketBatch` blocks. Defaults to True.
+
+        Yields:
+            list-of-messages: the messages from each block of the log, in log order
+        """
+        block = []
+        blockid = None
+        for chunk in self.chunks:
+            if trange is not None and ((trange[0] is not None and chunk['sts'][1] < trange[0]) or
+                                       (trange[1] is not None and chunk['sts'][0] >= trange[1])):
+                continue
+            if block and chunk['block'] != blockid:
+                yield [m for _, m in sorted(block, key=lambda x: x[0])]
+                block = []
+            blockid = chunk['block']
+            block.extend(self._chunk_messages(chunk, trange, packet_batch))
+        if block:
+            yield [m for _, m in sorted(block, key=lambda x: x[0])]
+
+    def read_messages(self, trange=None, packet_batch:bool=True):
+        """read all the messages in the time range
+
+        Args:
+            trange ((start,end), optional): the server time-stamp range to read. Defaults to None, i.e. everything.
+            packet_batch (bool, optional): If True then return the data-packets as `DataPacketBatch` blocks. Defaults to True.
+
+        Returns:
+            list-of-messages: the messages, in log order
+        """
+        return [m for blk in self.iter_messages(trange, packet_batch) for m in blk]
+
+
+def convert_mindaffectBCI_txt2bin(source:str, dest:str=None, chunksize:int=1<<22):
+    """convert a mindaffectBCI text save file to the binary session log format
+
+    Args:
+        source (str): the text log file
+        dest (str, optional): the binary file to write. Defaults to None, i.e. source with the extension replaced by .mabin
+        chunksize (int, optional): the size of the text blocks to convert at once, each gives one set of chunks in the output. Defaults to 4M.
+
+    Returns:
+        str: the name of the written binary log
+    """
+    if dest is None:
+        dest = os.path.splitext(source)[0] + BINLOG_EXT
+    with BinaryLogWriter(dest) as writer:
+        for msgs in iter_mindaffectBCI_message_chunks(source, chunksize=chunksize, packet_batch=True):
+            writer.write(msgs)
+    return dest
+
+
+def testcase(fn=None):
+    import tempfile
+    import time
+    from mindaffectBCI.decoder.offline.read_mindaffectBCI import read_mindaffectBCI_messages, read_mindaffectBCI_data_messages
+    if fn is None:
+        fn = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../../docs/source/mindaffectBCI_exampledata.txt')
+    dest = os.path.join(tempfile.mkdtemp(), 'test' + BINLOG_EXT)
+    convert_mindaffectBCI_txt2bin(fn, dest, chunksize=1<<20)
+    print("{} : {} -> {} bytes".format(fn, os.path.getsize(fn), os.path.getsize(dest)))
+
+    # full read gives the same messages
+    t0 = time.perf_counter()
+    txt = read_mindaffectBCI_messages(fn, regress=None)
+    t1 = time.perf_counter()
+    rdr = BinaryLogReader(dest)
+    binmsgs = rdr.read_messages(packet_batch=False)
+    t2 = time.perf_counter()
+    print("txt {:.3f}s  bin {:.3f}s".format(t1-t0, t2-t1))
+    assert len(txt) == len(binmsgs)
+    key = lambda m: (m.sts, m.msgName, m.timestamp)
+    for a, b in zip(sorted(txt, key=key), sorted(binmsgs, key=key)):
+        assert type(a) == type(b) and a.timestamp == b.timestamp and a.sts == b.sts and a.clientip == b.clientip
+        if isinstance(a, DataPacket):
+            assert np.array_equal(a.samples, b.samples)
+
+    # seek to a single trial
+    print("{} trials".format(len(rdr.trials)))
+    trange = rdr.trial_range(len(rdr.trials)//2)
+    X, msgs = read_mindaffectBCI_data_messages(dest, trange=trange)
+    X_txt, msgs_txt = read_mindaffectBCI_data_messages(fn, trange=trange)
+    print("trial {}: X={} {} msgs".format(trange, X.shape, len(msgs)))
+    assert np.array_equal(X, X_txt) and len(msgs) == len(msgs_txt)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="convert mindaffectBCI text save files to the binary session log format")
+    parser.add_argument('files', nargs='*', help='the text save file(s) to convert')
+    args = parser.parse_args()
+    if not args.files:
+        testcase()
+    for f in args.files:
+        print("{} -> {}".format(f, convert_mindaffectBCI_txt2bin(f)))
@@ -202,50 +202,252 @@ def read_mindaffectBCI_message(line:str):
         msg.clientip = read_clientip(line) # client ip-address
     return msg
 
+class DataPacketBatch:
+    """a block of consecutive DataPacket messages, stored as arrays rather than as individual messages
+
+    Attributes:
+        samples (np.ndarray (sum(nsamp),d)): the samples of all the packets, concatenated
+        nsamp (np.ndarray (npkt,)): the number of samples in each packet
+        timestamp (np.ndarray (npkt,)): the time-stamp of each packet
+        sts (np.ndarray (npkt,)): the server time-stamp of each packet
+        rts (np.ndarray (npkt,)): the recieved time-stamp of each packet
+        clientip (list-of-str): the client ip-address of each packet
+    """
+    msgName = DataPacket.msgName
+
+    def __init__(self, samples, nsamp, timestamp, sts=None, rts=None, clientip=None):
+        self.samples = samples
+        self.nsamp = nsamp
+        self.timestamp = timestamp
+        self.sts = sts
+        self.rts = rts
+        self.clientip = clientip
+
+    def __len__(self):
+        return len(self.nsamp)
+
+    def to_messages(self):
+        """convert to a list of individual DataPacket messages"""
+        msgs = []
+        offs = np.cumsum(np.append(0, self.nsamp)).tolist()
+        for j in range(len(self)):
+            m = DataPacket(self.timestamp[j], self.samples[offs[j]:offs[j+1], :])
+            m.sts, m.rts, m.clientip = self.sts[j], self.rts[j], self.clientip[j]
+            msgs.append(m)
+        return msgs
+
+    def select(self, keep):
+        """get a new batch with only the selected packets
+
+        Args:
+            keep (np.ndarray (npkt,) bool): which packets to keep
+
+        Returns:
+            DataPacketBatch: the selected packets
+        """
+        idx = np.flatnonzero(keep)
+        offs = np.cumsum(np.append(0, self.nsamp))
+        samples = np.concatenate([self.samples[offs[i]:offs[i+1]] for i in idx], 0) if len(idx) else self.samples[:0]
+        pick = lambda a: np.asarray(a)[idx] if a is not None else None
+        return DataPacketBatch(samples, pick(self.nsamp), pick(self.timestamp), pick(self.sts), pick(self.rts),
+                               [self.clientip[i] for i in idx] if self.clientip is not None else None)
+
+    def __str__(self):
+        return "{}x{}({})".format(self.msgName, len(self), self.samples.shape)
+
+
+def _parse_headers(heads, msgName:str, nfields:int):
+    """parse the 'rts:<int> sts:<int>  t:<TYPE> ts:<int> v[<shape>' line prefixes into a (nline,nfields) int array, None if mal-formed"""
+    txt = '\n'.join(heads).replace(msgName,' ').replace('rts:',' ').replace('sts:',' ').replace('ts:',' ').replace('t:',' ').replace('v[',' ').replace('x',' ')
+    hdr = np.fromstring(txt, sep=' ', dtype=np.int64)
+    if hdr.size != len(heads)*nfields:
+        return None
+    return hdr.reshape((len(heads),nfields))
+
+
+def _parse_batch(lines, idx, msgName:str, nshape:int, dtype, payload2csv):
+    """parse the given lines of a single message type, with a single numpy call for all the headers and all the payloads
+
+    Returns:
+        (idx, hdr, values, ips) for the well-formed lines, or None if the headers can't be parsed
+    """
+    parts = [lines[i].partition(']:') for i in idx]
+    tails = [p[2].rpartition(' <-') for p in parts]
+    # skip truncated lines, e.g. the last line of a crashed session
+    if not all(t[1] for t in tails):
+        ok = [j for j, t in enumerate(tails) if t[1]]
+        idx, parts, tails = [idx[j] for j in ok], [parts[j] for j in ok], [tails[j] for j in ok]
+        if not idx:
+            return None
+    hdr = _parse_headers([p[0] for p in parts], msgName, 3+nshape)
+    if hdr is None:
+        return None
+    values = np.fromstring(payload2csv(''.join([t[0] for t in tails])), sep=',', dtype=dtype)
+    ips = [t[2].rstrip()[1:] for t in tails]
+    return idx, hdr, values, ips
+
+
+def _datapacket2csv(payload:str):
+    # N.B. rows are formatted as [x,y,z,], so removing the brackets gives a single comma separated list
+    return payload.replace('[','').replace(']','')
+
+
+def _stimulusevent2csv(payload:str):
+    # N.B. formatted as {id,state}{id,state}
+    return payload.replace('{','').replace('}',',')
+
+
+def parse_mindaffectBCI_lines(lines, packet_batch:bool=False):
+    """parse a batch of lines from a mindaffectBCI offline save file into messages
+
+    The common DataPacket and StimulusEvent lines are dispatched on their fixed type prefix, and the headers and payloads of
+    all such lines are converted to numbers with a single numpy call per message type.
+    Any other lines, or all lines of a type if any is mal-formed, are parsed with `read_mindaffectBCI_message`.
+
+    Args:
+        lines (list-of-str): the lines to parse
+        packet_batch (bool, optional): If True, then the data-packets are returned as a single `DataPacketBatch` at the position of the first packet, rather than as individual messages. Defaults to False.
+
+    Returns:
+        list-of-messages: the decoded messages, in line order
+    """
+    msgs = [None]*len(lines)
+    dp_tag = 't:'+DataPacket.msgName+' '
+    se_tag = 't:'+StimulusEvent.msgName+' '
+    dp_idx = [i for i, l in enumerate(lines) if l.find(dp_tag, 0, 64) > 0]
+    se_idx = [i for i, l in enumerate(lines) if l.find(se_tag, 0, 64) > 0]
+
+    if dp_idx:
+        res = _parse_batch(lines, dp_idx, DataPacket.msgName, 2, np.float32, _datapacket2csv)
+        nsamp = res[1][:,4]*res[1][:,3] if res is not None else None
+        if res is not None and res[2].size == np.sum(nsamp):
+            dp_idx, hdr, samples, ips = res
+            if packet_batch and np.all(hdr[:,3] == hdr[0,3]):
+                msgs[dp_idx[0]] = DataPacketBatch(samples.reshape((-1,hdr[0,3])), hdr[:,4], hdr[:,2], hdr[:,1], hdr[:,0], ips)
+            else:
+                offs = np.cumsum(np.append(0,nsamp)).tolist()
+                for j, (i, (rts, sts, ts, nch, ns)) in enumerate(zip(dp_idx, hdr.tolist())):
+                    m = DataPacket(ts, samples[offs[j]:offs[j+1]].reshape((ns,nch)))
+                    m.rts, m.sts, m.clientip = rts, sts, ips[j]
+                    msgs[i] = m
+        else:
+            for i in dp_idx:
+                msgs[i] = read_mindaffectBCI_message(lines[i])
+
+    if se_idx:
+        res = _parse_batch(lines, se_idx, StimulusEvent.msgName, 1, int, _stimulusevent2csv)
+        if res is not None and res[2].size == 2*np.sum(res[1][:,3]):
+            se_idx, hdr, stiminfo, ips = res
+            objIDs = stiminfo[0::2]
+            stimstate = stiminfo[1::2]
+            stimstate = np.where(stimstate < 0, stimstate+256, stimstate).tolist() # signed->unsigned conversion
+            offs = np.cumsum(np.append(0,hdr[:,3])).tolist()
+            for j, (i, (rts, sts, ts, _)) in enumerate(zip(se_idx, hdr.tolist())):
+                m = StimulusEvent(ts, objIDs[offs[j]:offs[j+1]], stimstate[offs[j]:offs[j+1]])
+                m.rts, m.sts, m.clientip = rts, sts, ips[j]
+                msgs[i] = m
+        else:
+            for i in se_idx:
+                msgs[i] = read_mindaffectBCI_message(lines[i])
+
+    # slow path for the other message types
+    fast = set(dp_idx).union(se_idx)
+    for i, l in enumerate(lines):
+        if i not in fast:
+            msgs[i] = read_mindaffectBCI_message(l)
+    return [m for m in msgs if m is not None]
+
+
+def open_mindaffectBCI_source(source):
+    """get a text stream for a mindaffectBCI log source
+
+    Args:
+        source ([str, stream]): the log file messages source, can be file-name (or glob pattern, when the newest match is used), or IO-stream, or string
+
+    Returns:
+        stream: the text stream to read from
+    """
+    if hasattr(source, 'read'):
+        return source
+    import glob
+    files = glob.glob(os.path.expanduser(source))
+    if files: # read from file
+        return open(max(files, key=os.path.getctime), 'r')
+    # assume it's already a string with the messages in
+    import io
+    return io.StringIO(source)
+
+
+def iter_mindaffectBCI_message_chunks(source, chunksize:int=1<<22, packet_batch:bool=False):
+    """streaming reader for mindaffectBCI offline save files, which reads the file in large blocks
+
+    Args:
+        source ([str, stream]): the log file messages source, can be file-name, or IO-stream, or string
+        chunksize (int, optional): the number of characters to read in each block. Defaults to 4M.
+        packet_batch (bool, optional): If True, then return the data-packets of each block as a single `DataPacketBatch`. Defaults to False.
+
+    Yields:
+        list-of-messages: the decoded messages from each block of the file
+    """
+    stream = open_mindaffectBCI_source(source)
+    rest = ''
+    while True:
+        block = stream.read(chunksize)
+        if not block:
+            break
+        lines = (rest + block).split('\n')
+        rest = lines.pop() # incomplete final line
+        msgs = parse_mindaffectBCI_lines(lines, packet_batch)
+        if msgs:
+            yield msgs
+    if rest:
+        msgs = parse_mindaffectBCI_lines([rest], packet_batch)
+        if msgs:
+            yield msgs
+
+
 def datapackets2array(msgs, sample2timestamp='lower_bound_tracker', timestamp_ch=None):
     """Convert a set of datapacket messages to a 2-d numpy array (with timestamp channel)
 
     Args:
-        msgs ([type]): list of DataPacket messages
+        msgs ([type]): list of DataPacket messages, or `DataPacketBatch` blocks of messages
         sample2timestamp (str, optional): filtering function, to filter the data-packet time-stamps using the increasing sample counts. Defaults to 'lower_bound_tracker'.
         timestamp_ch (int, optional): If set, channel which contains the timestamp information. Defaults to None.
 
     Returns:
         X( (t,d) np.ndarray): the extracted samples in a numpy array
     """
-    data=[]
     from mindaffectBCI.decoder.UtopiaDataInterface import timestamp_interpolation, linear_trend_tracker
 
+    # pre-allocate the output, and copy the samples directly into it
+    nsamp = np.concatenate([m.nsamp if isinstance(m,DataPacketBatch) else [len(m.samples)] for m in msgs]).astype(int)
+    ts = np.concatenate([np.atleast_1d(m.timestamp) for m in msgs])
+    nch = msgs[0].samples.shape[-1]
+    data = np.empty((np.sum(nsamp), nch+1), dtype=msgs[0].samples.dtype)
+    np.concatenate([m.samples for m in msgs], axis=0, out=data[:,:-1])
+
     # extract the time-stamp channel and map to server time-stamps
     # and insert as the packet time-stamp
-    if timestamp_ch is not None and timestamp_ch < len(msgs[0].samples[0]):
+    if timestamp_ch is not None and timestamp_ch < nch:
         # get the client-timestamp, server-timestamp pairs
-        x = np.array([msg.samples[-1,timestamp_ch] for msg in msgs]) #  from: client timestamp, from ts-channel
-        y = np.array([msg.rts for msg in msgs]) # to: server timestamp
+        x = data[np.cumsum(nsamp)-1, timestamp_ch] #  from: client timestamp, from ts-channel, of last sample in each packet
+        y = np.concatenate([np.atleast_1d(m.rts) for m in msgs]) # to: server timestamp
         ab = robust_timestamp_regression(x,y)
         # now rewrite the client time-stamps
-        for m in msgs:
-            m.rawtimestamp = m.timestamp # save the old one
-            m.timestamp = m.samples[-1,timestamp_ch]*ab[0] + ab[1]
-            # wrap into the desired bit-size if wanted
-            if hasattr(m,'unwrapped_timestamp'):
-                m.unwrapped_timestamp = m.timestamp
-                # BODGE: fixed wrapping size!
-                m.timestamp = m.timestamp % (1<<24)
-            
+        ts = x*ab[0] + ab[1]
+        # wrap into the desired bit-size if wanted
+        if hasattr(msgs[0],'unwrapped_timestamp'):
+            # BODGE: fixed wrapping size!
+            ts = ts % (1<<24)
+
+    # N.B. filter packet-by-packet, so the time-stamps are the same as on-line
     tsfilt = timestamp_interpolation(sample2timestamp=sample2timestamp)
-    for m in msgs:
-        samples = m.samples
-        ts   = m.timestamp
+    i = 0
+    for t, n in zip(ts, nsamp):
         # TODO[]: look at using the time-stamps non-filtered?
-        samples_ts = tsfilt.transform(ts,len(samples))
-        samples = np.append(samples, samples_ts[:,np.newaxis], -1).astype(samples.dtype)
-        data.append(samples)
-        #last_ts = ts
-        
-    # convert data into single np array
-    data = np. concatenate(data,0)
-    return data    
+        data[i:i+n,-1] = tsfilt.transform(t, n)
+        i = i + n
+    return data
 
 
 def robust_timestamp_regression(x,y):
@@ -300,34 +502,70 @@ def rewrite_timestamps2servertimestamps(msgs):
     return msgs
 
     
-def read_mindaffectBCI_messages( source, regress:bool=False ):
+def select_time_range(msgs, trange):
+    """select the messages with server time-stamp in the range trange[0] <= sts < trange[1]
+
+    Args:
+        msgs (list-of-messages): the messages to select from
+        trange ((start,end)): the server time-stamp range, use None for an open end
+
+    Returns:
+        list-of-messages: the selected messages
+    """
+    bgn, end = trange
+    out = []
+    for m in msgs:
+        if isinstance(m, DataPacketBatch):
+            sts = np.asarray(m.sts)
+            keep = np.ones(sts.shape, dtype=bool)
+            if bgn is not None: keep &= sts >= bgn
+            if end is not None: keep &= sts < end
+            if np.any(keep):
+                out.append(m if np.all(keep) else m.select(keep))
+        elif m.sts is not None and (bgn is None or m.sts >= bgn) and (end is None or m.sts < end):
+            out.append(m)
+    return out
+
+
+def read_mindaffectBCI_messages( source, regress:bool=False, fast:bool=True, packet_batch:bool=False, trange=None, trial:int=None ):
     """read all the messages from a mindaffetBCI offline save file
 
     Args:
         source ([str, stream]): the log file messages source, can be file-name, or IO-stream, or string
         regress (bool, optional): How should we regress the client-time stamps onto the server time-stamps.  If False then use the server-time-stamps, if None then leave the client-time-stamps, if True then use robust-regression to map from client to server time-stamps.
         Defaults to False.
+        fast (bool, optional): If True then use the block-wise parser `iter_mindaffectBCI_message_chunks`, else parse line-by-line with `read_mindaffectBCI_message`. Defaults to True.
+        packet_batch (bool, optional): If True, and fast, then the data-packets are returned in `DataPacketBatch` blocks rather than as individual messages.  Not used with regress=True. Defaults to False.
+        trange ((start,end), optional): only return messages with server time-stamps in this range. Defaults to None.
+        trial (int, optional): only return messages from this trial, i.e. from its NewTarget to the next NewTarget/ModeChange.  Defaults to None.
 
     Returns:
         (list, messages): a list of all the decoded messages
     """
-    if hasattr(source, 'readline'):
-        stream = source
-    elif isinstance(source,str):
-        import glob
-        source = max(glob.glob(os.path.expanduser(source)), key=os.path.getctime)
-        if os.path.exists(source): # read from file
-            source = os.path.expanduser(source)
-            stream = open(source,'r')
-        else: # assume it's already a string with the messages in
-            import io
-            stream = io.StringIO(fn)
-
-    msgs=[]
-    for line in stream:
-        msg = read_mindaffectBCI_message(line)
-        if msg is not None:
-            msgs.append(msg)
+    from mindaffectBCI.decoder.offline.mindaffectBCI_binlog import is_binary_log, BinaryLogReader, boundaries2trials, trial_range
+    binary = is_binary_log(source)
+    if binary:
+        # binary log -> seek directly to the wanted part of the file
+        rdr = BinaryLogReader(source)
+        if trial is not None:
+            trange = rdr.trial_range(trial)
+        msgs = rdr.read_messages(trange, packet_batch=packet_batch and not regress)
+    elif fast:
+        packet_batch = packet_batch and not regress
+        msgs = [m for chunk in iter_mindaffectBCI_message_chunks(source, packet_batch=packet_batch) for m in chunk]
+    else:
+        msgs = []
+        for line in open_mindaffectBCI_source(source):
+            msg = read_mindaffectBCI_message(line)
+            if msg is not None:
+                msgs.append(msg)
+
+    if not binary:
+        if trial is not None:
+            trials = boundaries2trials([(m.msgName, m.sts) for m in msgs if isinstance(m,(NewTarget,ModeChange))])
+            trange = trial_range(trials, trial)
+        if trange is not None:
+            msgs = select_time_range(msgs, trange)
 
     # TODO [X]: intelligent time-stamp re-writer taking account of the client-ip
     if regress is None:
@@ -352,19 +590,21 @@ def read_mindaffectBCI_messages( source, regress:bool=False ):
         
     return msgs
 
-def read_mindaffectBCI_data_messages( source, regress=False, timestamp_wrap_size=(1<<24), **kwargs ):
+def read_mindaffectBCI_data_messages( source, regress=False, timestamp_wrap_size=(1<<24), trange=None, trial:int=None, **kwargs ):
     """read an offline mindaffectBCI save file, and return raw-data (as a np.ndarray) and messages. 
 
     Args:
         source (str): the file name to load the data from
         regress (bool, optional): How to map from client-specific to a common time-stamp basis. Defaults to False.
         timestamp_wrap_size (tuple, optional): The bit-resolution of the time-stamps. Defaults to (1<<24).
+        trange ((start,end), optional): only load messages with server time-stamps in this range. Defaults to None.
+        trial (int, optional): only load this trial.  Defaults to None.
 
     Returns:
         data (np.ndarray (nsamp,d) float): the time-stamped data stream
         messages (list messages): the (non-datapacket) messages in the file
     """
-    rawmsgs = read_mindaffectBCI_messages(source, regress)
+    rawmsgs = read_mindaffectBCI_messages(source, regress, packet_batch=True, trange=trange, trial=trial)
     # split into datapacket messages and others
     data=[]
     msgs=[]
@@ -376,7 +616,7 @@ def read_mindaffectBCI_data_messages( source, regress=False, timestamp_wrap_size
             m.unwrapped_timestamp = m.timestamp
             m.timestamp = m.timestamp % timestamp_wrap_size
 
-        if isinstance(m,DataPacket):
+        if isinstance(m,(DataPacket,DataPacketBatch)):
             data.append(m)
         else:
             msgs.append(m)
@@ -17,8 +17,12 @@
 
 import numpy as np
 from mindaffectBCI.decoder.utils import window_axis
+
+# number of output elements per block in contract_events
+CONTRACT_BLOCK_SIZE = 1<<16
+
 #@function
-def scoreOutput(Fe_mTSe, Y_TSye, dedup0=None, R=None, offset=None, outputscore='ip'):
+def scoreOutput(Fe_mTSe, Y_TSye, dedup0=None, R=None, offset=None, outputscore='ip', out=None):
     '''
     score each output given information on which stim-sequences corrospend to which inputs
 
@@ -27,11 +31,13 @@ def scoreOutput(Fe_mTSe, Y_TSye, dedup0=None, R=None, offset=None, outputscore='
       Fe_mTSe (nM,nTrl,nSamp,nE): similarity score for each event type for each stimulus
       Y_TSye (nTrl,nSamp,nY,nE): Indicator for which events occured for which outputs
                nE=#event-types  nY=#possible-outputs  nEpoch=#stimulus events to process
+               N.B. Y can be kept packed, e.g. as uint8 or bool, it is never converted to Fe's type
       R_mket (nM,nfilt,nE,tau): FWD-model (impulse response) for each of the event types, used to correct the 
             scores for correlated responses.
       offset (int): A (set of) offsets to try when decoding.  Defaults to None.
       dedup0 (int): remove duplicate copies of output O, >0 remove the copy, <0 remove objID==0 (used when cross validating calibration data)
       outputscore (str): type of score to compute. one-of: 'ip', 'sse'.  Defaults to 'ip' 
+      out (nM,nTrl,nSamp,nY): optional buffer of Fe's type to write the scores into, with nM=#offsets if offset is given.  Defaults to None.
 
     Returns
       Fy_mTSy  (nM,nTrl,nSamp,nY): similarity score for each input epoch for each output
@@ -47,38 +53,23 @@ def scoreOutput(Fe_mTSe, Y_TSye, dedup0=None, R=None, offset=None, outputscore='
         Fe_mTSe = Fe_mTSe.reshape((1,)*(4-Fe_mTSe.ndim)+Fe_mTSe.shape)    
     if dedup0 is not None and dedup0 is not False: # remove duplicate copies output=0
         Y_TSye = dedupY0(Y_TSye, zerodup=dedup0>0)
-    # ensure Y_TSye has same type of Fe_mTSe
-    Y_TSye = Y_TSye.astype(Fe_mTSe.dtype)
 
     # inner-product score
     if offset is None:
-        Fy_mTSy = np.einsum("mTEe,TEYe->mTEY", Fe_mTSe, Y_TSye, dtype=Fe_mTSe.dtype)
-        Fy_mTSy = Fy_mTSy.astype(Fe_mTSe.dtype)
+        Fy_mTSy = contract_events(Fe_mTSe, Y_TSye, out=out)
 
     else:
         assert Fe_mTSe.ndim<4 or Fe_mTSe.shape[0]==1, "Offsets only for single models!"
         if not hasattr(offset,'__iter__'): 
             offset=[offset]
-        # list of possible offsets to try
-        Fy_mTSy= np.zeros((len(offset), Fe_mTSe.shape[1], Fe_mTSe.shape[2], Y_TSye.shape[-2]), dtype=Fe_mTSe.dtype)
-        for i,o in enumerate(offset):
-            # +offset -> Y is later than it 'should' be
-            if o == 0:
-                Fyi = np.einsum("mTEe,TEYe->mTEY", Fe_mTSe, Y_TSye, dtype=Fe_mTSe.dtype)
-                Fy_mTSy[i,...] = Fyi.astype(Fe_mTSe.dtype)
-
-            elif o > 0:
-                Fyi = np.einsum("mTEe,TEYe->mTEY", Fe_mTSe[..., o: ,: ], Y_TSye[..., :-o , :, :], dtype=Fe_mTSe.dtype)
-                Fy_mTSy[i, ..., o:, :] = Fyi.astype(Fe_mTSe.dtype)
-
-            else:
-                Fyi = np.einsum("mTEe,TEYe->mTEY", Fe_mTSe[..., :o ,:], Y_TSye[..., -o: , :, :], dtype=Fe_mTSe.dtype)
-                Fy_mTSy[i, ..., :o, :] = Fyi.astype(Fe_mTSe.dtype)
+        # all the possible offsets to try in one go, as shifted views of Y
+        # +offset -> Y is later than it 'should' be
+        Fy_mTSy = contract_events(Fe_mTSe, shifted_views(Y_TSye, offset, axis=-3), out=out)
 
 
     # add correction for other measures
     if outputscore == 'sse':
-        YR = convYR(Y_TSye,R,offset) # (nM,nTrl,nSamp,nY,nFilt)
+        YR = convYR(Y_TSye.astype(Fe_mTSe.dtype),R,offset) # (nM,nTrl,nSamp,nY,nFilt)
         # Apply the correction:
         #  SSE = (wX-Yr).^2
         #      = wX**2 - 2 wXYr + Yr**2
@@ -86,7 +77,7 @@ def scoreOutput(Fe_mTSe, Y_TSye, dedup0=None, R=None, offset=None, outputscore='
         #      = wX**2 - 2Fy + Yr**2
         #  take negative, so big (i.e. 0) is good, and drop constant over Y and divide by 2 ->
         #  -SSE = fY  = Fe*Y - .5* Yr**2
-        Fy_mTSy = Fy_mTSy - np.sum(YR**2,-1) / 2
+        Fy_mTSy -= np.sum(YR**2,-1) / 2
 
     elif outputscore == 'corr': # correlation based scoring...
         raise NotImplementedError()
@@ -99,6 +90,77 @@ def scoreOutput(Fe_mTSe, Y_TSye, dedup0=None, R=None, offset=None, outputscore='
     
     return Fy_mTSy
 
+def contract_events(Fe, Y, out=None):
+    ''' compute the inner product over event types of Fe (...,nSamp,nE) with Y (...,nSamp,nY,nE)
+
+    The contraction is done one event type at a time with broadcasting, so Y is never converted to
+    Fe's type, in blocks of samples so the only temporary is a small cache sized buffer.
+
+    Args:
+      Fe (...,nSamp,nE): score for each event type
+      Y (...,nSamp,nY,nE): indicator for which events occured for which outputs, any numeric type
+      out (...,nSamp,nY): optional buffer of Fe's type to write the result into.  Defaults to None.
+
+    Returns:
+      out (...,nSamp,nY): the summed score for each output
+    '''
+    shape = np.broadcast_shapes(Fe.shape[:-1]+(1,), Y.shape[:-1])
+    if out is None:
+        out = np.empty(shape, dtype=Fe.dtype)
+    elif not out.shape == shape:
+        raise ValueError("out has the wrong shape, {}!={}".format(out.shape, shape))
+    nSamp = shape[-2]
+    blksz = max(1, CONTRACT_BLOCK_SIZE // max(1, out.size // max(1, nSamp)))
+    tmp = np.empty(shape[:-2]+(min(blksz, nSamp), shape[-1]), dtype=out.dtype) if Fe.shape[-1] > 1 else None
+    for bi in range(0, nSamp, blksz):
+        blk = slice(bi, min(nSamp, bi+blksz))
+        outb, Feb, Yb = out[..., blk, :], Fe[..., blk, :], Y[..., blk, :, :]
+        np.multiply(Feb[..., 0:1], Yb[..., 0], out=outb)
+        for ei in range(1, Fe.shape[-1]):
+            tmpb = tmp[..., :outb.shape[-2], :]
+            np.multiply(Feb[..., ei:ei+1], Yb[..., ei], out=tmpb)
+            outb += tmpb
+    return out
+
+def shifted_views(Y, offsets, axis=-3):
+    ''' get a set of time-shifted versions of Y, zero padded at the ends, so Yo[i,...,t,...] = Y[...,t-offsets[i],...]
+
+    N.B. for evenly spaced offsets, the result is a view of a single zero-padded copy of Y.
+
+    Args:
+      Y (...,nSamp,...): the array to shift
+      offsets (nOff): the shifts along axis, +offset means Y is later
+      axis (int): the time axis of Y.  Defaults to -3.
+
+    Returns:
+      Yo (nOff,...,nSamp,...): the shifted versions of Y
+    '''
+    offsets = np.asarray(offsets, dtype=int).ravel()
+    if axis < 0:
+        axis = Y.ndim + axis
+    pad = int(np.max(np.abs(offsets)))
+    if pad == 0:
+        return np.broadcast_to(Y, (len(offsets),)+Y.shape)
+    padshape = list(Y.shape); padshape[axis] = Y.shape[axis] + 2*pad
+    Ypad = np.zeros(padshape, dtype=Y.dtype)
+    idx = [slice(None)]*Y.ndim
+    idx[axis] = slice(pad, pad+Y.shape[axis])
+    Ypad[tuple(idx)] = Y
+    steps = np.diff(offsets)
+    if len(offsets) > 1 and not np.all(steps == steps[0]):
+        # uneven offsets -> stack of slices
+        Yo = []
+        for o in offsets:
+            idx[axis] = slice(pad-o, pad-o+Y.shape[axis])
+            Yo.append(Ypad[tuple(idx)])
+        return np.stack(Yo, 0)
+    step = int(steps[0]) if len(offsets) > 1 else 0
+    idx[axis] = slice(pad-offsets[0], pad-offsets[0]+Y.shape[axis])
+    Y0 = Ypad[tuple(idx)]
+    return np.lib.stride_tricks.as_strided(Y0, shape=(len(offsets),)+Y.shape,
+                                           strides=(-step*Ypad.strides[axis],)+Ypad.strides,
+                                           writeable=False)
+
 def dedupY0(Y, zerodup=True, yfeatdim=True, verb=0):
     ''' remove outputs which are duplicates of the first (objID==0) output
     Inputs:
@@ -107,13 +169,13 @@ def dedupY0(Y, zerodup=True, yfeatdim=True, verb=0):
          if True, then if mi is the duplicate, then zero the  duplicate, i.e. of Y[...,mi,:]=0
          else, we zero out ojID==0, i.e. Y[...,0,:]=0
     Outputs:
-      Y=(tr,ep,Y,e) version of Y with duplicates of 1st row of Y set to 0'''
+      Y=(tr,ep,Y,e) version of Y with duplicates of 1st row of Y set to 0
+       N.B. only copied if a duplicate is found, otherwise Y itself is returned'''
 
     # record input shape so can get it back later
     Yshape = Y.shape
     #print("Y={}".format(Yshape))
     
-    Y = np.copy(Y) # copy so can modify, w/o killing orginal
     # make the shape we want
     if not yfeatdim: # hack in feature dim
         Y = Y[..., np.newaxis]
@@ -122,12 +184,16 @@ def dedupY0(Y, zerodup=True, yfeatdim=True, verb=0):
     if Y.ndim == 3: # add trial dim if not there
         Y = Y[np.newaxis, :, :, :]
         
+    copied = False
     for ti in range(Y.shape[0]):
         # Note: horrible numpy hacks to make work & only for idx==0
         sim = np.sum(np.equal(Y[ti, :, 0:1, :], Y[ti, :, 1:, :]), axis=(0, 2))/(Y.shape[1]*Y.shape[3])
         #print("sim={}".format(sim))
         mi = np.argmax(sim)
         if sim[mi] > .95:
+            if not copied: # copy so can modify, w/o killing orginal
+                Y = np.copy(Y)
+                copied = True
             if verb>0 : print("{}) dup {}={} ".format(ti,0,mi+1),end='')
             if zerodup: # zero out the duplicate of objId=0
                 Y[ti, :, mi+1, :] = 0
@@ -42,7 +42,7 @@ def run(ui: UtopiaDataInterface=None, host=None, timeout_ms:float=np.inf,
     plt.axes((.05,.25,.9,.7))
     plt.title("EEG")
     idx=slice(-int(ui.fs*timerange),None)
-    data = ui.data_ringbuffer[idx, :]
+    data = ui.data_ringbuffer.with_timestamps(idx)
     # vertical gap between EEG lines
     data_linestep = np.arange(data[:, :ndata_lines].shape[-1]) * datastep
     # compute the x-point,  i.e. in time. Use these as ring-buffer may not be full yet
@@ -53,7 +53,7 @@ def run(ui: UtopiaDataInterface=None, host=None, timeout_ms:float=np.inf,
 
     plt.axes((.05,.05,.9,.1))
     plt.title("Stimulus")
-    stimulus = ui.stimulus_ringbuffer[idx, :]
+    stimulus = ui.stimulus_ringbuffer.with_timestamps(idx)
     # vertical gap between stimulus lines
     stimulus_linestep = np.arange(nstimulus_lines) * stimstep
     stimulus_lines = plt.plot((xdata[0],xdata[-1]),np.zeros((2,nstimulus_lines))+stimulus_linestep)
@@ -84,7 +84,7 @@ def run(ui: UtopiaDataInterface=None, host=None, timeout_ms:float=np.inf,
 
         # Update the EEG stream
         idx = slice(-int(ui.fs*timerange),None) # final 5s data
-        data = ui.data_ringbuffer[idx, :]
+        data = ui.data_ringbuffer.with_timestamps(idx)
         if center:
             # only the non-timestamp channels
             data[:,:-1] = data[:,:-1] - np.mean(data[-int(data.shape[0]*.25):,:-1],axis=0)
@@ -102,7 +102,7 @@ def run(ui: UtopiaDataInterface=None, host=None, timeout_ms:float=np.inf,
 
         # Update the Stimulus Stream
         # TODO[]: search backwards instead of assuming the stimulus rate...
-        stimulus = ui.stimulus_ringbuffer[idx,:]
+        stimulus = ui.stimulus_ringbuffer.with_timestamps(idx)
         # BODGE: pad with 2 extra 0 events, if last stimulus before last data
         if stimulus.shape[0]<2 or stimulus[-1,-1] < data[-1,-1]:
             pad = np.zeros((2,stimulus.shape[1]),dtype=stimulus.dtype)
@@ -16,20 +16,162 @@
 # along with pymindaffectBCI.  If not, see <http://www.gnu.org/licenses/>
 
 import numpy as np
-from mindaffectBCI.decoder.utils import equals_subarray
+from functools import lru_cache
+
+# aliases for the named multi-bit patterns, oldest sample first
+PATTERN_ALIASES = {'flash':'1', 're':'01', 'fe':'10', 'short':'010', 'long':'0110'}
+# the non-pattern event types
+EVENT_OPS = ('diff', 'rest', 'raw', 'grad', 'onset')
+
+class EventSpec:
+    '''
+    pre-compiled set of event types, for repeated (incremental) conversion of stimulus sequences to event sequences
+
+    All the bit-pattern event types are matched in a single pass over a packed sliding-window code of M,
+    with 2 bits per sample (01 for a 0, 10 for a 1, 00 for anything else), newest sample in the lowest bits,
+    so each pattern becomes a single masked compare.  Incremental calls only need the last few samples of the prefix.
+
+    Args:
+     evtypes - [nE]:str list of event types, see `stim2event`
+    '''
+    def __init__(self, evtypes):
+        if isinstance(evtypes, str):
+            evtypes = [evtypes]
+        self.evtypes = tuple(evtypes)
+        self.ops = [] # (op, arg, modifier) for each event type
+        for etype in self.evtypes:
+            modifier = None
+            if etype.startswith("nt"):
+                modifier = "nt"
+                etype = etype[len(modifier):]
+            if etype.startswith("any"):
+                modifier = "any"
+                etype = etype[len(modifier):]
+            pattern = PATTERN_ALIASES.get(etype, etype)
+            if len(pattern) > 0 and all(c in '01' for c in pattern):
+                self.ops.append(('pattern', pattern, modifier))
+            elif etype in EVENT_OPS:
+                self.ops.append((etype, None, modifier))
+            else:
+                raise ValueError("Unrecognised evttype:{}".format(etype))
+
+        # the packed code for the patterns
+        patterns = [arg for op, arg, _ in self.ops if op == 'pattern']
+        self.patlen = max([len(p) for p in patterns], default=0)
+        if self.patlen > 32:
+            raise ValueError("Patterns longer than 32 samples not supported")
+        self.code_dtype = np.uint8 if self.patlen <= 4 else np.uint16 if self.patlen <= 8 else np.uint32 if self.patlen <= 16 else np.uint64
+        self.patcodes = dict()
+        for p in patterns:
+            code = 0
+            for k, c in enumerate(reversed(p)):
+                code |= (2 if c == '1' else 1) << (2*k)
+            self.patcodes[p] = (self.code_dtype((1 << (2*len(p)))-1), self.code_dtype(code))
+
+    def __repr__(self):
+        return "EventSpec({})".format(self.evtypes)
+
+    def digits(self, M):
+        """2-bit digit code for each element of M"""
+        D = (M == 0).astype(self.code_dtype)
+        D[M == 1] = 2
+        return D
+
+    def pack(self, M, oM=None):
+        """packed sliding window code for time along axis 0 of M, with optional prefix oM"""
+        D = self.digits(M)
+        code = D.copy()
+        P = self.digits(oM[-(self.patlen-1):]) if oM is not None and self.patlen > 1 else None
+        n, npre = D.shape[0], P.shape[0] if P is not None else 0
+        for k in range(1, self.patlen):
+            shift = self.code_dtype(2*k)
+            code[k:] |= D[:-k] << shift
+            # window start before M, so get from the prefix
+            t0, t1 = max(0, k-npre), min(k, n)
+            if t0 < t1:
+                code[t0:t1] |= P[npre+t0-k:npre+t1-k] << shift
+        return code
+
+    def __call__(self, M, axis=-1, oM=None):
+        """convert the stimulus sequence M to an event sequence, see `stim2event`"""
+        if axis < 0: # ensure axis is positive!
+            axis=M.ndim+axis
+        # N.B. the gradient of un-signed stimulus can be negative, so needs a signed type
+        dtype = M.dtype
+        if np.issubdtype(dtype, np.unsignedinteger) and any(op == 'grad' for op, _, _ in self.ops):
+            dtype = np.result_type(dtype, np.int8)
+        E = np.zeros(M.shape+(len(self.ops), ), dtype) # list event types
+        if M.size == 0: # guard empty inputs
+            return E
+        # work with time in the 1st axis
+        Mt = np.moveaxis(M, axis, 0)
+        Et = np.moveaxis(E, axis, 0)
+        oMt = np.moveaxis(oM, axis, 0) if oM is not None and oM.shape[axis] > 0 else None
+        code = self.pack(Mt, oMt) if self.patlen > 0 else None
+
+        for ei, (op, arg, modifier) in enumerate(self.ops):
+            if op == 'pattern':
+                mask, patcode = self.patcodes[arg]
+                F = (code & mask) == patcode
+            elif op == 'diff' or op == 'grad':
+                F = np.zeros(Mt.shape, dtype=bool if op == 'diff' else dtype)
+                if op == 'diff':
+                    F[1:] = Mt[1:] != Mt[:-1]
+                else:
+                    np.subtract(Mt[1:], Mt[:-1], out=F[1:], dtype=dtype)
+                if oMt is not None:
+                    F[0] = Mt[0] != oMt[-1] if op == 'diff' else np.subtract(Mt[0], oMt[-1], dtype=dtype)
+            elif op == 'rest': # i.e. no stimuli anywhere
+                if not axis == M.ndim-2:
+                    raise ValueError("rest only for axis==-2")
+                F = np.logical_not(np.any(Mt, axis=-1, keepdims=True))
+            elif op == 'raw':
+                F = Mt
+            elif op == 'onset':
+                # first stimulus RE for any output, i.e. only 1 stimulus since trial start
+                F = np.cumsum(Mt > 0, axis=0)
+                if oMt is not None:
+                    F += np.count_nonzero(oMt > 0, axis=0)
+                F = F == 1
+
+            # apply any modifiers wanted to F
+            if modifier == "nt":
+                # non-target, means true when OTHER targets are high, i.e. or over other outputs
+                if not axis == M.ndim-2:
+                    raise ValueError("non-target only for axis==-2")
+                anyevt = np.any(F > 0, axis=-1, keepdims=True) # any stim event type
+                F = np.logical_and(F == 0, anyevt)
+            elif modifier == "any":
+                if not axis == M.ndim-2:
+                    raise ValueError("any feature only for axis==-2")
+                # any, means true if any target is true, N.B. use logical_or to broadcast
+                F = np.any(F > 0, axis=-1, keepdims=True)
+
+            Et[..., ei] = F
+        return E
+
+
+@lru_cache(maxsize=64)
+def get_eventspec(evtypes):
+    """get the (cached) pre-compiled EventSpec for this tuple of event types"""
+    return EventSpec(evtypes)
+
+
 def stim2event(M, evtypes=('re','fe'), axis=-1, oM=None):
     '''
     convert per-sample stimulus sequence into per-sample event sequence (e.g. rising/falling edge, or long/short flash)
 
     Args:
      M  (...samp) or (...,samp,nY): for and/non-target features
-     evnames - [nE]:str list of strings:
+     evnames - [nE]:str list of strings, or a pre-compiled EventSpec:
         "0", "1", "00", "11", "01" (aka. 're'), "10" (aka, fe), "010" (aka. short), "0110" (aka long)
+         N.B. in general any string of 0/1 up to 32 samples long is matched as a bit pattern
         "nt"+evtname : non-target event, i.e. evtname occured for any other target
         "any"+evtname: any event, i.e. evtname occured for *any* target
         "rest" - not any of the other event types, N.B. must be *last* in event list
         "raw" - unchanged input intensity coding
         "grad" - 1st temporal derivative of the raw intensity
+        "onset" - first stimulus for any output since the trial start
      axis - (-1) the axis of M which runs along 'time'
      oM - (...osamp) or (...,osamp,nY) prefix stimulus values of M, used to incrementally compute the  stimulus features
     Outputs:
@@ -41,116 +183,12 @@ def stim2event(M, evtypes=('re','fe'), axis=-1, oM=None):
       #Or modeling as two responses, target-stim-response and any-stim-response
         E = stim2event(M,evtypes=('re','anyre'), axis=-2)
     '''
-    if axis < 0: # ensure axis is positive!
-        axis=M.ndim+axis
-    if isinstance(evtypes, str):
-        evtypes = [evtypes]
     if evtypes is None:
         return M[:,:,:,np.newaxis]
-    if oM is not None:
-        #  include the prefix
-        M = np.append(oM,M,axis)
-
+    if not isinstance(evtypes, EventSpec):
+        evtypes = get_eventspec((evtypes,) if isinstance(evtypes, str) else tuple(evtypes))
     # Copyright (c) MindAffect B.V. 2018
-    E = np.zeros(M.shape+(len(evtypes), ), M.dtype) # list event types
-    #print("E.dtype={}".format(E.dtype))
-    if len(M) == 0: # guard empty inputs
-        return E
-    for ei, etype in enumerate(evtypes):
-        modifier = None
-        if etype.startswith("nt"):
-            modifier = "nt"
-            etype = etype[len(modifier):]
-        if etype.startswith("any"):
-            modifier = "any"
-            etype = etype[len(modifier):]
-            
-        # 1-bit
-        if etype == "flash" or etype == '1':
-            F = (M == 1)
-        elif etype == '0':
-            F = (M == 0)
-        # 2-bit
-        elif etype == "00":
-            F = equals_subarray(M, [0, 0], axis)
-        elif etype == "re" or etype == "01":
-            F = equals_subarray(M, [0, 1], axis)
-        elif etype == "fe" or etype == "10":
-            F = equals_subarray(M, [1, 0], axis)
-        elif etype == "11":
-            F = equals_subarray(M, [1, 1], axis)
-        # 3-bit
-        elif etype == "000":
-            F = equals_subarray(M, [0, 0, 0], axis)
-        elif etype == "001":
-            F = equals_subarray(M, [0, 0, 1], axis)
-        elif etype == "010" or etype == 'short':
-            F = equals_subarray(M, [0, 1, 0], axis)
-        elif etype == "011":
-            F = equals_subarray(M, [0, 1, 1], axis)
-        elif etype == "100":
-            F = equals_subarray(M, [1, 0, 0], axis)
-        elif etype == "101":
-            F = equals_subarray(M, [1, 0, 1], axis)
-        elif etype == "110":
-            F = equals_subarray(M, [1, 1, 0], axis)
-        elif etype == "111":
-            F = equals_subarray(M, [1, 1, 1], axis)
-        # 4-bit
-        elif etype == "0110" or etype == 'long':
-            F = equals_subarray(M, [0, 1, 1, 0], axis)
-        # diff
-        elif etype == "diff":
-            F = np.diff(M, axis=axis) != 0
-            # pad missing entry
-            padshape=list(F.shape); padshape[axis] = 1
-            F = np.append(np.zeros(padshape, dtype=F.dtype), F, axis)
-
-        elif etype == "rest": # i.e. no stimuli anywhere
-            if not axis == M.ndim-2:
-                raise ValueError("rest only for axis==-2")
-            F = np.logical_not(np.any(M, axis=-1, keepdims=True))
-
-        elif etype == 'raw':
-            F = M
-        elif etype == 'grad': # i.e. gradient of the stimulus
-            F = np.diff(M,axis=axis)
-
-        elif etype == 'onset':
-            # first stimulus RE for any output
-            F = np.cumsum(M>0, axis=axis, dtype=M.dtype) # number of stimulus since trial start 
-            F[F>1] = 0 # zero out if more than 1 stimulus since trial start
-
-        else:
-            raise ValueError("Unrecognised evttype:{}".format(etype))
-
-        # apply any modifiers wanted to F
-        if modifier == "nt":
-            # non-target, means true when OTHER targets are high, i.e. or over other outputs
-            if not axis == M.ndim-2:
-                raise ValueError("non-target only for axis==-2")
-            anyevt = np.any(F > 0, axis=-1) # any stim event type
-            for yi in range(F.shape[-1]):
-                # non-target if target for *any* Y except this one
-                F[..., yi] = np.logical_and(F[..., yi] == 0, anyevt)
-                
-        elif modifier == "any":
-            if not axis == M.ndim-2:
-                raise ValueError("any feature only for axis==-2")   
-            # any, means true if any target is true, N.B. use logical_or to broadcast
-            F = np.any(F > 0, axis=-1, keepdims=True)
-
-        E[..., ei] = F
-
-    if oM is not None:
-        # strip the prefix
-        # build index expression to get the  post-fix along axis
-        idx=[slice(None)]*E.ndim
-        idx[axis]=slice(oM.shape[axis],E.shape[axis])
-        # get  the postfix
-        E = E[tuple(idx)]
-    #print("E.dtype={}".format(E.dtype))
-    return E
+    return evtypes(M, axis=axis, oM=oM)
 
 def testcase():
     from stim2event import stim2event
@@ -168,6 +206,12 @@ def testcase():
     e = stim2event(M.T, ('re', 'fe', 'rest'), axis=-2); print("referest :{}".format(e[0, ...].T))
     e = stim2event(M.T, 'ntre', axis=-2);      print("ntre :{}".format(e[0, ...].T))
 
+    # un-signed stimulus, the falling edges must give a negative gradient
+    e = stim2event(M.astype(np.uint8), 'grad', axis=-1); print("grad(uint8):{}".format(e[0, ...].T))
+    assert np.all(e == stim2event(M.astype(np.float32), 'grad', axis=-1)) and np.min(e) == -1
+    e = stim2event(M[:,4:].astype(np.uint8), 'grad', axis=-1, oM=M[:,:4].astype(np.uint8))
+    assert np.all(e == stim2event(M, 'grad', axis=-1)[:,4:,:])
+
     # test incremental calling, propogating prefix between calls
     oM= None
     e = []
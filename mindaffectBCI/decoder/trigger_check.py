@@ -249,7 +249,7 @@ def run(hostname='-', stopband=(.1,45,'bandpass'), fs_out=250, **kwargs):
         nmsgs, ndata, nstim = ui.update(timeout_ms=500)
 
         # get the new raw data and append
-        rawdata = ui.data_ringbuffer[-ndata:, :]
+        rawdata = ui.data_ringbuffer.with_timestamps(slice(-ndata, None))
         if data is None:
             data = rawdata
         else:
@@ -260,7 +260,7 @@ def run(hostname='-', stopband=(.1,45,'bandpass'), fs_out=250, **kwargs):
             continue
 
         # get the new raw stimulus 
-        rawstimulus = ui.stimulus_ringbuffer[-nstim:, :]
+        rawstimulus = ui.stimulus_ringbuffer.with_timestamps(slice(-nstim, None))
         if rawstimulus.size > 0 :
             # append to the stimulus info
             if stimulus is None:
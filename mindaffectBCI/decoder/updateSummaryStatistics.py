@@ -17,11 +17,25 @@
 
 import numpy as np
 from mindaffectBCI.decoder.utils import window_axis, idOutliers, zero_outliers
+try:
+    from scipy.fft import rfft, irfft, next_fast_len
+except ImportError: # old scipy, use numpy
+    from numpy.fft import rfft, irfft
+    def next_fast_len(n): return 1<<int(np.ceil(np.log2(n)))
+
+# method used to compute the lagged cross-products in Cxy, Cyy, one-of:
+#   'loop' - direct computation with one product per lag
+#   'fft'  - all lags at once by FFT cross-correlation of overlapping blocks
+#   'auto' - 'fft' when tau >= FFT_MIN_TAU, 'loop' otherwise
+LAGGED_METHOD = 'auto'
+FFT_MIN_TAU = 4
+# max number of samples transformed at once in the FFT method
+FFT_BLOCK_SIZE = 1<<16
 #@function
 def updateSummaryStatistics(X, Y, stimTimes=None, 
                             Cxx=None, Cxy=None, Cyy=None, 
-                            badEpThresh=4, halflife_samp=1, cxxp=True, cyyp=True, tau=None,
-                            offset=0, center=True, unitnorm=True, zeropadded:bool=True, perY=True):
+                            badEpThresh=4, halflife_samp:float=None, cxxp=True, cyyp=True, tau=None,
+                            offset=0, center=True, unitnorm=True, zeropadded:bool=True, perY=True, method:str=None, toeplitz:bool=False):
     '''
     Compute updated summary statistics (Cxx_dd, Cxy_yetd, Cyy_yetet) for new data in X with event-info Y
 
@@ -43,8 +57,13 @@ def updateSummaryStatistics(X, Y, stimTimes=None,
       Cyy_yetet (nY, nE, tau, nE, tau) : current response covariance for each output
       badEpThresh (float): threshold for removing bad-data before fitting the summary statistics
       center (bool): do we center the X data before computing the summary statistics? (True)
-      halflife_samp (float): forgetting factor for the updates
+      halflife_samp (float): forgetting factor for the updates, s.t. the old statistics are down-weighted
+               by alpha**nSamp for the nSamp new samples.  None for no forgetting.  Defaults to None.
                Note: alpha = exp(log(.5)./(half-life)), half-life = log(.5)/log(alpha)   
+      method (str): how to compute the lagged cross-products for Cxy, Cyy, one of:
+               'loop' - one product per lag, 'fft' - all lags at once with the FFT, 
+               'auto' - fft for long tau.  Defaults to LAGGED_METHOD.
+      toeplitz (bool): return Cyy as a ToeplitzCyy, which only stores the (tau,nY,nE,nE) diagonal blocks. (False)
     Returns:
       Cxx_dd (d,d) : updated data covariance
       Cxy_yetd (nY, nE, tau, d) : updated per output ERPs
@@ -70,12 +89,12 @@ def updateSummaryStatistics(X, Y, stimTimes=None,
         else:
             raise ValueError("tau not set and Cxy is None!")
     tau = int(tau) # ensure tau is integer
-    wght = 1
+    wght = forgetting_weight(X.shape[0]*X.shape[1] if X.ndim > 2 else X.shape[0], halflife_samp)
 
     X, Y = zero_outliers(X, Y, badEpThresh)
     
     # update the cross covariance XY
-    Cxy = updateCxy(Cxy, X, Y, stimTimes, tau, wght, offset=offset, center=center, unitnorm=unitnorm)
+    Cxy = updateCxy(Cxy, X, Y, stimTimes, tau, wght, offset=offset, center=center, unitnorm=unitnorm, method=method)
     # Update Cxx
     if (cxxp):
         Cxx = updateCxx(Cxx, X, stimTimes, None, wght, offset=offset, center=center, unitnorm=unitnorm)
@@ -83,10 +102,102 @@ def updateSummaryStatistics(X, Y, stimTimes=None,
     # ensure Cyy has the right size if not entry-per-model
     if (cyyp):
         # TODO [] : support overlapping info between update calls
-        Cyy = updateCyy(Cyy, Y, stimTimes, tau, wght, offset=offset, unitnorm=unitnorm, perY=perY, zeropadded=zeropadded)
+        Cyy = updateCyy(Cyy, Y, stimTimes, tau, wght, offset=offset, unitnorm=unitnorm, perY=perY, zeropadded=zeropadded, method=method, toeplitz=toeplitz)
         
     return Cxx, Cxy, Cyy
 
+def forgetting_weight(nSamp:int, halflife_samp:float=None):
+    '''
+    weight for the old summary statistics after nSamp new samples with the given half-life
+
+    Args:
+      nSamp (int): the number of new samples
+      halflife_samp (float): the half-life in samples, None for no forgetting.  Defaults to None.
+    Returns:
+      wght (float): the weight, alpha**nSamp with alpha = exp(log(.5)/halflife_samp)
+    '''
+    if halflife_samp is None or halflife_samp <= 0:
+        return 1
+    return float(np.exp(np.log(.5) * nSamp / halflife_samp))
+
+#@function
+def perTrialSummaryStatistics(X, Y, tau:int, offset:int=0, badEpThresh:float=4, method:str=None):
+    '''
+    Compute the raw, i.e. un-centered and un-normalized, summary statistics for each trial independently
+
+    The summary statistics for any subset of the trials can then be computed by summing the
+    per-trial statistics (or subtracting the excluded trials from the total), see `summaryStatisticsFromTrials`.
+    N.B. the bad-data removal is done once using all the trials.
+
+    Args:
+      X_TSd (nTrl, nSamp, d): raw response at sample rate
+      Y_TSye (nTrl, nSamp, nY, nE): event indicator at sample rate
+      tau (int): the length of the impulse response in samples
+      offset (int): relative shift of Y w.r.t. X
+      badEpThresh (float): threshold for removing bad-data before fitting the summary statistics
+      method (str): lagged cross-product method, one of 'loop','fft','auto'.  Defaults to LAGGED_METHOD.
+    Returns:
+      XX_Tdd (nTrl, d, d): per-trial data cross-product
+      sX_Td (nTrl, d): per-trial data sum
+      XY_Tyetd (nTrl, nY, nE, tau, d): per-trial un-centered ERPs
+      sY_Tye (nTrl, nY, nE): per-trial sum of the response window aligned events
+      YY_Ttyee (nTrl, tau, nY, nE, nE): per-trial diagonal Cyy entries
+      N_T (nTrl,): number of samples in each trial
+    '''
+    if X.ndim == 2:
+        X = X[np.newaxis, ...]
+    if Y.ndim == 3:
+        Y = Y[np.newaxis, ...]
+    tau = int(tau)
+    X, Y = zero_outliers(X, Y, badEpThresh)
+
+    XX_Tdd = np.einsum("TSd,TSe->Tde", X, X)
+    sX_Td = np.sum(X, axis=1)
+    # N.B. include a constant channel to get the sum of the window-aligned Y, for centering
+    X1 = np.concatenate((X, np.ones(X.shape[:-1]+(1,), dtype=X.dtype)), axis=-1)
+    XY_Tyetd = np.zeros((X.shape[0], Y.shape[-2], Y.shape[-1], tau, X.shape[-1]), dtype=X.dtype)
+    sY_Tye = np.zeros((X.shape[0], Y.shape[-2], Y.shape[-1]), dtype=X.dtype)
+    YY_Ttyee = np.zeros((X.shape[0], tau, Y.shape[-2], Y.shape[-1], Y.shape[-1]), dtype=np.float32 if not np.issubdtype(Y.dtype, np.floating) else Y.dtype)
+    for ti in range(X.shape[0]):
+        XY = updateCxy(None, X1[ti:ti+1, ...], Y[ti:ti+1, ...], None, tau, offset=offset, center=False, unitnorm=False, method=method)
+        XY_Tyetd[ti, ...] = XY[..., :-1]
+        sY_Tye[ti, ...] = XY[..., 0, -1]
+        YY_Ttyee[ti, ...] = compCyy_diag_perY(Y[ti:ti+1, ...], tau, unitnorm=False, method=method)
+    N_T = np.full((X.shape[0],), X.shape[1], dtype=int)
+    return XX_Tdd, sX_Td, XY_Tyetd, sY_Tye, YY_Ttyee, N_T
+
+#@function
+def summaryStatisticsFromTrials(stats, exclude_idx=None, center:bool=True, unitnorm:bool=True, toeplitz:bool=False):
+    '''
+    Compute the summary statistics (Cxx_dd, Cxy_yetd, Cyy_yetet) for a subset of trials from the per-trial statistics
+
+    Args:
+      stats (tuple): the per-trial statistics as returned by `perTrialSummaryStatistics`
+      exclude_idx (list-of-int, optional): the trials to leave out, e.g. the validation trials. Defaults to None.
+      center (bool): do we center the X data? (True)
+      unitnorm (bool): do we normalize by the number of samples? (True)
+      toeplitz (bool): return Cyy as a ToeplitzCyy, without expanding to the full matrix. (False)
+    Returns:
+      Cxx_dd (d,d) : data covariance
+      Cxy_yetd (nY, nE, tau, d) : per output ERPs
+      Cyy_yetet (nY, nE, tau, nE, tau): response covariance for each output
+      muX_d (d,) : the data mean
+    '''
+    # sum over trials, by removing the excluded trials from the total
+    XX, sX, XY, sY, YY, N = [np.sum(s, 0) for s in stats]
+    if exclude_idx is not None and len(exclude_idx) > 0:
+        XX, sX, XY, sY, YY, N = [tot - np.sum(s[exclude_idx, ...], 0) for tot, s in zip((XX, sX, XY, sY, YY, N), stats)]
+    N = max(1, N)
+    muX = sX / N
+    if center:
+        XX = XX - np.einsum("i,j->ij", sX, sX) / N
+        XY = XY - np.einsum("ye,d->yed", sY, muX)[..., np.newaxis, :]
+    if unitnorm:
+        XX = XX / N
+        XY = XY / N
+        YY = YY / N
+    return XX, XY, ToeplitzCyy(YY) if toeplitz else Cyy_diag2full(YY), muX
+
 #@function
 def updateCxx(Cxx, X, stimTimes=None, tau:int=None, wght:float=1, offset:int=0, center:bool=False, unitnorm:bool=True):
     '''
@@ -118,8 +229,65 @@ def updateCxx(Cxx, X, stimTimes=None, tau:int=None, wght:float=1, offset:int=0,
     Cxx = wght*Cxx + XX if Cxx is not None else XX
     return Cxx
 
+def use_fft(method:str, tau:int):
+    """resolve the lagged cross-product method to use, returns True if should use the FFT method"""
+    if method is None:
+        method = LAGGED_METHOD
+    if method == 'auto':
+        return tau >= FFT_MIN_TAU
+    if method not in ('loop', 'fft'):
+        raise ValueError("Unknown lagged cross-product method: {}".format(method))
+    return method == 'fft'
+
+def lagged_crossproduct(A_TSgk, B_TSgm, tau:int, nsum:int=None, dtype=None):
+    '''
+    Compute the cross-products of A with B for all lags 0..tau-1 at once
+
+    i.e. C[t,g,k,m] = \\sum_T \\sum_{s<nsum} A[T,s+t,g,k] B[T,s,g,m], with A zero after its end.
+    This is the Toeplitz structured part of the Cxy and Cyy matrices, which is computed by FFT
+    cross-correlation of overlapping blocks of tau samples, summed in the frequency domain.
+    Thus the cost is independent of tau, and the lagged copies of A are never made.
+
+    Args:
+      A_TSgk (nTrl, nSamp, g, k): the leading sequence
+      B_TSgm (nTrl, nSamp, g, m): the lagging sequence
+      tau (int): the number of lags to compute
+      nsum (int, optional): number of samples of B to sum over.  Defaults to nSamp.
+      dtype (np.dtype, optional): the type of the result.  Defaults to the type of A.
+    Returns:
+      C_tgkm (tau, g, k, m): the lagged cross-products
+    '''
+    nTrl, nSamp = A_TSgk.shape[:2]
+    nsum = B_TSgm.shape[1] if nsum is None else min(nsum, B_TSgm.shape[1])
+    if dtype is None:
+        dtype = A_TSgk.dtype
+    # work in float64 so the summed counts are exact for indicator Y
+    L = next_fast_len(max(4*tau, 64)) # fft length
+    blk = L - tau + 1 # samples of B in each block, so the wrap-around doesn't reach A
+    nblk = max(1, -(-nsum // blk))
+    # zero-pad to whole blocks
+    A = np.zeros((nTrl, (nblk-1)*blk+L)+A_TSgk.shape[2:], dtype=np.float64)
+    n = min(nSamp, A.shape[1])
+    A[:, :n, ...] = A_TSgk[:, :n, ...]
+    B = np.zeros((nTrl, nblk*blk)+B_TSgm.shape[2:], dtype=np.float64)
+    B[:, :nsum, ...] = B_TSgm[:, :nsum, ...]
+    Aw = window_axis(A, winsz=L, axis=1, step=blk) # (nTrl, nblk, L, g, k)
+    Bw = B.reshape((nTrl, nblk, blk)+B.shape[2:]) # (nTrl, nblk, blk, g, m)
+
+    # accumulate the cross-spectra over blocks, FFT_BLOCK_SIZE samples at a time
+    Cf = np.zeros((L//2+1, A.shape[-2], A.shape[-1], B.shape[-1]), dtype=np.complex128) # (F,g,k,m)
+    nc = max(1, FFT_BLOCK_SIZE // L)
+    blkidx = np.arange(nTrl*nblk)
+    for ci in range(0, blkidx.size, nc):
+        ti, bi = np.divmod(blkidx[ci:ci+nc], nblk)
+        FA = rfft(Aw[ti, bi, ...], axis=1)        # (c,F,g,k)
+        FB = rfft(Bw[ti, bi, ...], n=L, axis=1)   # (c,F,g,m)
+        Cf += FA.transpose((1, 2, 3, 0)) @ FB.conj().transpose((1, 2, 0, 3))
+    C = irfft(Cf, n=L, axis=0)[:tau, ...]
+    return C.astype(dtype)
+
 #@function
-def updateCxy(Cxy, X, Y, stimTimes=None, tau=None, wght=1, offset=0, center=False, verb=0, unitnorm=True):
+def updateCxy(Cxy, X, Y, stimTimes=None, tau=None, wght=1, offset=0, center=False, verb=0, unitnorm=True, method:str=None):
     '''
     Args:
         X_TSd (nTrl, nSamp, d): raw response at sample rate
@@ -127,6 +295,7 @@ def updateCxy(Cxy, X, Y, stimTimes=None, tau=None, wght=1, offset=0, center=Fals
         stimTimes_samp = (nTrl, nEp) sample times for start each epoch.  Used to detect
                 overlapping responses
         Cxy_yetd (nY, nE, tau, d): current per output ERPs
+        method (str): lagged cross-product method, one of 'loop','fft','auto'.  Defaults to LAGGED_METHOD.
 
     Returns:
         Cxy_yetd (nY, nE, tau, d): current per output ERPs
@@ -142,32 +311,45 @@ def updateCxy(Cxy, X, Y, stimTimes=None, tau=None, wght=1, offset=0, center=Fals
     if verb > 1: print("tau={}".format(tau))
     if stimTimes is None:
         # X, Y are at sample rate, slice X every sample
-        Xe = window_axis(X, winsz=tau, axis=-2) # (nTrl, nSamp, tau, d)
+        if X.ndim == 2:
+            X = X[np.newaxis, :, :]
+        nWin = X.shape[-2]-tau+1 # number of complete windows
         # shrink Y w.r.t. the window and shift to align with the offset
         if offset <=0 : # shift Y forwards
-            Ye = Y[:, -offset:Xe.shape[-3]-offset, :, :] # shift fowards and shrink
+            Ye = Y[:, -offset:nWin-offset, :, :] # shift fowards and shrink
             if offset < -tau: # zero pad to size
-                pad = np.zeros(Y.shape[:1]+(Xe.shape[-3]-Ye.shape[1],)+Y.shape[2:], dtype=Y.dtype)
+                pad = np.zeros(Y.shape[:1]+(nWin-Ye.shape[1],)+Y.shape[2:], dtype=Y.dtype)
                 Ye = np.append(Ye,pad,1)        
         elif offset>0: # shift and pad
-            Ye = Y[:, :Xe.shape[-3]-offset, :, :] # shrink
-            pad = np.zeros(Y.shape[:1]+(Xe.shape[-3]-Ye.shape[1],)+Y.shape[2:], dtype=Y.dtype)
+            Ye = Y[:, :nWin-offset, :, :] # shrink
+            pad = np.zeros(Y.shape[:1]+(nWin-Ye.shape[1],)+Y.shape[2:], dtype=Y.dtype)
             Ye = np.append(pad,Ye,1) # pad to shift forwards
 
+        if use_fft(method, tau):
+            # all lags at once, without making the windowed X
+            if verb > 1: print("X={}\nYe={}".format(X.shape, Ye.shape))
+            XY = lagged_crossproduct(X[..., np.newaxis, :], Ye.reshape(Ye.shape[:2]+(1,-1)), tau, nsum=nWin) # (tau,1,d,ye)
+            XY = XY[:, 0, ...].reshape((tau, X.shape[-1])+Ye.shape[-2:]).transpose((2, 3, 0, 1)) # (nY,nE,tau,d)
+            Xe = None
+        else:
+            Xe = window_axis(X, winsz=tau, axis=-2) # (nTrl, nSamp, tau, d)
+
     else:
         Xe = X
         Ye = Y
-    if Xe.ndim == 3:
-        Xe = Xe[np.newaxis, :, :, :]
 
-    if verb > 1: print("Xe={}\nYe={}".format(Xe.shape, Ye.shape))
+    if Xe is not None:
+        if Xe.ndim == 3:
+            Xe = Xe[np.newaxis, :, :, :]
 
-    # LOOPY version as einsum doens't manage the memory well...
-    XY = np.zeros( (Ye.shape[-2],Ye.shape[-1],Xe.shape[-2],Xe.shape[-1]), dtype=Xe.dtype)
-    for tau in range(Xe.shape[-2]):
-        XY[:,:,tau,:] = np.einsum("TSye, TSd->yed", Ye, Xe[:,:,tau,:], casting='unsafe', dtype=Xe.dtype)
+        if verb > 1: print("Xe={}\nYe={}".format(Xe.shape, Ye.shape))
 
-    #XY = np.einsum("TSye, TStd->yetd", Ye.reshape((-1,)+Ye.shape[-2:]), Xe.reshape((-1,)+Xe.shape[-2:]))
+        # LOOPY version as einsum doens't manage the memory well...
+        XY = np.zeros( (Ye.shape[-2],Ye.shape[-1],Xe.shape[-2],Xe.shape[-1]), dtype=Xe.dtype)
+        for t in range(Xe.shape[-2]):
+            XY[:,:,t,:] = np.einsum("TSye, TSd->yed", Ye, Xe[:,:,t,:], casting='unsafe', dtype=Xe.dtype)
+
+        #XY = np.einsum("TSye, TStd->yetd", Ye.reshape((-1,)+Ye.shape[-2:]), Xe.reshape((-1,)+Xe.shape[-2:]))
 
     if center:
         if verb > 1: print("center")
@@ -186,7 +368,7 @@ def updateCxy(Cxy, X, Y, stimTimes=None, tau=None, wght=1, offset=0, center=Fals
     return Cxy
 
 # @function
-def updateCyy(Cyy, Y, stimTime=None, tau=None, wght=1, offset:float=0, zeropadded=True, unitnorm=True, perY=True):
+def updateCyy(Cyy, Y, stimTime=None, tau=None, wght=1, offset:float=0, zeropadded=True, unitnorm=True, perY=True, method:str=None, toeplitz:bool=False):
     '''
     Compute the Cyy tensors given new data
     Args:
@@ -197,14 +379,18 @@ def updateCyy(Cyy, Y, stimTime=None, tau=None, wght=1, offset:float=0, zeropadde
       zeropadded (bool) : flag variable length Y are padded with 0s
       wght (float) : weighting for the new vs. old data
       unitnorm(bool) : flag if we normalize the Cyy with number epochs
+      method (str): lagged cross-product method, one of 'loop','fft','auto'.  Defaults to LAGGED_METHOD.
+      toeplitz (bool): return a ToeplitzCyy, i.e. without expanding the diagonal blocks.  Only for perY.
     Returns:
       Cyy_yetet (nY, tau, nE, nE):
     '''
     if perY:
-        MM = compCyy_diag_perY(Y,tau,unitnorm=unitnorm) # (tau, nY, nE, nE)
+        MM = compCyy_diag_perY(Y,tau,unitnorm=unitnorm,method=method) # (tau, nY, nE, nE)
     else:
-        MM = compCyy_diag(Y,tau,unitnorm=unitnorm) # (tau,nY,nE,nY,nE)
-    MM = Cyy_diag2full(MM) # (nY,nE,tau,nE,tau)
+        if toeplitz:
+            raise NotImplementedError("toeplitz Cyy only for perY")
+        MM = compCyy_diag(Y,tau,unitnorm=unitnorm,method=method) # (tau,nY,nE,nY,nE)
+    MM = ToeplitzCyy(MM) if toeplitz else Cyy_diag2full(MM) # (nY,nE,tau,nE,tau)
     Cyy = wght*Cyy + MM if Cyy is not None else MM
     return Cyy
 
@@ -219,19 +405,104 @@ def Cyy_diag2full(Cyy_tyee):
     """    
     # BODGE: tau-diag Cyy entries to the 'correct' shape
     # (tau,nY,nE,nE) -> (nY,nE,tau,nE,tau)
-    if Cyy_tyee.ndim == 3: # (tau,nE,nE) -> (tau,1,nE,nE)
+    squeeze = Cyy_tyee.ndim == 3
+    if squeeze: # (tau,nE,nE) -> (tau,1,nE,nE)
         Cyy_tyee = np.reshape(Cyy_tyee,(Cyy_tyee.shape[0],1,Cyy_tyee.shape[1],Cyy_tyee.shape[2]))
-    Cyy_yetet = np.zeros((Cyy_tyee.shape[-3],Cyy_tyee.shape[-2],Cyy_tyee.shape[-4],Cyy_tyee.shape[-2],Cyy_tyee.shape[-4]),dtype=Cyy_tyee.dtype) # (nY,nE,tau,nE,tau)
-    # fill in the block diagonal entries
-    for i in range(Cyy_tyee.shape[-4]):
-        Cyy_yetet[...,:,i,:,i] = Cyy_tyee[0,:,:,:]
-        for j in range(i+1,Cyy_tyee.shape[-4]):
-            Cyy_yetet[...,:,i,:,j] = Cyy_tyee[j-i,:,:,:]
-            Cyy_yetet[...,:,j,:,i] = Cyy_tyee[j-i,:,:,:].swapaxes(-2,-1) # transpose the event types
-    if Cyy_tyee.ndim==3: # ( 1,nE,tau,nE,tau) -> (nE,tau,nE,tau)
+    # Toeplitz structure: block (i,j) is lag |j-i|, with the event types transposed below the diagonal
+    i, j = np.meshgrid(np.arange(Cyy_tyee.shape[0]), np.arange(Cyy_tyee.shape[0]), indexing='ij')
+    Cyy_ttyee = Cyy_tyee[np.abs(j-i), ...] # (tau,tau,nY,nE,nE)
+    lower = i > j
+    Cyy_ttyee[lower] = Cyy_ttyee[lower].swapaxes(-2,-1) # transpose the event types
+    Cyy_yetet = np.ascontiguousarray(Cyy_ttyee.transpose((2,3,0,4,1))) # (nY,nE,tau,nE,tau)
+    if squeeze: # ( 1,nE,tau,nE,tau) -> (nE,tau,nE,tau)
         Cyy_yetet = Cyy_yetet[0,...]
     return Cyy_yetet
 
+
+class ToeplitzCyy:
+    '''
+    block-Toeplitz response covariance, stored as just the tau diagonal blocks
+
+    Equivalent to the full Cyy_yetet = Cyy_diag2full(Cyy_tyee), which is only made when needed,
+    e.g. with np.asarray(Cyy).  Use `multipleCCA.block_toeplitz_whitener` to whiten it directly.
+
+    Args:
+      Cyy_tyee (tau, nY, nE, nE) or (tau, nE, nE): the lag diagonal blocks, as from `compCyy_diag_perY`
+    '''
+    def __init__(self, Cyy_tyee):
+        self.Cyy_tyee = Cyy_tyee
+
+    @property
+    def shape(self):
+        """the shape of the equivalent full Cyy, i.e. (nY, nE, tau, nE, tau) or (nE, tau, nE, tau)"""
+        tau, nE = self.Cyy_tyee.shape[0], self.Cyy_tyee.shape[-1]
+        return self.Cyy_tyee.shape[1:-2] + (nE, tau, nE, tau)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def dtype(self):
+        return self.Cyy_tyee.dtype
+
+    def __repr__(self):
+        return "ToeplitzCyy{}".format(self.shape)
+
+    def __getitem__(self, idx):
+        """the Cyy for output idx, N.B. only the output dim can be indexed"""
+        if isinstance(idx, tuple): # e.g. Cyy[mi, :, :]
+            if any(not i == slice(None) for i in idx[1:]):
+                raise IndexError("Only the output dim can be indexed")
+            idx = idx[0]
+        if self.Cyy_tyee.ndim < 4:
+            raise IndexError("No output dim to index")
+        return ToeplitzCyy(self.Cyy_tyee[:, idx, ...])
+
+    def full(self):
+        """expand to the full Cyy_yetet"""
+        return Cyy_diag2full(self.Cyy_tyee)
+
+    def __array__(self, dtype=None, copy=None):
+        Cyy = self.full()
+        return Cyy if dtype is None else Cyy.astype(dtype)
+
+    def __add__(self, other):
+        return ToeplitzCyy(self.Cyy_tyee + other.Cyy_tyee)
+
+    def __sub__(self, other):
+        return ToeplitzCyy(self.Cyy_tyee - other.Cyy_tyee)
+
+    def __mul__(self, alpha):
+        return ToeplitzCyy(self.Cyy_tyee * alpha)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, alpha):
+        return ToeplitzCyy(self.Cyy_tyee / alpha)
+
+    def __matmul__(self, B):
+        """
+        matrix product with the equivalent 2d Cyy, one block diagonal at a time
+
+        Args:
+          B ((nY,) nE*tau, k): the matrix to multiply, with rows in (nE,tau) order
+        Returns:
+          CB ((nY,) nE*tau, k): the product
+        """
+        C = self.Cyy_tyee if self.Cyy_tyee.ndim > 3 else self.Cyy_tyee[:, np.newaxis, ...] # (tau,nY,nE,nE)
+        tau, nE, k = C.shape[0], C.shape[-1], B.shape[-1]
+        Bndim = np.ndim(B)
+        B = np.reshape(B, (-1, nE, tau*k)) # (nY,nE,tau*k)
+        CB = np.zeros(np.broadcast_shapes(C.shape[1:2], B.shape[:1])+B.shape[1:], dtype=np.result_type(C, B))
+        CB += C[0] @ B
+        for t in range(1, tau): # upper diagonal, and it's transpose below
+            CB[..., :-t*k] += C[t] @ B[..., t*k:]
+            CB[..., t*k:] += C[t].swapaxes(-1, -2) @ B[..., :-t*k]
+        CB = CB.reshape(CB.shape[:1]+(nE*tau, k))
+        return CB if Bndim > 2 or self.Cyy_tyee.ndim > 3 else CB[0, ...]
+
+
 def compCxx_diag(X_TSd, tau:float, offset:float=0, unitnorm:bool=True, center:bool=False):
     '''
     Compute the main tau diagonal entries of a Cyy tensor
@@ -554,7 +825,7 @@ def test_compCyx_diag():
     plt.suptitle('Cyx_tyefd')
     plt.show()
 
-def compCyy_diag_perY(Y, tau:float, unitnorm:bool=True, perY:bool=True):
+def compCyy_diag_perY(Y, tau:float, unitnorm:bool=True, perY:bool=True, method:str=None):
     '''
     Compute the main tau diagonal entries of a Cyy tensor for each output independently
     Args:
@@ -563,19 +834,22 @@ def compCyy_diag_perY(Y, tau:float, unitnorm:bool=True, perY:bool=True):
                nE=#event-types  nY=#possible-outputs  nEpoch=#stimulus events to process
       tau (int): number of samples in the stimulus response
       unitnorm(bool) : flag if we normalize the Cyy with number epochs. Defaults to True.
+      method (str): lagged cross-product method, one of 'loop','fft','auto'.  Defaults to LAGGED_METHOD.
     Returns:
       Cyy_tyee (tau, nY, nE, nE):
     '''
     if Y.ndim == 3:  # ensure is 4-d
         Y = Y[np.newaxis, :, :, :] # (nTrl, nEp/nSamp, nY, nE)
 
-    if not np.issubdtype(Y.dtype, np.floating): # all at once
-        Y = Y.astype(np.float32)
-
-    Cyy_tyee = np.zeros((tau,Y.shape[-2],Y.shape[-1],Y.shape[-1]),dtype=Y.dtype) # tau,y,e,e
-    Cyy_tyee[0,...] = np.einsum('TSye,TSyf->yef',Y,Y) # special case as python makes :end+1 hard ...
-    for t in range(1,tau): # manually slide over Y -- as einsum doesn't manage the memory well
-        Cyy_tyee[t,...] = np.einsum('TSye,TSyf->yef',Y[:,t:,:,:],Y[:,:-t,:,:])
+    dtype = Y.dtype if np.issubdtype(Y.dtype, np.floating) else np.float32
+    if use_fft(method, tau):
+        Cyy_tyee = lagged_crossproduct(Y, Y, tau, dtype=dtype) # tau,y,e,e
+    else:
+        Y = Y.astype(dtype, copy=False) # all at once
+        Cyy_tyee = np.zeros((tau,Y.shape[-2],Y.shape[-1],Y.shape[-1]),dtype=Y.dtype) # tau,y,e,e
+        Cyy_tyee[0,...] = np.einsum('TSye,TSyf->yef',Y,Y) # special case as python makes :end+1 hard ...
+        for t in range(1,tau): # manually slide over Y -- as einsum doesn't manage the memory well
+            Cyy_tyee[t,...] = np.einsum('TSye,TSyf->yef',Y[:,t:,:,:],Y[:,:-t,:,:])
 
     if unitnorm:
         # normalize so the resulting constraint on the estimated signal is that it have
@@ -583,7 +857,7 @@ def compCyy_diag_perY(Y, tau:float, unitnorm:bool=True, perY:bool=True):
         Cyy_tyee = Cyy_tyee / (Y.shape[0]*Y.shape[1]) # / nTrl*nEp
     return Cyy_tyee
 
-def compCyy_diag(Y, tau:float, unitnorm:bool=True):
+def compCyy_diag(Y, tau:float, unitnorm:bool=True, method:str=None):
     '''
     Compute the main tau diagonal entries of a Cyy tensor
     Args:
@@ -592,19 +866,24 @@ def compCyy_diag(Y, tau:float, unitnorm:bool=True):
                nE=#event-types  nY=#possible-outputs  nEpoch=#stimulus events to process
       tau (int): number of samples in the stimulus response
       unitnorm(bool) : flag if we normalize the Cyy with number epochs. Defaults to True.
+      method (str): lagged cross-product method, one of 'loop','fft','auto'.  Defaults to LAGGED_METHOD.
     Returns:
       Cyy_tyeye (tau,nY,nE,nY,nE):
     '''
     if Y.ndim == 3:  # ensure is 4-d
         Y = Y[np.newaxis, :, :, :] # (nTrl, nEp/nSamp, nY, nE)
 
-    if not np.issubdtype(Y.dtype, np.floating): # all at once
-        Y = Y.astype(np.float32)
-
-    Cyy_tyeye = np.zeros((tau,Y.shape[-2],Y.shape[-1],Y.shape[-2],Y.shape[-1]),dtype=Y.dtype) # tau,y,e,y,e
-    Cyy_tyeye[0,...] = np.einsum('TSye,TSzf->yezf',Y,Y) # special case as python makes :end+1 hard ...
-    for t in range(1,tau): # manually slide over Y -- as einsum doesn't manage the memory well
-        Cyy_tyeye[t,...] = np.einsum('TSye,TSzf->yezf',Y[:,t:,:,:],Y[:,:-t,:,:])
+    dtype = Y.dtype if np.issubdtype(Y.dtype, np.floating) else np.float32
+    if use_fft(method, tau):
+        # all outputs as one group
+        Yg = Y.reshape(Y.shape[:2]+(1,-1))
+        Cyy_tyeye = lagged_crossproduct(Yg, Yg, tau, dtype=dtype).reshape((tau,)+Y.shape[-2:]+Y.shape[-2:]) # tau,y,e,y,e
+    else:
+        Y = Y.astype(dtype, copy=False) # all at once
+        Cyy_tyeye = np.zeros((tau,Y.shape[-2],Y.shape[-1],Y.shape[-2],Y.shape[-1]),dtype=Y.dtype) # tau,y,e,y,e
+        Cyy_tyeye[0,...] = np.einsum('TSye,TSzf->yezf',Y,Y) # special case as python makes :end+1 hard ...
+        for t in range(1,tau): # manually slide over Y -- as einsum doesn't manage the memory well
+            Cyy_tyeye[t,...] = np.einsum('TSye,TSzf->yezf',Y[:,t:,:,:],Y[:,:-t,:,:])
 
     if unitnorm:
         # normalize so the resulting constraint on the estimated signal is that it have
@@ -622,19 +901,12 @@ def Cyy_tyeye_diag2full(Cyy_tyeye):
     Returns:
         Cyy_yetyet: the expanded version of Cyy
     """    
-    t=Cyy_tyeye.shape[0]
-    y=Cyy_tyeye.shape[1]
-    e=Cyy_tyeye.shape[2]
-    
-    Cyy_yetyet = np.zeros((y,e,t,y,e,t),dtype=Cyy_tyeye.dtype)
-    # fill in the block diagonal entries
-    for i in range(t):
-        Cyy_yetyet[:,:,i,:,:,i] = Cyy_tyeye[0,:,:,:,:]
-        for j in range(i+1,t):
-            Cyy_yetyet[:,:,i,:,:,j] = Cyy_tyeye[j-i,:,:,:,:]
-            # lower diag, transpose the event types
-            Cyy_yetyet[:,:,j,:,:,i] = Cyy_tyeye[j-i,:,:,:,:].swapaxes(-3,-1).swapaxes(-4,-2)
-    return Cyy_yetyet
+    # Toeplitz structure: block (i,j) is lag |j-i|, with the (y,e) pairs transposed below the diagonal
+    i, j = np.meshgrid(np.arange(Cyy_tyeye.shape[0]), np.arange(Cyy_tyeye.shape[0]), indexing='ij')
+    Cyy_ttyeye = Cyy_tyeye[np.abs(j-i), ...] # (tau,tau,nY,nE,nY,nE)
+    lower = i > j
+    Cyy_ttyeye[lower] = Cyy_ttyeye[lower].transpose((0,3,4,1,2))
+    return np.ascontiguousarray(Cyy_ttyeye.transpose((2,3,0,4,5,1))) # (nY,nE,tau,nY,nE,tau)
 
 def Cyy_yetet_diag2full(Cyy_yetet):
     """[summary]
@@ -1411,6 +1683,23 @@ def testCases():
     plt.figure(3);plt.clf();plot_erp(Cxy);plt.show()
 
     
+def benchmark_lagged_methods(taus=(5,10,20,45,90), ds=(4,32,64), nTrl=10, nSamp=1000, nY=36, nE=2, number=3):
+    """time the loop vs. fft computation of the lagged cross-products (Cxy,Cyy) over a range of tau and d"""
+    import timeit
+    rng = np.random.default_rng(0)
+    Y = (rng.random((nTrl, nSamp, nY, nE)) < .1).astype(np.uint8)
+    print("{:>4s} {:>4s} {:>10s} {:>10s} {:>10s} {:>10s} {:>8s}".format('tau','d','Cxy loop','Cxy fft','Cyy loop','Cyy fft','maxerr'))
+    for d in ds:
+        X = rng.standard_normal((nTrl, nSamp, d)).astype(np.float32)
+        for tau in taus:
+            t = dict()
+            for m in ('loop', 'fft'):
+                t['Cxy'+m] = timeit.timeit(lambda: updateCxy(None, X, Y, tau=tau, method=m), number=number)/number
+                t['Cyy'+m] = timeit.timeit(lambda: updateCyy(None, Y, tau=tau, method=m), number=number)/number
+            Cxy = updateCxy(None, X, Y, tau=tau, method='loop')
+            err = np.max(np.abs(updateCxy(None, X, Y, tau=tau, method='fft') - Cxy)) / np.max(np.abs(Cxy))
+            print("{:4d} {:4d} {:10.4f} {:10.4f} {:10.4f} {:10.4f} {:8.1e}".format(tau, d, t['Cxyloop'], t['Cxyfft'], t['Cyyloop'], t['Cyyfft'], err))
+
 if __name__=="__main__":
     test_compCyx_diag()
     testComputationMethods()
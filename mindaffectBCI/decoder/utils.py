@@ -16,6 +16,8 @@
 # along with pymindaffectBCI.  If not, see <http://www.gnu.org/licenses/>
 
 import numpy as np
+import copy
+from array import array
 
 # time-series tests
 def window_axis(a, winsz, axis=0, step=1, prependwindowdim=False):
@@ -58,8 +60,20 @@ def equals_subarray(a, pat, axis=-1, match=-1):
 
 
 class RingBuffer:
-    ''' time efficient linear ring-buffer for storing packed data, e.g. continguous np-arrays '''
-    def __init__(self, maxsize, shape, dtype=np.float32):
+    ''' time efficient linear ring-buffer for storing packed data, e.g. continguous np-arrays 
+    
+    If timestamp_channel is given then a monotone (i.e. un-wrapped) copy of this channel is also 
+    kept, so segments can be found by binary search, see `extract_ringbuffer_segment`.
+
+    If ts_dtype is given then the time-stamps are stored in their own array of this type,
+    (rather than as a channel of the data), and must be given when adding data, i.e. `extend(x,ts)`.
+    This allows, e.g. float32 data or uint8 stimulus state with int64/float64 time-stamps.
+
+    With a single writer thread, readers in other threads can use `snapshot` to get a consistent
+    lock-free view of the buffer, and `snapshot_valid` to check it was not over-written while reading.
+    N.B. nflip works as a seqlock, it is odd while a flip is over-writing old data and even otherwise.
+    '''
+    def __init__(self, maxsize, shape, dtype=np.float32, timestamp_channel:int=None, timestamp_wrap:float=None, ts_dtype=None):
         self.elementshape = shape
         self.bufshape = (int(maxsize), )+shape
         self.buffer = np.zeros((2*int(maxsize), np.prod(shape)), dtype=dtype) # store as 2d
@@ -68,6 +82,18 @@ class RingBuffer:
         self.n = 0 # count of total number elements added to the buffer
         self.copypos = 0 # position of the last element copied to the 1st half
         self.copysize = 0 # number entries to copy as a block
+        # monotone time-stamp index
+        self.timestamp_channel = timestamp_channel
+        self.timestamp_wrap = timestamp_wrap
+        self.ts_dtype = ts_dtype
+        if timestamp_channel is not None or ts_dtype is not None:
+            self.tsbuffer = np.zeros((2*int(maxsize),), dtype=ts_dtype if ts_dtype is not None else np.float64)
+        else:
+            self.tsbuffer = None
+        self.ts_offset = 0 # accumulated wrap-around offset
+        self.last_ts = None # last raw time-stamp added
+        self.nflip = 0 # seqlock count of the copies to the 1st half, which invalidate older snapshots
+        self.state_ = (self.pos, self.n, self.nflip) # published cursor state for readers
 
     def clear(self):
         '''empty the ring-buffer and reset to empty'''
@@ -75,30 +101,85 @@ class RingBuffer:
         self.n  =0
         self.copypos=0
         self.copysize=0
-
-    def append(self, x):
-        '''add single element to the ring buffer'''
-        return self.extend(x[np.newaxis, ...])
+        self.ts_offset=0
+        self.last_ts=None
+        self.nflip = self.nflip + 2 # N.B. keep even, as not in a flip
+        self.state_ = (self.pos, self.n, self.nflip)
+
+    def append(self, x, ts=None):
+        '''add single element (with it's time-stamp) to the ring buffer'''
+        return self.extend(x[np.newaxis, ...], None if ts is None else np.array((ts,)))
     
-    def extend(self, x):
-        '''add a group of elements to the ring buffer'''
+    def extend(self, x, ts=None):
+        '''add a group of elements (with their time-stamps) to the ring buffer'''
         # TODO[] : incremental copy to the 1st half, to spread the copy cost?
         nx = x.shape[0]
         if self.pos+nx >= self.buffer.shape[0]:
+            # N.B. the copy itself doesn't touch the valid region, but the following insert does,
+            # so publish the (odd) flip *before* writing, to invalidate any snapshots being read,
+            # and mark it finished (even) after the insert
+            self.nflip = self.nflip + 1
+            self.state_ = (self.pos, self.n, self.nflip)
             flippos = self.buffer.shape[0]//2
             # flippos-nx to 1st half
             self.buffer[:(flippos-nx), :] = self.buffer[(self.pos-(flippos-nx)):self.pos, :]
+            if self.tsbuffer is not None:
+                self.tsbuffer[:(flippos-nx)] = self.tsbuffer[(self.pos-(flippos-nx)):self.pos]
             # move cursor to end 1st half
             self.pos = flippos-nx
 
         # insert in the buffer
         self.buffer[self.pos:self.pos+nx, :] =  x.reshape((nx, self.buffer.shape[1]))
+        if self.tsbuffer is not None and nx > 0:
+            if ts is None:
+                if self.timestamp_channel is None:
+                    raise ValueError("time-stamps must be given for a separate time-stamp ring buffer")
+                ts = self.buffer[self.pos:self.pos+nx, self.timestamp_channel]
+            self.tsbuffer[self.pos:self.pos+nx] = self.unwrap_timestamps(ts)
         # move the cursor
         self.pos = self.pos+nx
         # update the count
         self.n = self.n + nx
+        # end the flip, N.B. invalidates any snapshots taken during it
+        if self.nflip % 2:
+            self.nflip = self.nflip + 1
+        # publish the new state, as a single atomic update
+        self.state_ = (self.pos, self.n, self.nflip)
         return self
-    
+
+    def snapshot(self):
+        '''get a consistent read-only view of the ring buffer as of the last completed insert
+
+        N.B. this shares the buffer storage, so is only valid as long as `snapshot_valid` is True.
+        '''
+        snap = copy.copy(self)
+        snap.pos, snap.n, snap.nflip = self.state_
+        return snap
+
+    def snapshot_valid(self, snap):
+        '''check if the data in a snapshot is still valid, i.e. has not been over-written since it was taken'''
+        # N.B. snapshots taken during a flip, i.e. odd nflip, are never valid
+        return snap.nflip % 2 == 0 and self.state_[2] == snap.nflip
+
+    def unwrap_timestamps(self, ts):
+        '''map a new block of raw time-stamps to monotone time-stamps, tracking the wrap-around'''
+        ts = np.asarray(ts, dtype=self.tsbuffer.dtype)
+        if self.timestamp_wrap is not None:
+            # count the wraps = large backwards steps
+            prev = np.append(ts[0] if self.last_ts is None else self.last_ts, ts[:-1])
+            nwrap = np.cumsum(ts - prev < -self.timestamp_wrap/2)
+            self.last_ts = ts[-1]
+            ts = ts + (self.ts_offset + nwrap*self.timestamp_wrap)
+            self.ts_offset = self.ts_offset + nwrap[-1]*self.timestamp_wrap
+        return ts
+
+    def timestamp2monotone(self, ts):
+        '''map a (wrapped) query time-stamp to the monotone time-stamps, assuming it is within half a wrap of the most recent entry'''
+        if self.timestamp_wrap is None or self.n == 0:
+            return ts
+        last = self.tsbuffer[self.pos-1]
+        return ts + self.timestamp_wrap * np.round((last - ts)/self.timestamp_wrap)
+
     @property
     def shape(self):
         return (min(self.n,self.bufshape[0]),)+self.bufshape[1:]
@@ -107,36 +188,111 @@ class RingBuffer:
         '''get a view on the valid portion of the ring buffer'''
         return self.buffer[self.pos-min(self.n,self.bufshape[0]):self.pos, :].reshape(self.shape)
 
+    def unwrap_ts(self):
+        '''get a view on the valid portion of the monotone time-stamp index'''
+        return self.tsbuffer[self.pos-min(self.n,self.bufshape[0]):self.pos]
+
+    def with_timestamps(self, item=slice(None)):
+        '''get a copy of the selected elements with their time-stamps as an extra last channel, i.e. the single array layout'''
+        if self.ts_dtype is None: # time-stamps are already in the data
+            return self.unwrap()[item]
+        X = self.unwrap()[item]
+        X = X.reshape(X.shape[:1]+(-1,))
+        X_ts = self.unwrap_ts()[item]
+        Xts = np.empty(X.shape[:1]+(X.shape[1]+1,), dtype=np.result_type(X.dtype, X_ts.dtype))
+        Xts[:, :-1] = X
+        Xts[:, -1] = X_ts
+        return Xts
+
     def __getitem__(self, item):
         return self.unwrap()[item]
 
     def __iter__(self):
         return iter(self.unwrap())
 
-def extract_ringbuffer_segment(rb, bgn_ts, end_ts=None):
-    ''' extract the data between start/end time stamps, from time-stamps contained in the last channel of a nd matrix'''
-    # get the data / msgs from the ringbuffers
-    X = rb.unwrap() # (nsamp,nch+1)
-    X_ts = X[:, -1] # last channel is timestamps
-    # TODO: binary-search to make these searches more efficient!
-    # search backwards for trial-start time-stamp
-    # TODO[X] : use a bracketing test.. (better with wrap-arround)
-    bgn_samp = np.flatnonzero(np.logical_and(X_ts[:-1] < bgn_ts, bgn_ts <= X_ts[1:]))
-    # get the index of this timestamp, guarding for after last sample
-    if len(bgn_samp) == 0 :
-        bgn_samp = 0 if bgn_ts <= X_ts[0] else len(X_ts)+1
+def ringbuffer_segment_slice(rb, bgn_ts, end_ts=None):
+    ''' get the slice of the ring buffer between start/end time-stamps, 
+    from time-stamps contained in the last channel of a nd matrix or in the ring buffers time-stamp index
+
+    Note: if the ring buffer has a monotone time-stamp index this is an O(log n) binary search.
+
+    Args:
+        rb (RingBuffer): the ring buffer to search
+        bgn_ts (float): segment start time-stamp
+        end_ts (float, optional): segment end time-stamp. Defaults to None, i.e. until now.
+
+    Returns:
+        slice: the slice of `rb.unwrap()` with this data
+    '''
+    if getattr(rb, 'tsbuffer', None) is not None:
+        # binary search in the monotone time-stamps
+        X_ts = rb.unwrap_ts()
+        # index of last sample before bgn_ts, guarding for before first/after last sample
+        bgn_samp = np.searchsorted(X_ts, rb.timestamp2monotone(bgn_ts), side='left')
+        bgn_samp = len(X_ts)+1 if bgn_samp == len(X_ts) else max(0, bgn_samp-1)
+        if end_ts is not None:
+            # index of last sample before end_ts, guarding for after last data sample
+            end_samp = np.searchsorted(X_ts, rb.timestamp2monotone(end_ts), side='left') - 1
+            end_samp = end_samp if 0 <= end_samp < len(X_ts)-1 else len(X_ts)
+        else: # until now
+            end_samp = len(X_ts)
     else:
-        bgn_samp = bgn_samp[0]
-    # and just to be sure the trial-end timestamp
-    if  end_ts is not None:
-        end_samp = np.flatnonzero(np.logical_and(X_ts[:-1] < end_ts, end_ts <= X_ts[1:]))
-        # get index of this timestamp, guarding for after last data sample
-        end_samp = end_samp[-1] if len(end_samp) > 0 else len(X_ts)
-    else: # until now
-        end_samp = len(X_ts)
-    # extract the trial data, and make copy (just to be sure)
-    X = X[bgn_samp:end_samp+1, :].copy()
-    return X
+        X_ts = rb.unwrap()[:, -1] # last channel is timestamps
+        # search backwards for trial-start time-stamp
+        # TODO[X] : use a bracketing test.. (better with wrap-arround)
+        bgn_samp = np.flatnonzero(np.logical_and(X_ts[:-1] < bgn_ts, bgn_ts <= X_ts[1:]))
+        # get the index of this timestamp, guarding for after last sample
+        if len(bgn_samp) == 0 :
+            bgn_samp = 0 if bgn_ts <= X_ts[0] else len(X_ts)+1
+        else:
+            bgn_samp = bgn_samp[0]
+        # and just to be sure the trial-end timestamp
+        if  end_ts is not None:
+            end_samp = np.flatnonzero(np.logical_and(X_ts[:-1] < end_ts, end_ts <= X_ts[1:]))
+            # get index of this timestamp, guarding for after last data sample
+            end_samp = end_samp[-1] if len(end_samp) > 0 else len(X_ts)
+        else: # until now
+            end_samp = len(X_ts)
+    return slice(bgn_samp, end_samp+1)
+
+def extract_ringbuffer_segment(rb, bgn_ts, end_ts=None, copy:bool=True):
+    ''' extract the data between start/end time stamps, from time-stamps contained in the last channel of a nd matrix
+
+    Note: for a separate time-stamp ring buffer the time-stamps are appended as the last channel, 
+    so this is always a copy.  Use `extract_ringbuffer_segment_ts` to avoid this.
+
+    Args:
+        rb (RingBuffer): the ring buffer to extract from
+        bgn_ts (float): segment start time-stamp
+        end_ts (float, optional): segment end time-stamp. Defaults to None, i.e. until now.
+        copy (bool, optional): return a copy of the data.  If False return a view on the ring buffer, which is only valid until the next time it is extended.  Defaults to True.
+
+    Returns:
+        (np.ndarray): the data between these time-stamps, with time-stamps in the last channel
+    '''
+    idx = ringbuffer_segment_slice(rb, bgn_ts, end_ts)
+    if getattr(rb, 'ts_dtype', None) is not None:
+        return rb.with_timestamps(idx)
+    # extract the trial data, and make copy if wanted
+    X = rb.unwrap()[idx, :]
+    return X.copy() if copy else X
+
+def extract_ringbuffer_segment_ts(rb, bgn_ts, end_ts=None, copy:bool=True):
+    ''' extract the data and it's time-stamps between start/end time stamps from a separate time-stamp ring buffer
+
+    Args:
+        rb (RingBuffer): the ring buffer to extract from
+        bgn_ts (float): segment start time-stamp
+        end_ts (float, optional): segment end time-stamp. Defaults to None, i.e. until now.
+        copy (bool, optional): return a copy of the data.  If False return views on the ring buffer, which are only valid until the next time it is extended.  Defaults to True.
+
+    Returns:
+        X (np.ndarray): the data between these time-stamps
+        X_ts (np.ndarray): the time-stamps for each element of X
+    '''
+    idx = ringbuffer_segment_slice(rb, bgn_ts, end_ts)
+    X, X_ts = rb.unwrap()[idx], rb.unwrap_ts()[idx]
+    return (X.copy(), X_ts.copy()) if copy else (X, X_ts)
 
 def unwrap(x,range=None):
     ''' unwrap a list of numbers to correct for truncation due to limited bit-resolution, e.g. time-stamps stored in 24bit integers'''
@@ -160,6 +316,118 @@ def unwrap_test():
     plt.legend()
 
 
+def test_extract_ringbuffer_segment(nsamp=50000, maxsize=5000, pktsize=7, wrap=1<<16):
+    ''' check the binary-search segment extraction matches the linear-scan version, including with time-stamp wrap-around '''
+    import time
+    rb = RingBuffer(maxsize, (3,), timestamp_channel=-1, timestamp_wrap=wrap)
+    rb_lin = RingBuffer(maxsize, (3,))
+    ts = np.cumsum(np.random.randint(3, 5, size=nsamp)) % wrap
+    X = np.concatenate((np.random.randn(nsamp, 2), ts[:, np.newaxis]), 1).astype(np.float32)
+    tbin, tlin = 0, 0
+    for i in range(0, nsamp, pktsize):
+        rb.extend(X[i:i+pktsize, :])
+        rb_lin.extend(X[i:i+pktsize, :])
+        # test a segment not containing the wrap-around
+        X_ts = rb_lin[:, -1]
+        bgn = np.random.randint(0, rb.shape[0])
+        end = bgn + np.random.randint(0, 200)
+        if end >= len(X_ts) or np.any(np.diff(X_ts[bgn:end+1]) < 0) or X_ts[bgn] < X_ts[0]:
+            continue
+        bgn_ts, end_ts = X_ts[bgn] + 1, X_ts[end]
+        t0 = time.perf_counter()
+        Xb = extract_ringbuffer_segment(rb, bgn_ts, end_ts, copy=False)
+        t1 = time.perf_counter()
+        Xl = extract_ringbuffer_segment(rb_lin, bgn_ts, end_ts)
+        t2 = time.perf_counter()
+        tbin, tlin = tbin + t1 - t0, tlin + t2 - t1
+        assert Xb.shape == Xl.shape and np.all(Xb == Xl), "segment mismatch {}->{}".format(bgn_ts, end_ts)
+    print("extract_ringbuffer_segment: binary-search {}s, linear-scan {}s".format(tbin, tlin))
+
+    # separate time-stamp ring-buffer, with large time-stamps
+    rb_sep = RingBuffer(maxsize, (2,), dtype=np.uint8, ts_dtype=np.float64)
+    ts = np.cumsum(np.random.randint(3, 5, size=nsamp)) + float(1<<31)
+    for i in range(0, nsamp, pktsize):
+        rb_sep.extend(X[i:i+pktsize, :2].astype(np.uint8), ts[i:i+pktsize])
+    X_ts = rb_sep.unwrap_ts()
+    Xs, Xs_ts = extract_ringbuffer_segment_ts(rb_sep, X_ts[10]+1, X_ts[110], copy=False)
+    assert Xs.dtype == np.uint8 and Xs.shape[0] == 100 and np.all(Xs_ts == X_ts[10:110])
+    Xc = extract_ringbuffer_segment(rb_sep, X_ts[10]+1, X_ts[110])
+    assert np.all(Xc[:, :-1] == Xs) and np.all(Xc[:, -1] == Xs_ts)
+
+
+def test_ringbuffer_snapshot_threaded(maxsize=20, pktsize=(1,20), duration_s:float=3):
+    ''' stress test the lock-free snapshot reads with a concurrent writer thread
+
+    The writer adds a counter, so a consistent read is a run of consecutive values ending at the snapshot count.
+    N.B. use a separate time-stamp buffer, as the time-stamp unwrapping gives the writer a chance to be interrupted
+    between the insert and publishing the new state.
+    '''
+    import sys
+    import threading
+    import time
+    rb = RingBuffer(maxsize, (1,), dtype=np.float64, ts_dtype=np.float64)
+    # switch threads often, to hit the races
+    switchinterval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    done = threading.Event()
+    def writer():
+        i = 0
+        t0 = time.perf_counter()
+        while time.perf_counter()-t0 < duration_s:
+            nx = np.random.randint(*pktsize)
+            x = np.arange(i, i+nx, dtype=np.float64)
+            rb.extend(x[:, np.newaxis], x)
+            i = i + nx
+        done.set()
+    thread = threading.Thread(target=writer, daemon=True)
+    thread.start()
+    nread, nretry, ntorn = 0, 0, 0
+    while not done.is_set():
+        snap = rb.snapshot()
+        X = snap.unwrap().copy()
+        if not rb.snapshot_valid(snap):
+            nretry = nretry + 1
+            continue
+        nread = nread + 1
+        if X.shape[0] > 0 and not (X[-1, 0] == snap.n-1 and np.all(np.diff(X[:, 0]) == 1)):
+            ntorn = ntorn + 1
+    thread.join()
+    sys.setswitchinterval(switchinterval)
+    print("RingBuffer snapshots: {} reads, {} retries, {} torn".format(nread, nretry, ntorn))
+    assert ntorn == 0, "torn snapshot reads"
+
+
+def test_ringbuffer_snapshot_flip(maxsize=20, pktsize=7):
+    ''' deterministic check of the snapshots taken during an extend, e.g. between publishing a flip and the insert
+
+    The buffer storage is hooked to take a snapshot just before every write to it, and the snapshots which
+    are still valid after the extend must hold the same consistent run of counter values as when they were taken.
+    '''
+    rb = RingBuffer(maxsize, (1,), dtype=np.float64)
+    snaps = []
+    class HookedArray(np.ndarray):
+        def __setitem__(self, item, value):
+            snap = rb.snapshot()
+            snaps.append((snap, snap.unwrap().copy()))
+            super().__setitem__(item, value)
+    rb.buffer = rb.buffer.view(HookedArray)
+    nflips, nvalid = 0, 0
+    for i in range(0, 10*maxsize, pktsize):
+        snaps.clear()
+        nflip = rb.nflip
+        rb.extend(np.arange(i, i+pktsize, dtype=np.float64)[:, np.newaxis])
+        nflips = nflips + (rb.nflip > nflip)
+        for snap, X in snaps:
+            if not rb.snapshot_valid(snap):
+                continue
+            nvalid = nvalid + 1
+            Xnow = snap.unwrap()
+            assert np.all(Xnow == X), "valid snapshot over-written"
+            assert Xnow.shape[0] == 0 or (Xnow[-1, 0] == snap.n-1 and np.all(np.diff(Xnow[:, 0]) == 1)), "torn snapshot"
+    assert nflips > 0
+    print("RingBuffer snapshots during extend: {} flips, {} valid snapshots".format(nflips, nvalid))
+
+
 def search_directories_for_file(f,*args):
     """search a given set of directories for given filename, return 1st match
 
@@ -719,14 +987,30 @@ def sosfilt_2d_py(sos,X,axis=-2,zi=None):
         if sos[j,3] != 1.0:
             sos[j,:] = sos[j,:]/sos[j,3]
     
-    n_signals = X.shape[1]
-    n_samples = X.shape[0]
-    n_sections = sos.shape[0]
-
     # extract the a/b
     b = sos[:,:3]
     a = sos[:,4:]
 
+    # filter in-place with the fastest available backend
+    _sosfilt_2d_kernel(b, a, X, zi)
+
+    # back to input shape
+    if not len(Xshape) == 2:
+        X = X.reshape(Xshape)
+
+    # match sosfilt, only return zi if given zi
+    if returnzi :
+        return X, zi
+    else:
+        return X
+
+
+def _sosfilt_2d_loop(b, a, X, zi):
+    ''' reference in-place direct II transposed sos filter, X=(n_samples,n_signals), zi=(n_sections,2,n_signals) '''
+    n_signals = X.shape[1]
+    n_samples = X.shape[0]
+    n_sections = b.shape[0]
+
     # loop over outputs
     x_n = 0
     for i in range(n_signals):
@@ -738,15 +1022,71 @@ def sosfilt_2d_py(sos,X,axis=-2,zi=None):
                 zi[s, 0, i] = b[s, 1] * x_n - a[s, 0] * X[n, i] + zi[s, 1, i]
                 zi[s, 1, i] = b[s, 2] * x_n - a[s, 1] * X[n, i]
 
-    # back to input shape
-    if not len(Xshape) == 2:
-        X = X.reshape(Xshape)
+def _sosfilt_2d_block(b, a, X, zi):
+    ''' pure-python in-place sos filter, with the same arithmetic as _sosfilt_2d_loop
 
-    # match sosfilt, only return zi if given zi
-    if returnzi :
-        return X, zi
+    As the sections are causal the cascade can be run a whole section at a time for each signal,
+    with the inner loop on python floats rather than numpy scalars.  The data is held in an array.array
+    of the same precision as X, so the rounding on storing the section outputs is also identical.
+    '''
+    tcx = 'f' if X.dtype == np.float32 else 'd'
+    exact_z = zi.dtype == np.float64
+    tcz = 'f' if zi.dtype == np.float32 else 'd'
+    sections = [ bs + as_ for bs, as_ in zip(b.tolist(), a.tolist()) ]
+    for i in range(X.shape[1]):
+        xi = array(tcx, X[:, i].tolist())
+        for s, (b0, b1, b2, a1, a2) in enumerate(sections):
+            if exact_z: # filter state in local python floats
+                z0, z1 = zi[s, :, i].tolist()
+                for n in range(len(xi)):
+                    x = xi[n]
+                    xi[n] = b0 * x + z0
+                    y = xi[n] # N.B. re-read to get the stored precision
+                    z0 = b1 * x - a1 * y + z1
+                    z1 = b2 * x - a2 * y
+                zi[s, 0, i] = z0
+                zi[s, 1, i] = z1
+            else: # filter state rounded to it's storage precision
+                z = array(tcz, zi[s, :, i].tolist())
+                for n in range(len(xi)):
+                    x = xi[n]
+                    xi[n] = b0 * x + z[0]
+                    y = xi[n]
+                    z[0] = b1 * x - a1 * y + z[1]
+                    z[1] = b2 * x - a2 * y
+                zi[s, :, i] = z
+        X[:, i] = xi
+
+def _sosfilt_2d_vec(b, a, X, zi):
+    ''' in-place sos filter vectorized over signals, with the same arithmetic as _sosfilt_2d_loop '''
+    # N.B. 1-element slices so the arithmetic is at the coefficient precision, as for python scalars
+    b0, b1, b2 = b[:, 0:1], b[:, 1:2], b[:, 2:3]
+    a1, a2 = a[:, 0:1], a[:, 1:2]
+    for s in range(b.shape[0]):
+        z0, z1 = zi[s, 0, :], zi[s, 1, :]
+        for n in range(X.shape[0]):
+            x = X[n, :].copy()
+            X[n, :] = b0[s] * x + z0
+            z0[:] = b1[s] * x - a1[s] * X[n, :] + z1
+            z1[:] = b2[s] * x - a2[s] * X[n, :]
+
+def _sosfilt_2d_py_kernel(b, a, X, zi):
+    ''' pick the fastest pure-python kernel, vectorizing over signals for many signals '''
+    if X.shape[1] >= SOSFILT_VEC_MIN_SIGNALS:
+        _sosfilt_2d_vec(b, a, X, zi)
     else:
-        return X
+        _sosfilt_2d_block(b, a, X, zi)
+
+# min number of signals for which vectorizing over signals beats the per-signal python loop
+SOSFILT_VEC_MIN_SIGNALS = 64
+# select the sosfilt_2d_py backend, JIT compiled if numba is available
+try:
+    from numba import njit
+    _sosfilt_2d_kernel = njit(cache=True)(_sosfilt_2d_loop)
+    sosfilt_2d_backend = 'numba'
+except ImportError:
+    _sosfilt_2d_kernel = _sosfilt_2d_py_kernel
+    sosfilt_2d_backend = 'python'
 
 def sosfilt_zi_py(sos):
     ''' compute an initial state for a second-order section filter '''
@@ -793,6 +1133,45 @@ def test_sosfilt_py():
     plt.subplot(413);plt.plot(Xpy[:500,:]);plt.title('Xpy')
     plt.subplot(414);plt.plot(Xsci-Xpy);plt.title('Xsci - Xpy')
 
+def benchmark_sosfilt_2d_py(nchs=(8, 32, 128), fs:float=250, duration_s:float=10, stopband=((45,65),(5.5,25,'bandpass')), order:int=6, dtype=np.float32):
+    """benchmark the throughput of the sosfilt_2d_py backends against scipy's sosfilt
+
+    Args:
+        nchs (tuple, optional): numbers of channels to test. Defaults to (8, 32, 128).
+        fs (float, optional): sample rate of the data. Defaults to 250.
+        duration_s (float, optional): duration of the test data. Defaults to 10.
+        stopband (tuple, optional): filter specification. Defaults to ((45,65),(5.5,25,'bandpass')).
+        order (int, optional): filter order. Defaults to 6.
+        dtype (optional): data type of the test data. Defaults to np.float32.
+    """
+    import time
+    from scipy.signal import sosfilt as sosfilt_scipy
+    sos = iir_sosfilt_sos(stopband, fs, order)
+    print("sosfilt_2d_py backend={} sos={}".format(sosfilt_2d_backend, sos.shape))
+    backends = dict(loop=_sosfilt_2d_loop, block=_sosfilt_2d_block, vec=_sosfilt_2d_vec)
+    if sosfilt_2d_backend == 'numba':
+        backends['numba'] = _sosfilt_2d_kernel
+    for nch in nchs:
+        X = np.cumsum(np.random.standard_normal((int(fs*duration_s), nch)), 0).astype(dtype)
+        zi = np.zeros((sos.shape[0], 2, nch))
+        t0 = time.perf_counter()
+        sosfilt_scipy(sos, X, axis=-2, zi=zi)
+        res = dict(scipy=time.perf_counter()-t0)
+        Xref = None
+        for name, kernel in backends.items():
+            if name == 'loop' and nch > 32:
+                continue # too slow....
+            Xf, zf = X.copy(), zi.copy()
+            t0 = time.perf_counter()
+            kernel(sos[:, :3], sos[:, 4:], Xf, zf)
+            res[name] = time.perf_counter()-t0
+            if Xref is None:
+                Xref = Xf
+            elif not np.array_equal(Xf, Xref):
+                print("Warning: {} output differs!".format(name))
+        print("nch={:4d} : ".format(nch) + "  ".join("{}={:.3g}x realtime".format(k, duration_s/t) for k, t in res.items()))
+
+
 # def butter_py(order,fc,fs,btype,output):
 #     ''' pure python butterworth filter synthesis '''
 #     if fc>=fs/2:
@@ -27,6 +27,11 @@ import struct
 import time
 import socket
 import sys
+try:
+    import numpy as np
+except ImportError:
+    # fall back to the pure-python struct codec, e.g. on micro-controllers / stim-boxes
+    np = None
 
 class UtopiaMessage:
     """
@@ -116,48 +121,62 @@ class RawMessage(UtopiaMessage):
         return S
 
     @classmethod
-    def deserialize(cls, buf):
+    def deserialize(cls, buf, offset:int=0, end:int=None):
         """
         Read a raw message from a byte-buffer, return the read message and the number of bytes used from the bytebuffer, or None, 0 if message is mal-formed
 
         Args:
-            buf (bytes): the byte buffer to read from
+            buf (bytes|bytearray|memoryview): the byte buffer to read from
+            offset (int, optional): start of the message in buf. Defaults to 0.
+            end (int, optional): end of the valid data in buf. Defaults to None, i.e. len(buf).
 
         Returns:
             RawMessage: the decoded raw message
         """        
-        bufsize = len(buf)
+        bufsize = (len(buf) if end is None else end) - offset
         if bufsize < 4:
             print("Buffer too short for header")
             return (None, 0)
-        (msgID, ver, msgsize) = struct.unpack('<BBH', buf[0:4])
+        (msgID, ver, msgsize) = struct.unpack_from('<BBH', buf, offset)
         # read the rest of the message
         if msgsize > 0:
             if bufsize >= 4+msgsize:
-                payload = buf[4:4+msgsize]
+                # N.B. this is the only copy, so the payload is independent of buf
+                payload = bytes(buf[offset+4:offset+4+msgsize])
             else:
                 print("Buffer too short for payload: id:{}, ver:{}, sz:{}".format(chr(msgID), ver, msgsize))
                 return (None, 0)
         else:
-            payload = None
+            payload = b''
         msg=cls(msgID, ver, payload)
         return (msg, 4+msgsize)        
 
     @classmethod
-    def deserializeMany(cls, buf):
+    def deserializeMany(cls, buf, offset:int=0, end:int=None):
         """
         decode multiple RawMessages from the byte-buffer of data, return the length of data consumed.
 
+        Messages are parsed in place from offsets into buf, so buf can be a memoryview
+        onto a larger receive buffer.
+
         Args:
-            buf (bytes): the byte buffer to read from
+            buf (bytes|bytearray|memoryview): the byte buffer to read from
+            offset (int, optional): start of the data in buf. Defaults to 0.
+            end (int, optional): end of the valid data in buf. Defaults to None, i.e. len(buf).
 
         Returns:
             list-of-RawMessage: the list of decoded raw messages
         """        
+        if end is None:
+            end = len(buf)
         msgs=[]
         nconsumed=0
-        while nconsumed < len(buf):            
-            (msg, msgconsumed)=RawMessage.deserialize(buf[nconsumed:])
+        while offset + nconsumed + 4 <= end:
+            # check the message is complete before decoding
+            (msgsize,) = struct.unpack_from('<H', buf, offset + nconsumed + 2)
+            if offset + nconsumed + 4 + msgsize > end:
+                break # bug-out if incomplete message
+            (msg, msgconsumed)=RawMessage.deserialize(buf, offset + nconsumed, end)
             if  msg==None or msgconsumed == 0:
                 break # bug-out if invalid/incomplete message
             msgs.append(msg)
@@ -409,13 +428,15 @@ class DataPacket(UtopiaMessage):
     # Static definitions of the class type constants
     msgID=ord('D')
     msgName="DATAPACKET"
+    # use the numpy codec when numpy is available
+    USE_NUMPY = np is not None
 
     def __init__(self, timestamp=None, samples=None):
         """the DATAPACKET utopia message class  --- which is used to stream raw (time,channels) EEG data packets.
 
         Args:
             timestamp (int, optional): time-stamp for this message. Defaults to None.
-            samples (list-of-lists-of-float, optional): (samples,channels) array of the raw EEG data. Defaults to None.
+            samples (list-of-lists-of-float|np.ndarray, optional): (samples,channels) array of the raw EEG data. Defaults to None.
         """        
         super().__init__(DataPacket.msgID, DataPacket.msgName)
         self.timestamp=timestamp
@@ -425,18 +446,32 @@ class DataPacket(UtopiaMessage):
         """Returns the contents of this event as a byte-stream, ready to send over the network, 
            or None in case of conversion problems.
 
+        Returns:
+            bytes: the encoded message
+        """
+        if not DataPacket.USE_NUMPY:
+            return self.serialize_struct()
+        # N.B. wire format is little-endian float32, (samples,channels) in row-major order
+        samples = np.asarray(self.samples, dtype='<f4')
+        return struct.pack("<ii", int(self.timestamp), len(samples)) + samples.tobytes()
+
+    def serialize_struct(self):
+        """pure-python version of serialize, for use when numpy is not available
+
         Returns:
             bytes: the encoded message
         """
         S = struct.pack("<i", int(self.timestamp)) # timestamp
         S = S + struct.pack("<i", len(self.samples))  # nsamp
-        for tp in self.samples:
-            S = S + struct.pack("<%df"%(len(tp)), *tp)
+        S = S + b''.join([struct.pack("<%df"%(len(tp)), *tp) for tp in self.samples])
         return S
 
     @staticmethod
     def deserialize(buf):
-        """Static method to create a STIMULUSEVENT class from a **PAYLOAD** byte-stream, return created object and the number of bytes consumed from buf
+        """Static method to create a DATAPACKET class from a **PAYLOAD** byte-stream, return created object and the number of bytes consumed from buf
+
+        Note: when numpy is available samples is a (nsamp,nch) float32 array which is a 
+        read-only view on buf, i.e. no copy is made.
 
         Args:
             buf (bytes): the message buffer
@@ -449,17 +484,17 @@ class DataPacket(UtopiaMessage):
         if bufsize < 8:
             return (None, 0)
         timestamp, nsamp = struct.unpack("<ii", buf[0:8])
-        nch=int((bufsize-8)/(nsamp*4))
-        samples=[]
-        for t in range(nsamp):
-            sampt=struct.unpack_from("<%df"%(nch), buf, 8+t*4*nch)
-            samples.append(sampt)
+        nch = (bufsize-8)//(nsamp*4) if nsamp > 0 else 0
+        if DataPacket.USE_NUMPY:
+            samples = np.frombuffer(buf, dtype='<f4', count=nsamp*nch, offset=8).reshape((nsamp, nch))
+        else:
+            samples = [struct.unpack_from("<%df"%(nch), buf, 8+t*4*nch) for t in range(nsamp)]
         msg=DataPacket(timestamp, samples)
-        return (msg, 8+nsamp*nch*8)
+        return (msg, 8+nsamp*nch*4)
 
     def __str__(self):
         ss="%c(%d) %s %i "%(self.msgID, self.msgID, self.msgName, self.timestamp)
-        ss= ss+ "[%dx%d]"%(len(self.samples), len(self.samples[0]))
+        ss= ss+ "[%dx%d]"%(len(self.samples), len(self.samples[0]) if len(self.samples)>0 else 0)
         for chs in self.samples:
             chstr = "".join(["%f, "%(c) for c in chs])
             ss = ss + "["+chstr+"]"
@@ -1019,6 +1054,7 @@ class UtopiaClient:
     HEARTBEATINTERVAL_ms=1000
     HEARTBEATINTERVALUDP_ms=200
     MAXMESSAGESIZE = 1024 * 1024
+    RECVBUFSIZE = 4 * MAXMESSAGESIZE
 
     def __init__(self, clientstate=None):
         """Class for managing a client connection to a UtopiaServer
@@ -1029,7 +1065,10 @@ class UtopiaClient:
         self.isConnected = False
         self.sock = []
         self.udpsock=None
-        self.recvbuf = b''
+        # receive buffer, valid data is in recvbuf[recvbufstart:recvbufend]
+        self.recvbuf = bytearray(self.RECVBUFSIZE)
+        self.recvbufstart = 0
+        self.recvbufend = 0
         self.tsClock = TimeStampClock()
         self.sendHeartbeats = True
         self.nextHeartbeatTime = self.getTimeStamp()
@@ -1285,6 +1324,58 @@ class UtopiaClient:
                 print("Socket error" + str(ex) + "#" + str(ex.errno) ) 
         return bytes(data)
     
+    def recvall_into(self, timeout_ms=0):
+        """Read all the data from the socket directly into the receive buffer immeaditely or block for timeout_ms if nothing to do.
+
+        Args:
+            timeout_ms (int, optional): timeout in milliseconds for the read. Defaults to 0.
+
+        Returns:
+            int: the number of new bytes added to the receive buffer
+        """
+        if timeout_ms>0:
+            self.sock.setblocking(1)
+            self.sock.settimeout(timeout_ms/1000.0)
+        else:
+            self.sock.setblocking(0)
+        nrecv = 0
+        while nrecv < self.RECVBUFSIZE: # bound the work per call
+            self.reserve_recvbuf(self.MAXMESSAGESIZE)
+            try:
+                with memoryview(self.recvbuf) as mv:
+                    n = self.sock.recv_into(mv[self.recvbufend:])
+            except socket.timeout:
+                break
+            except socket.error as ex:
+                if not ( ex.errno == 11 or ex.errno == 10035 or ex.errno==35 ): # 11 is raised when no-data to read
+                    print("Socket error" + str(ex) + "#" + str(ex.errno) ) 
+                break
+            if n == 0: # connection closed
+                break
+            self.recvbufend = self.recvbufend + n
+            nrecv = nrecv + n
+            # only block for the first read, then drain whatever else is waiting
+            if timeout_ms>0:
+                self.sock.setblocking(0)
+        return nrecv
+
+    def reserve_recvbuf(self, nfree:int):
+        """ensure there is at least nfree bytes free at the end of the receive buffer, 
+        by moving the un-consumed data to the front or growing the buffer
+
+        Args:
+            nfree (int): the number of free bytes required
+        """        
+        if len(self.recvbuf) - self.recvbufend >= nfree:
+            return
+        nvalid = self.recvbufend - self.recvbufstart
+        if len(self.recvbuf) - nvalid < nfree: # grow, amortized doubling
+            self.recvbuf.extend(bytes(max(len(self.recvbuf), nvalid + nfree - len(self.recvbuf))))
+        # move the (small) un-consumed part to the front of the buffer
+        self.recvbuf[:nvalid] = self.recvbuf[self.recvbufstart:self.recvbufend]
+        self.recvbufstart = 0
+        self.recvbufend = nvalid
+
     def getNewMessages(self, timeout_ms=250):
         """Wait for new messages from the utopia-server (with optional timeout), decode them and return the list of new messages
 
@@ -1294,13 +1385,15 @@ class UtopiaClient:
         Returns:
             list-of-UtopiaMessage: the list of recieved messages
         """   
-        # get all the data in the socket
-        buf = self.recvall(timeout_ms)
-        # append to the receive buffer
-        self.recvbuf = self.recvbuf + buf
-        # decode all the new messages to RawMessage
-        (newmessages, nconsumed) = RawMessage.deserializeMany(self.recvbuf)
-        self.recvbuf = self.recvbuf[nconsumed:] # remove the consumed part of the buffer
+        # get all the data in the socket, directly into the receive buffer
+        self.recvall_into(timeout_ms)
+        # decode all the new messages to RawMessage, in place in the receive buffer
+        (newmessages, nconsumed) = RawMessage.deserializeMany(self.recvbuf, self.recvbufstart, self.recvbufend)
+        # mark the consumed part of the buffer as free
+        self.recvbufstart = self.recvbufstart + nconsumed
+        if self.recvbufstart == self.recvbufend:
+            self.recvbufstart = 0
+            self.recvbufend = 0
         # decode the RawMessages to actual messages
         newmessages = decodeRawMessages(newmessages)
         self.sendHeartbeatIfTimeout()
@@ -1419,7 +1512,7 @@ def testSerialization():
 
     srhb=rhb.serialize()
     print("serialized   : %s"%(srhb))
-    dsrhb, =RawMessage.deserialize(srhb)
+    dsrhb, _ =RawMessage.deserialize(srhb)
     print("Deserialized serialized Raw(Heartbeat): %s"%(dsrhb))
     sedsrhb=decodeRawMessage(dsrhb)
     print("Decoded deserialized Raw(Heartbeat): %s"%(sedsrhb))
@@ -1442,6 +1535,79 @@ def testSerialization():
 
 
 
+def testDataPacketSpeed(nch=32, nsamp=20, npkt=5000):
+    """micro-benchmark the DataPacket codec, comparing the struct and numpy implementations
+
+    Args:
+        nch (int, optional): number of channels per sample. Defaults to 32.
+        nsamp (int, optional): number of samples per packet. Defaults to 20.
+        npkt (int, optional): number of packets to encode/decode. Defaults to 5000.
+    """    
+    import random
+    samples = [[random.random() for c in range(nch)] for t in range(nsamp)]
+    # get the reference wire format from the struct codec
+    DataPacket.USE_NUMPY = False
+    ref = DataPacket(10, samples).serialize()
+
+    for use_numpy in ((False, True) if np is not None else (False,)):
+        DataPacket.USE_NUMPY = use_numpy
+        dp = DataPacket(10, np.array(samples, dtype=np.float32) if use_numpy else samples)
+        S = dp.serialize()
+        assert S == ref, "serialize not byte-compatible with the struct wire format"
+        t0 = time.perf_counter()
+        for i in range(npkt):
+            dp.serialize()
+        tser = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        for i in range(npkt):
+            DataPacket.deserialize(S)
+        tdes = time.perf_counter() - t0
+        print("%s: serialize %8.0f pkt/s  deserialize %8.0f pkt/s  (%dx%d)"%("numpy " if use_numpy else "struct",
+              npkt/tser, npkt/tdes, nsamp, nch))
+    DataPacket.USE_NUMPY = np is not None
+
+
+def testRecvBuffer(nmsg=50000, blksize=4096):
+    """test the in-place receive buffer parsing by feeding a fake socket in blocks of arbitrary size
+
+    Args:
+        nmsg (int, optional): number of messages to send. Defaults to 50000.
+        blksize (int, optional): size of the blocks returned by the fake socket. Defaults to 4096.
+    """    
+    msgs = [StimulusEvent(i, [0, 1, 2], [i%2, 1, 0]) if i%3 else DataPacket(i, [[.1, .2, .3]]*5) for i in range(nmsg)]
+    stream = b''.join([RawMessage.fromUtopiaMessage(m).serialize() for m in msgs])
+
+    class FakeSocket:
+        def __init__(self, stream, blksize):
+            self.stream = memoryview(stream)
+            self.pos = 0
+            self.blksize = blksize
+        def setblocking(self, flag): pass
+        def settimeout(self, timeout): pass
+        def recv_into(self, buf):
+            if self.pos >= len(self.stream):
+                raise socket.timeout()
+            n = min(len(buf), self.blksize, len(self.stream)-self.pos)
+            buf[:n] = self.stream[self.pos:self.pos+n]
+            self.pos = self.pos + n
+            return n
+
+    client = UtopiaClient()
+    client.sendHeartbeats = False
+    client.sock = FakeSocket(stream, blksize)
+    t0 = time.perf_counter()
+    recvd = []
+    while True:
+        newmsgs = client.getNewMessages(0)
+        if len(newmsgs) == 0:
+            break
+        recvd.extend(newmsgs)
+    t = time.perf_counter() - t0
+    assert len(recvd) == len(msgs), "lost messages"
+    assert all(r.timestamp == m.timestamp for r, m in zip(recvd, msgs)), "corrupted messages"
+    print("Recv %d msgs / %d bytes in %fs = %8.0f msg/s"%(len(recvd), len(stream), t, len(recvd)/t))
+
+
 def testSending():
     """test object sending by connecting and sending a set of test messages to the server
     """    